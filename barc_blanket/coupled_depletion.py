@@ -5,6 +5,7 @@ import numpy as np
 from models.barc_model_simple_toroidal import make_model
 from materials.blanket_depletion import gw_to_neutron_rate
 from utilities import CROSS_SECTIONS, CHAIN_FILE
+from depletion_chain import reduced_chain_file
 
 openmc.config['cross_sections'] = CROSS_SECTIONS
 openmc.config['chain_file'] = CHAIN_FILE
@@ -28,8 +29,7 @@ source_rates = np.ones_like(timesteps)*neutron_rate
 # Setup CoupledOperator class 
 
 op = openmc.deplete.CoupledOperator(model, 
-                                    reduce_chain=True, 
-                                    reduce_chain_level=3, 
+                                    chain_file=reduced_chain_file(model.geometry.get_all_materials().values(), 3),
                                     normalization_mode='source-rate')
 
 # Set output directory 
@@ -0,0 +1,73 @@
+import os
+import hashlib
+
+import openmc
+import openmc.deplete
+
+from barc_blanket.utilities import file_fingerprint, cache_directory, atomic_write
+
+# Reduced chains shared by every run, see reduced_chain_file
+CHAIN_CACHE_DIRECTORY = cache_directory('reduced_chains', 'BARC_CHAIN_CACHE')
+
+def depletable_nuclides(materials):
+    """Get the set of nuclides in the depletable materials,
+    which is what openmc.deplete operators reduce the chain from
+
+    Parameters
+    ----------
+    materials : iterable of openmc.Material
+        Materials to get the nuclides from
+
+    Returns
+    -------
+    nuclides : set of str
+        Names of the nuclides in any depletable material
+    """
+
+    nuclides = set()
+    for material in materials:
+        if material.depletable:
+            nuclides.update(material.get_nuclides())
+    return nuclides
+
+def reduced_chain_file(materials, reduce_chain_level, chain_file=None, cache_directory=CHAIN_CACHE_DIRECTORY):
+    """Get a chain file reduced to what the depletable materials can reach, only reducing the chain
+    the first time a set of nuclides and level is seen
+
+    Pass the returned file as chain_file to an operator with reduce_chain=False,
+    instead of reduce_chain=True and reduce_chain_level, so the full chain isn't parsed every time.
+
+    Parameters
+    ----------
+    materials : iterable of openmc.Material
+        Materials to be depleted
+    reduce_chain_level : int
+        Depth of the search for nuclides to keep, as in openmc.deplete.Chain.reduce
+    chain_file : str, optional
+        Full chain file to reduce. Default is openmc.config['chain_file']
+    cache_directory : str, optional
+        Directory to keep the reduced chains in
+
+    Returns
+    -------
+    path : str
+        Path to the reduced chain file
+    """
+
+    if chain_file is None:
+        chain_file = openmc.config['chain_file']
+
+    nuclides = sorted(depletable_nuclides(materials))
+
+    hasher = hashlib.sha256()
+    hasher.update(file_fingerprint(chain_file).encode())
+    hasher.update(repr((nuclides, reduce_chain_level)).encode())
+    path = os.path.join(cache_directory, f"chain_{hasher.hexdigest()[:16]}.xml")
+
+    if not os.path.exists(path):
+        chain = openmc.deplete.Chain.from_xml(chain_file)
+        reduced_chain = chain.reduce(nuclides, reduce_chain_level)
+        with atomic_write(path) as temporary_path:
+            reduced_chain.export_to_xml(temporary_path)
+
+    return path
@@ -0,0 +1,168 @@
+import csv
+import json
+import time
+import resource
+from functools import lru_cache
+from contextlib import contextmanager
+
+# Written next to 'depletion_results.h5', with '.json' and '.csv' extensions
+PERFORMANCE_FILE = "depletion_performance"
+
+STEP_FIELDS = ['step', 'dt_seconds', 'source_rate',
+               'transport_seconds', 'depletion_seconds', 'write_seconds', 'step_seconds',
+               'transport_calls', 'particles_per_second',
+               'peak_memory_mb', 'peak_children_memory_mb']
+
+def _peak_memory_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+class DepletionProfiler:
+    """Records where the time goes in a depletion run, step by step
+
+    Setup phases like chain reduction are timed with the phase context manager, and each step is
+    split into transport (evaluating the operator, which is a transport solve for a coupled operator),
+    depletion (the CRAM solves) and writing the step to 'depletion_results.h5', which is whatever is left over.
+
+    Parameters
+    ----------
+    particles_per_transport : int, optional
+        Particles simulated in each transport solve, to work out the particle rate
+    """
+
+    def __init__(self, particles_per_transport=None):
+        self.particles_per_transport = particles_per_transport
+        self.setup = {}
+        self.steps = []
+        self.final_seconds = None
+        self._current = None
+        self._step_start = None
+
+    @contextmanager
+    def phase(self, name):
+        """Time a setup phase, adding to the time of any earlier phase with the same name"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.setup[name] = self.setup.get(name, 0.0) + time.perf_counter() - start_time
+
+    def start_step(self, dt, source_rate):
+        self._current = {'step': len(self.steps),
+                         'dt_seconds': float(dt),
+                         'source_rate': float(source_rate),
+                         'transport_seconds': 0.0,
+                         'depletion_seconds': 0.0,
+                         'transport_calls': 0}
+        self._step_start = time.perf_counter()
+
+    def add(self, name, value):
+        """Add to a time or count of the current step"""
+        if self._current is not None:
+            self._current[name] += value
+
+    def end_step(self):
+        step = self._current
+        step['step_seconds'] = time.perf_counter() - self._step_start
+        step['write_seconds'] = max(step['step_seconds'] - step['transport_seconds'] - step['depletion_seconds'], 0.0)
+
+        if self.particles_per_transport is not None and step['transport_seconds'] > 0.0:
+            step['particles_per_second'] = step['transport_calls'] * self.particles_per_transport / step['transport_seconds']
+        else:
+            step['particles_per_second'] = None
+
+        step['peak_memory_mb'] = _peak_memory_mb()
+        step['peak_children_memory_mb'] = _peak_memory_mb(resource.RUSAGE_CHILDREN)
+
+        self.steps.append(step)
+        self._current = None
+
+    def summary(self):
+        """Totals of each phase over the whole run"""
+        totals = {name: sum(step[name] for step in self.steps)
+                  for name in ['transport_seconds', 'depletion_seconds', 'write_seconds', 'step_seconds']}
+        totals['setup_seconds'] = sum(self.setup.values())
+        totals['final_seconds'] = self.final_seconds or 0.0
+        totals['total_seconds'] = totals['setup_seconds'] + totals['step_seconds'] + totals['final_seconds']
+        totals['steps'] = len(self.steps)
+        totals['peak_memory_mb'] = max([step['peak_memory_mb'] for step in self.steps], default=_peak_memory_mb())
+        totals['peak_children_memory_mb'] = max([step['peak_children_memory_mb'] for step in self.steps], default=0.0)
+        return totals
+
+    def write(self, path=PERFORMANCE_FILE):
+        """Write the setup phases, steps and summary to '<path>.json' and the steps to '<path>.csv'"""
+        with open(f"{path}.json", 'w') as f:
+            json.dump({'setup': self.setup, 'steps': self.steps, 'summary': self.summary()}, f, indent=2)
+
+        with open(f"{path}.csv", 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=STEP_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.steps)
+
+    def print_summary(self):
+        totals = self.summary()
+        total = totals['total_seconds']
+        print(f"Depletion took {total:0.1f} s over {totals['steps']} steps")
+        for name, seconds in self.setup.items():
+            print(f"    {name}: {seconds:0.1f} s ({100*seconds/total:0.1f}%)")
+        for name in ['transport', 'depletion', 'write']:
+            seconds = totals[f'{name}_seconds']
+            print(f"    {name}: {seconds:0.1f} s ({100*seconds/total:0.1f}%)")
+        print(f"    final transport and write: {totals['final_seconds']:0.1f} s ({100*totals['final_seconds']/total:0.1f}%)")
+        particle_rates = [step['particles_per_second'] for step in self.steps if step['particles_per_second'] is not None]
+        if len(particle_rates) > 0:
+            print(f"    mean particle rate: {sum(particle_rates)/len(particle_rates):0.4g} particles/s")
+        print(f"    peak memory: {totals['peak_memory_mb']:0.0f} MB, depletion processes {totals['peak_children_memory_mb']:0.0f} MB")
+
+class _ProfiledIntegrator:
+    """Mixin for openmc.deplete integrators that reports the time of each part of a step to a DepletionProfiler"""
+
+    def __init__(self, *args, profiler, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._profiler = profiler
+
+    def __iter__(self):
+        # The integrate loop solves each step before asking for the next one
+        started = False
+        for dt, source_rate in super().__iter__():
+            if started:
+                self._profiler.end_step()
+            self._profiler.start_step(dt, source_rate)
+            started = True
+            yield dt, source_rate
+        if started:
+            self._profiler.end_step()
+
+    def _get_bos_data_from_operator(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        result = super()._get_bos_data_from_operator(*args, **kwargs)
+        self._profiler.add('transport_seconds', time.perf_counter() - start_time)
+        self._profiler.add('transport_calls', 1)
+        return result
+
+    def _timed_deplete(self, *args, **kwargs):
+        result = super()._timed_deplete(*args, **kwargs)
+        self._profiler.add('depletion_seconds', result[0])
+        return result
+
+    def __call__(self, *args, **kwargs):
+        # Anything but depletion in a step is an operator evaluation, e.g. the CE/CM middle of step transport
+        start_time = time.perf_counter()
+        depletion_before = self._profiler._current['depletion_seconds']
+        result = super().__call__(*args, **kwargs)
+        depletion_seconds = self._profiler._current['depletion_seconds'] - depletion_before
+        self._profiler.add('transport_seconds', time.perf_counter() - start_time - depletion_seconds)
+        self._profiler.add('transport_calls', len(result[2]))
+        return result
+
+    def integrate(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        super().integrate(*args, **kwargs)
+        total_seconds = time.perf_counter() - start_time
+        self._profiler.final_seconds = total_seconds - sum(step['step_seconds'] for step in self._profiler.steps)
+
+@lru_cache(maxsize=None)
+def profiled(integrator_class):
+    """Subclass of an openmc.deplete integrator that takes a profiler keyword argument
+    and reports to it, e.g. profiled(openmc.deplete.CECMIntegrator)(operator, timesteps, profiler=profiler)"""
+    return type(f"Profiled{integrator_class.__name__}", (_ProfiledIntegrator, integrator_class), {})
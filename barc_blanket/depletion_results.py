@@ -0,0 +1,574 @@
+import h5py
+import numpy as np
+import scipy.sparse as sp
+
+import openmc
+import openmc.data
+import openmc.stats
+from openmc.deplete.stepresult import VERSION_RESULTS
+
+SECONDS_PER_DAY = 24*60*60
+
+# Layout of the 'depletion_results.h5' file written by openmc.deplete:
+#   number         (steps, stages, materials, nuclides) atoms of each nuclide
+#   time           (steps, 2) start and end of each step in seconds
+#   source_rate    (steps, stages)
+#   materials/<id> attributes 'index' and 'volume'
+#   nuclides/<nuc> attribute 'atom number index'
+#   eigenvalues    (steps, stages, 2), 'depletion time' (steps,) and the 'reactions' group
+#                  are also needed for openmc.deplete.Results to read the file
+#
+# Compact files written by compact_results have the same 'time', 'source_rate' and 'materials', and
+#   tracked_number    (steps, materials, tracked nuclides) atoms of the tracked nuclides
+#   checkpoint_number (checkpoints, materials, nuclides) atoms of every nuclide at the checkpoints
+#   checkpoint_steps  (checkpoints,) index of the step of each checkpoint
+#   nuclides/<nuc>    attribute 'atom number index', and 'tracked index' if it is tracked
+# both chunked by material and step and compressed, so reading one material only reads its chunks
+
+def read_material_atoms(material_id, path="depletion_results.h5"):
+    """Read the atoms of every nuclide in one material at every timestep,
+    slicing only that material out of the results file instead of rebuilding every material.
+
+    Parameters
+    ----------
+    material_id : int or str
+        ID of the depleted material
+    path : str, optional
+        Path to the depletion results file
+
+    Returns
+    -------
+    times : numpy.ndarray
+        Start time of each step in seconds
+    nuclides : list of str
+        Names of the nuclides, in the same order as the last axis of atoms
+    atoms : numpy.ndarray
+        Number of atoms of each nuclide at each step, shape (steps, nuclides)
+    volume : float
+        Volume of the material in cm3
+    """
+
+    with h5py.File(path, 'r') as f:
+        material_group = f['materials'][str(material_id)]
+        material_index = material_group.attrs['index']
+        volume = float(material_group.attrs['volume'])
+
+        nuclides, atoms = _read_atoms(f, material_index)
+        times = f['time'][:, 0]
+
+    return times, nuclides, atoms, volume
+
+def _read_atoms(f, material_index=slice(None)):
+    """Nuclide names and atoms at every step from an open results file, full or compact.
+    Compact files only give the tracked nuclides."""
+
+    if 'tracked_number' in f:
+        tracked_indices = {nuclide: group.attrs['tracked index'] for nuclide, group in f['nuclides'].items()
+                           if 'tracked index' in group.attrs}
+        nuclides = sorted(tracked_indices, key=tracked_indices.get)
+        atoms = f['tracked_number'][:, material_index, :]
+    else:
+        nuclide_indices = {nuclide: group.attrs['atom number index'] for nuclide, group in f['nuclides'].items()}
+        nuclides = sorted(nuclide_indices, key=nuclide_indices.get)
+        # Beginning of step values are stored in the first stage
+        atoms = f['number'][:, 0, material_index, :]
+
+    return nuclides, atoms
+
+def read_checkpoint_atoms(material_id, path):
+    """Read the atoms of every nuclide in one material at the checkpoints of a compact results file
+
+    Parameters
+    ----------
+    material_id : int or str
+        ID of the depleted material
+    path : str
+        Path to the compact results file
+
+    Returns
+    -------
+    times : numpy.ndarray
+        Time of each checkpoint in seconds
+    nuclides : list of str
+        Names of the nuclides, in the same order as the last axis of atoms
+    atoms : numpy.ndarray
+        Number of atoms of each nuclide at each checkpoint, shape (checkpoints, nuclides)
+    volume : float
+        Volume of the material in cm3
+    """
+
+    with h5py.File(path, 'r') as f:
+        material_group = f['materials'][str(material_id)]
+        material_index = material_group.attrs['index']
+        volume = float(material_group.attrs['volume'])
+
+        nuclide_indices = {nuclide: group.attrs['atom number index'] for nuclide, group in f['nuclides'].items()}
+        nuclides = sorted(nuclide_indices, key=nuclide_indices.get)
+
+        checkpoint_steps = f['checkpoint_steps'][()]
+        atoms = f['checkpoint_number'][:, material_index, :]
+        times = f['time'][:, 0][checkpoint_steps]
+
+    return times, nuclides, atoms, volume
+
+def available_cross_section_nuclides(cross_sections=None):
+    """Get the set of nuclides that have neutron cross sections in a library
+
+    Parameters
+    ----------
+    cross_sections : str, optional
+        Path to cross_sections.xml. Default is openmc.config['cross_sections']
+
+    Returns
+    -------
+    nuclides : set of str
+        Nuclides with neutron data
+    """
+
+    if cross_sections is None:
+        cross_sections = openmc.config['cross_sections']
+
+    library = openmc.data.DataLibrary.from_xml(cross_sections)
+    nuclides = set()
+    for entry in library.libraries:
+        if entry['type'] == 'neutron':
+            nuclides.update(entry['materials'])
+
+    return nuclides
+
+def material_from_atoms(nuclides, atoms, volume, material_id=None, nuc_with_data=None):
+    """Create a material from the atoms of each nuclide, the same way
+    openmc.deplete.Results.export_to_materials fills in a depleted material
+
+    Parameters
+    ----------
+    nuclides : list of str
+        Names of the nuclides
+    atoms : numpy.ndarray
+        Number of atoms of each nuclide
+    volume : float
+        Volume of the material in cm3
+    material_id : int, optional
+        ID to give the new material
+    nuc_with_data : set of str, optional
+        If provided, only these nuclides are added (e.g. those with cross sections)
+
+    Returns
+    -------
+    material : openmc.Material
+        Material with the given composition and volume
+    """
+
+    material = openmc.Material(material_id=material_id)
+    material.volume = volume
+
+    for nuclide, nuclide_atoms in zip(nuclides, atoms):
+        if nuc_with_data is not None and nuclide not in nuc_with_data:
+            continue
+        if nuclide_atoms > 0.0:
+            atoms_per_barn_cm = 1e-24 * nuclide_atoms / volume
+            material.add_nuclide(nuclide, atoms_per_barn_cm)
+
+    material.set_density('sum')
+
+    return material
+
+def split_results_by_material(path, outputs):
+    """Split a depletion results file with several materials into one file per material,
+    each with the same layout as if that material had been depleted on its own
+
+    Parameters
+    ----------
+    path : str
+        Path to the depletion results file to split
+    outputs : dict
+        Maps the ID of each material to split out to a tuple of
+        (path of the new results file, ID to give the material in the new file)
+    """
+
+    # Datasets with a material axis, which is always the third
+    per_material_datasets = ['number', 'reaction rates']
+
+    with h5py.File(path, 'r') as source:
+        for material_id, (output_path, new_material_id) in outputs.items():
+            material_group = source['materials'][str(material_id)]
+            material_index = material_group.attrs['index']
+
+            with h5py.File(output_path, 'w') as destination:
+                for key, value in source.attrs.items():
+                    destination.attrs[key] = value
+
+                for name, item in source.items():
+                    if isinstance(item, h5py.Group):
+                        continue
+                    if name in per_material_datasets:
+                        data = item[:, :, material_index:material_index+1, ...]
+                    else:
+                        data = item[()]
+                    destination.create_dataset(name, data=data)
+
+                for group_name in ['nuclides', 'reactions']:
+                    if group_name in source:
+                        source.copy(source[group_name], destination, name=group_name)
+
+                new_material_group = destination.create_group('materials').create_group(str(new_material_id))
+                new_material_group.attrs['index'] = 0
+                new_material_group.attrs['volume'] = material_group.attrs['volume']
+
+def write_results(path, times, material_ids, volumes, nuclides, atoms):
+    """Write atoms of each nuclide in each material at each time to a file
+    that openmc.deplete.Results can read, without any transport or reaction rates
+
+    Parameters
+    ----------
+    path : str
+        Path to the depletion results file to write
+    times : numpy.ndarray
+        Time of each step in seconds
+    material_ids : list of int or str
+        IDs of the materials
+    volumes : list of float
+        Volume of each material in cm3
+    nuclides : list of str
+        Names of the nuclides, in the same order as the last axis of atoms
+    atoms : numpy.ndarray
+        Number of atoms of each nuclide, shape (steps, materials, nuclides)
+    """
+
+    times = np.asarray(times, dtype=float)
+    n_steps = len(times)
+
+    with h5py.File(path, 'w') as f:
+        f.attrs['filetype'] = np.bytes_(b'depletion results')
+        f.attrs['version'] = VERSION_RESULTS
+
+        # A single stage per step, as if from a predictor integrator
+        f.create_dataset('number', data=np.asarray(atoms, dtype=float)[:, np.newaxis, :, :])
+        f.create_dataset('time', data=np.column_stack([times, np.append(times[1:], times[-1])]))
+        f.create_dataset('source_rate', data=np.zeros((n_steps, 1)))
+        f.create_dataset('eigenvalues', data=np.zeros((n_steps, 1, 2)))
+        f.create_dataset('depletion time', data=np.zeros(n_steps))
+
+        materials_group = f.create_group('materials')
+        for i, (material_id, volume) in enumerate(zip(material_ids, volumes)):
+            material_group = materials_group.create_group(str(material_id))
+            material_group.attrs['index'] = i
+            material_group.attrs['volume'] = volume
+
+        nuclides_group = f.create_group('nuclides')
+        for i, nuclide in enumerate(nuclides):
+            nuclides_group.create_group(nuclide).attrs['atom number index'] = i
+
+        f.create_group('reactions')
+
+class DepletionResultsView:
+    """Read-only view of a depletion results file that reads it once and computes
+    atoms, activity, decay heat and decay photon spectra for every material together.
+    Each quantity is computed on first use and cached.
+
+    Decay data comes from openmc.config['chain_file'], the same as openmc.deplete.Results.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the depletion results file
+    """
+
+    def __init__(self, path="depletion_results.h5"):
+        with h5py.File(path, 'r') as f:
+            self._material_indices = {material_id: int(group.attrs['index']) for material_id, group in f['materials'].items()}
+            self.volumes = {material_id: float(group.attrs['volume']) for material_id, group in f['materials'].items()}
+            # HDF5 sorts the groups by name, so "10" comes before "2"
+            self.material_ids = sorted(self._material_indices, key=self._material_indices.get)
+
+            # Only the tracked nuclides for compact files
+            self.nuclides, self._atoms = _read_atoms(f)
+            self.times = f['time'][:, 0]
+
+        self._nuclide_indices = {nuclide: i for i, nuclide in enumerate(self.nuclides)}
+        self._cache = {}
+
+    def _cached(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    def material_index(self, material):
+        """Index of a material in the results, from its ID or the openmc.Material itself"""
+        if isinstance(material, openmc.Material):
+            material = material.id
+        return self._material_indices[str(material)]
+
+    def atoms(self, material):
+        """Atoms of every nuclide at every step, shape (steps, nuclides)"""
+        return self._atoms[:, self.material_index(material), :]
+
+    def nuclide_atoms(self, material, nuclides):
+        """Atoms of some nuclides at every step, as a dict of arrays"""
+        material_atoms = self.atoms(material)
+        return {nuclide: material_atoms[:, self._nuclide_indices[nuclide]] for nuclide in nuclides}
+
+    @property
+    def decay_constants(self):
+        """Decay constant of each nuclide in 1/s"""
+        return self._cached('decay_constants',
+                            lambda: np.array([openmc.data.decay_constant(nuclide) for nuclide in self.nuclides]))
+
+    @property
+    def decay_energies(self):
+        """Decay energy of each nuclide in eV"""
+        return self._cached('decay_energies',
+                            lambda: np.array([openmc.data.decay_energy(nuclide) for nuclide in self.nuclides]))
+
+    @property
+    def activities(self):
+        """Activity of every material at every step in Bq, shape (steps, materials)"""
+        return self._cached('activities', lambda: self._atoms @ self.decay_constants)
+
+    @property
+    def decay_heats(self):
+        """Decay heat of every material at every step in W, shape (steps, materials)"""
+        return self._cached('decay_heats',
+                            lambda: self._atoms @ (self.decay_constants * self.decay_energies) * openmc.data.JOULE_PER_EV)
+
+    def activity(self, material, units='Bq'):
+        """Activity of a material at every step in Bq, or in Bq/cm3 with units='Bq/cm3'
+        like openmc.deplete.Results.get_activity"""
+        activity = self.activities[:, self.material_index(material)]
+        if units == 'Bq/cm3':
+            return activity / self.volumes[self.material_ids[self.material_index(material)]]
+        if units != 'Bq':
+            raise ValueError(f"Unknown activity units {units}, use 'Bq' or 'Bq/cm3'")
+        return activity
+
+    def decay_heat(self, material):
+        """Decay heat of a material at every step in W"""
+        return self.decay_heats[:, self.material_index(material)]
+
+    @property
+    def photon_lines(self):
+        """Common energy grid and per-atom line intensity matrix of every nuclide, see photon_line_matrix"""
+        return self._cached('photon_lines', lambda: photon_line_matrix(self.nuclides))
+
+    def photon_intensities(self, material):
+        """Decay photon intensity of a material on the common energy grid at every step,
+        in photons/s, shape (steps, energies)"""
+        index = self.material_index(material)
+        _, line_matrix = self.photon_lines
+        return self._cached(('photon_intensities', index),
+                            lambda: (line_matrix @ self._atoms[:, index, :].T).T)
+
+    def decay_photon_energies(self, material, clip_tolerance=1e-6):
+        """Decay photon energy distribution of a material at every step,
+        with the intensity of each line in photons/s, or None where there are no photons
+
+        Like openmc.Material.get_decay_photon_energy, the weakest lines holding
+        clip_tolerance of the total photon energy are dropped."""
+        energies, _ = self.photon_lines
+        distributions = []
+        for step_intensities in self.photon_intensities(material):
+            emitted = step_intensities > 0.0
+            if np.any(emitted):
+                distribution = openmc.stats.Discrete(energies[emitted], step_intensities[emitted])
+                distribution.clip(clip_tolerance, inplace=True)
+                distributions.append(distribution)
+            else:
+                distributions.append(None)
+        return distributions
+
+def strip_nan_steps(times, values):
+    """Remove the steps where values is NaN, shifting times to start at 0
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        Time of each step
+    values : numpy.ndarray
+        Value at each step
+
+    Returns
+    -------
+    times : numpy.ndarray
+        Times of the steps with a value, starting at 0
+    values : numpy.ndarray
+        Values that aren't NaN
+    """
+
+    valid = ~np.isnan(values)
+    valid_times = np.asarray(times)[valid]
+    return valid_times - valid_times[0], np.asarray(values)[valid]
+
+def photon_line_matrix(nuclides):
+    """Decay photon line intensity of each nuclide per atom, on an energy grid common to all of them,
+    so the spectrum of any composition is a single matrix product with its atoms
+
+    Continuous parts of a spectrum are put on the grid as a line at the middle of each histogram bin.
+
+    Parameters
+    ----------
+    nuclides : list of str
+        Names of the nuclides, in the order of the columns of the matrix
+
+    Returns
+    -------
+    energies : numpy.ndarray
+        Photon energies in eV, sorted
+    matrix : scipy.sparse.csr_matrix
+        Intensity in photons/s/atom of each energy from each nuclide, shape (energies, nuclides)
+    """
+
+    columns = []
+    line_energies = []
+    line_intensities = []
+    for j, nuclide in enumerate(nuclides):
+        source = openmc.data.decay_photon_energy(nuclide)
+        if source is None:
+            continue
+        for energy, intensity in _photon_lines(source):
+            columns.append(j)
+            line_energies.append(energy)
+            line_intensities.append(intensity)
+
+    energies, rows = np.unique(line_energies, return_inverse=True)
+
+    # Duplicate entries are summed
+    matrix = sp.csr_matrix((line_intensities, (rows, columns)), shape=(len(energies), len(nuclides)))
+
+    return energies, matrix
+
+def _photon_lines(distribution, scale=1.0):
+    """Flatten a decay photon distribution into (energy, intensity) pairs"""
+    if isinstance(distribution, openmc.stats.Discrete):
+        return [(x, scale * p) for x, p in zip(distribution.x, distribution.p)]
+    if isinstance(distribution, openmc.stats.Mixture):
+        lines = []
+        for probability, component in zip(distribution.probability, distribution.distribution):
+            lines.extend(_photon_lines(component, scale * probability))
+        return lines
+    if isinstance(distribution, openmc.stats.Tabular):
+        # Treated as histogram bins, so each bin's intensity is p * width
+        widths = np.diff(distribution.x)
+        midpoints = distribution.x[:-1] + widths / 2
+        return [(x, scale * p * width) for x, p, width in zip(midpoints, distribution.p[:-1], widths)]
+    raise TypeError(f"Unsupported decay photon distribution {type(distribution).__name__}")
+
+def select_tracked_nuclides(path, extra_nuclides=(), top_activity=50, atom_fraction=1e-9):
+    """Pick the nuclides worth keeping at every step of a compact results file
+
+    These are the extra nuclides, the nuclides with the highest activity in any material at any step,
+    every nuclide that makes up more than atom_fraction of any material at any step,
+    and every transuranic with a half life over 5 years, which count towards table 1 of the waste classification.
+
+    Parameters
+    ----------
+    path : str
+        Path to the full depletion results file
+    extra_nuclides : iterable of str, optional
+        Nuclides to always keep, e.g. those named in the waste classification tables
+    top_activity : int, optional
+        Number of the most active nuclides to keep
+    atom_fraction : float, optional
+        Keep nuclides that make up at least this fraction of the atoms of a material
+
+    Returns
+    -------
+    nuclides : list of str
+        The tracked nuclides, in the order of the results file
+    """
+
+    with h5py.File(path, 'r') as f:
+        nuclide_indices = {nuclide: group.attrs['atom number index'] for nuclide, group in f['nuclides'].items()}
+        nuclides = sorted(nuclide_indices, key=nuclide_indices.get)
+        decay_constants = np.array([openmc.data.decay_constant(nuclide) for nuclide in nuclides])
+
+        # Largest activity and atom fraction of each nuclide over every step and material,
+        # one step at a time like compact_results so the full array is never in memory
+        number = f['number']
+        max_activity = np.zeros(len(nuclides))
+        max_atom_fraction = np.zeros(len(nuclides))
+        for step in range(number.shape[0]):
+            step_atoms = number[step, 0, :, :]
+            max_activity = np.maximum(max_activity, np.max(step_atoms * decay_constants, axis=0))
+            total_atoms = np.sum(step_atoms, axis=-1, keepdims=True)
+            max_atom_fraction = np.maximum(max_atom_fraction,
+                                           np.max(step_atoms / np.where(total_atoms > 0, total_atoms, 1.0), axis=0))
+
+    tracked = set(extra_nuclides)
+    active = np.argsort(max_activity)[::-1][:top_activity]
+    tracked.update(nuclides[i] for i in active if max_activity[i] > 0.0)
+    tracked.update(nuclides[i] for i in np.flatnonzero(max_atom_fraction >= atom_fraction))
+
+    five_years_seconds = 5 * 365 * SECONDS_PER_DAY
+    for nuclide, decay_constant in zip(nuclides, decay_constants):
+        if decay_constant > 0.0 and openmc.data.zam(nuclide)[0] > 92 and np.log(2) / decay_constant > five_years_seconds:
+            tracked.add(nuclide)
+
+    return [nuclide for nuclide in nuclides if nuclide in tracked]
+
+def compact_results(path, compact_path, tracked_nuclides, checkpoint_steps=(-1,), attributes=None):
+    """Write a compressed copy of a depletion results file with every nuclide only at some checkpoints
+    and just the tracked nuclides at every other step. Only the beginning of step values are kept.
+
+    The copy is made from a finished results file, so only the file kept afterwards is smaller.
+    The full file still has to fit on disk while the run is going.
+
+    Parameters
+    ----------
+    path : str
+        Path to the full depletion results file
+    compact_path : str
+        Path to write the compact results file to
+    tracked_nuclides : iterable of str
+        Nuclides to keep at every step, see select_tracked_nuclides
+    checkpoint_steps : iterable of int, optional
+        Steps to keep every nuclide at, negative counting from the end. Default is only the last step.
+    attributes : dict, optional
+        Extra attributes to store on the compact file
+    """
+
+    with h5py.File(path, 'r') as source, h5py.File(compact_path, 'w') as destination:
+        nuclide_indices = {nuclide: int(group.attrs['atom number index']) for nuclide, group in source['nuclides'].items()}
+        nuclides = sorted(nuclide_indices, key=nuclide_indices.get)
+        tracked_nuclides = set(tracked_nuclides)
+        tracked = [nuclide for nuclide in nuclides if nuclide in tracked_nuclides]
+        tracked_columns = np.array([nuclide_indices[nuclide] for nuclide in tracked], dtype=int)
+
+        number = source['number']
+        n_steps, _, n_materials, n_nuclides = number.shape
+        checkpoint_steps = sorted({step % n_steps for step in checkpoint_steps})
+
+        destination.attrs['filetype'] = np.bytes_(b'depletion results compact')
+        for key, value in (attributes or {}).items():
+            destination.attrs[key] = value
+
+        for name in ['time', 'source_rate', 'eigenvalues']:
+            if name in source:
+                destination.create_dataset(name, data=source[name][()])
+        destination.create_dataset('checkpoint_steps', data=np.array(checkpoint_steps, dtype=int))
+
+        compression = {'compression': 'gzip', 'shuffle': True, 'dtype': number.dtype}
+        tracked_number = destination.create_dataset('tracked_number', shape=(n_steps, n_materials, len(tracked)),
+                                                    chunks=(1, 1, max(len(tracked), 1)), **compression)
+        checkpoint_number = destination.create_dataset('checkpoint_number', shape=(len(checkpoint_steps), n_materials, n_nuclides),
+                                                       chunks=(1, 1, n_nuclides), **compression)
+
+        # One step at a time, so the full array is never in memory
+        for step in range(n_steps):
+            step_atoms = number[step, 0, :, :]
+            tracked_number[step] = step_atoms[:, tracked_columns]
+            if step in checkpoint_steps:
+                checkpoint_number[checkpoint_steps.index(step)] = step_atoms
+
+        materials_group = destination.create_group('materials')
+        for material_id, group in source['materials'].items():
+            material_group = materials_group.create_group(material_id)
+            material_group.attrs['index'] = group.attrs['index']
+            material_group.attrs['volume'] = group.attrs['volume']
+
+        tracked_indices = {nuclide: i for i, nuclide in enumerate(tracked)}
+        nuclides_group = destination.create_group('nuclides')
+        for nuclide in nuclides:
+            nuclide_group = nuclides_group.create_group(nuclide)
+            nuclide_group.attrs['atom number index'] = nuclide_indices[nuclide]
+            if nuclide in tracked_indices:
+                nuclide_group.attrs['tracked index'] = tracked_indices[nuclide]
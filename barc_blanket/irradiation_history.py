@@ -0,0 +1,179 @@
+import numpy as np
+
+class IrradiationPeriod:
+    """A stretch of time at a constant fraction of full power
+
+    Parameters
+    ----------
+    duration_days : float
+        Length of the period in days
+    power_fraction : float, optional
+        Fraction of full power during the period. Default is 1.0
+    """
+
+    def __init__(self, duration_days, power_fraction=1.0):
+        self.duration_days = duration_days
+        self.power_fraction = power_fraction
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.duration_days!r}, power_fraction={self.power_fraction!r})"
+
+class Campaign(IrradiationPeriod):
+    """A stretch of continuous operation"""
+
+class Outage(IrradiationPeriod):
+    """A stretch with the plant shut down, e.g. for maintenance
+
+    Parameters
+    ----------
+    duration_days : float
+        Length of the outage in days
+    """
+
+    def __init__(self, duration_days):
+        super().__init__(duration_days, power_fraction=0.0)
+
+    def __repr__(self):
+        return f"Outage({self.duration_days!r})"
+
+class DutyCycle:
+    """Repeated cycles of operation followed by downtime
+
+    Parameters
+    ----------
+    on_days : float
+        Length of the operating part of each cycle in days
+    off_days : float
+        Length of the downtime in each cycle in days
+    cycles : int
+        Number of cycles
+    power_fraction : float, optional
+        Fraction of full power while operating. Default is 1.0
+    """
+
+    def __init__(self, on_days, off_days, cycles, power_fraction=1.0):
+        self.on_days = on_days
+        self.off_days = off_days
+        self.cycles = cycles
+        self.power_fraction = power_fraction
+
+    def __repr__(self):
+        return f"DutyCycle({self.on_days!r}, {self.off_days!r}, {self.cycles!r}, power_fraction={self.power_fraction!r})"
+
+    @property
+    def period_days(self):
+        return self.on_days + self.off_days
+
+    @property
+    def availability(self):
+        """Fraction of the time spent operating"""
+        return self.on_days / self.period_days
+
+    def periods(self, cycles=None):
+        """Every operating and downtime period of the cycles, in order"""
+        if cycles is None:
+            cycles = self.cycles
+        periods = []
+        for _ in range(cycles):
+            periods.append(Campaign(self.on_days, self.power_fraction))
+            if self.off_days > 0:
+                periods.append(Outage(self.off_days))
+        return periods
+
+class IrradiationHistory:
+    """Sequence of campaigns, outages and duty cycles, turned into as few depletion steps as possible
+
+    Parameters
+    ----------
+    segments : list of IrradiationPeriod or DutyCycle
+        Parts of the history in order
+    """
+
+    def __init__(self, segments):
+        self.segments = list(segments)
+
+    def __repr__(self):
+        return f"IrradiationHistory({self.segments!r})"
+
+    @property
+    def duration_days(self):
+        return sum(segment.period_days * segment.cycles if isinstance(segment, DutyCycle) else segment.duration_days
+                   for segment in self.segments)
+
+    def periods(self, resolve_days=30, explicit_final_cycles=1):
+        """Compress the history into periods of constant power
+
+        Cycles shorter than resolve_days are replaced by one period at the average power,
+        which gives the same inventory of every nuclide that lives much longer than a cycle.
+        Nuclides that live about as long as a cycle or less saturate, and their inventory at the end
+        depends on the last few cycles, so those are kept as they are.
+        Neighbouring periods at the same power are merged.
+
+        Parameters
+        ----------
+        resolve_days : float, optional
+            Cycles at least this long are kept as they are
+        explicit_final_cycles : int, optional
+            Number of cycles at the end of each duty cycle that are kept as they are
+
+        Returns
+        -------
+        periods : list of IrradiationPeriod
+            Periods of constant power in order
+        """
+
+        periods = []
+        for segment in self.segments:
+            if isinstance(segment, DutyCycle):
+                if segment.period_days < resolve_days:
+                    averaged_cycles = max(segment.cycles - explicit_final_cycles, 0)
+                    if averaged_cycles > 0:
+                        periods.append(IrradiationPeriod(averaged_cycles * segment.period_days,
+                                                         segment.power_fraction * segment.availability))
+                    periods.extend(segment.periods(segment.cycles - averaged_cycles))
+                else:
+                    periods.extend(segment.periods())
+            else:
+                periods.append(segment)
+
+        merged = []
+        for period in periods:
+            if period.duration_days <= 0:
+                continue
+            if len(merged) > 0 and merged[-1].power_fraction == period.power_fraction:
+                merged[-1] = IrradiationPeriod(merged[-1].duration_days + period.duration_days, period.power_fraction)
+            else:
+                merged.append(IrradiationPeriod(period.duration_days, period.power_fraction))
+
+        return merged
+
+    def steps(self, full_source_rate, resolve_days=30, explicit_final_cycles=1, max_step_days=None):
+        """Timesteps and source rates to pass to an openmc.deplete integrator
+
+        Parameters
+        ----------
+        full_source_rate : float
+            Neutron source rate at full power in neutrons/s
+        resolve_days : float, optional
+            Cycles at least this long are kept as they are, see periods
+        explicit_final_cycles : int, optional
+            Number of cycles at the end of each duty cycle that are kept as they are, see periods
+        max_step_days : float, optional
+            Split periods longer than this into equal steps. Default is no limit.
+
+        Returns
+        -------
+        timesteps_days : numpy.ndarray
+            Length of each step in days
+        source_rates : numpy.ndarray
+            Source rate during each step in neutrons/s
+        """
+
+        timesteps_days = []
+        source_rates = []
+        for period in self.periods(resolve_days, explicit_final_cycles):
+            n_steps = 1 if max_step_days is None else int(np.ceil(period.duration_days / max_step_days))
+            timesteps_days.extend([period.duration_days / n_steps] * n_steps)
+            source_rates.extend([full_source_rate * period.power_fraction] * n_steps)
+
+        return np.array(timesteps_days), np.array(source_rates)
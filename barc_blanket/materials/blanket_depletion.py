@@ -1,10 +1,23 @@
+import os
+import csv
+import json
+import h5py
 import numpy as np
 import pickle as pkl
 import matplotlib.pyplot as plt
 
 import openmc.deplete
-from barc_blanket.materials.waste_classification import sum_of_fractions, remove_flibe, remove_tritium
+from barc_blanket.materials.waste_classification import TABLE_NUCLIDES, cached_sum_of_fractions, load_classification_cache, save_classification_cache, remove_flibe, remove_tritium
 from barc_blanket.models.barc_model_final import SECTION_CORRECTION
+from barc_blanket.utilities import file_fingerprint, model_fingerprint
+from barc_blanket.depletion_chain import reduced_chain_file
+from barc_blanket.depletion_profiling import DepletionProfiler, profiled
+from barc_blanket.depletion_results import read_material_atoms, material_from_atoms, available_cross_section_nuclides, split_results_by_material, select_tracked_nuclides, compact_results, SECONDS_PER_DAY
+
+RESULTS_FILE = "depletion_results.h5"
+COMPACT_RESULTS_FILE = "depletion_results_compact.h5"
+CHECKSUM_FILE = "depletion_checksum.json"
+CLASSIFICATION_LOG_FILE = "classification_log.csv"
 
 def gw_to_neutron_rate(gw, section_correction=SECTION_CORRECTION):
     """Convert GW of fusion power to neutron rate in n/s
@@ -24,10 +37,13 @@ def gw_to_neutron_rate(gw, section_correction=SECTION_CORRECTION):
 
     return neutron_rate
 
-def run_coupled_depletion(model, timesteps_years, fusion_power):
+def run_coupled_depletion(model, timesteps_years, fusion_power, resume=True, history=None, compact=False, checkpoint_interval=None, classifier=None):
     """ Run coupled depletion for a given model and timesteps
     Results are saved in 'depletion_results.h5' file in whatever directory called this function
 
+    If a previous run in this directory was interrupted, it is continued from the last completed timestep,
+    as long as the model, chain, fusion power and timesteps it was started with are the same as now.
+
     Parameters
     ----------
     model : openmc.model.Model
@@ -36,38 +52,608 @@ def run_coupled_depletion(model, timesteps_years, fusion_power):
         Array of timesteps to run depletion for (in years)
     fusion_power : float
         Fusion power in GW
+    resume : bool, optional
+        Continue from an existing 'depletion_results.h5' if it matches this run. Default is True.
+    history : IrradiationHistory, optional
+        Campaigns, outages and duty cycles at fractions of fusion_power.
+        If given, the timesteps and source rates come from it and timesteps_years is ignored.
+    compact : bool, optional
+        Replace 'depletion_results.h5' with a compressed 'depletion_results_compact.h5' at the end,
+        with every nuclide only at the checkpoints and the tracked nuclides from select_tracked_nuclides at every step.
+        The full file is still written during the run, so this saves disk space afterwards but not at the peak.
+        Default is False.
+    checkpoint_interval : int, optional
+        With compact, keep every nuclide every this many steps as well as at the first and last step
+    classifier : StreamingClassifier, optional
+        Classify the blanket after every step, and stop early if its stop condition is met.
+        A run that stopped early is continued like an interrupted one if run again.
     """
 
-    timesteps_days = np.array(timesteps_years) * 365  # convert to days
+    if history is None:
+        timesteps_days = np.array(timesteps_years) * 365  # convert to days
+        source_rates = np.ones_like(timesteps_days) * gw_to_neutron_rate(fusion_power)
+    else:
+        timesteps_days, source_rates = history.steps(gw_to_neutron_rate(fusion_power))
+
+    reduce_chain_level = 5
+    checksum = {'model': model_fingerprint(model),
+                'chain': file_fingerprint(openmc.config['chain_file']),
+                'reduce_chain_level': reduce_chain_level,
+                'fusion_power': fusion_power}
+    if history is not None:
+        checksum['source_rates'] = source_rates.tolist()
+
+    compact_attributes = {'checksum': json.dumps(checksum, sort_keys=True),
+                          'timesteps_days': np.asarray(timesteps_days, dtype=float)}
+    if compact and resume and _compact_results_match(compact_attributes):
+        print(f"All {len(timesteps_days)} timesteps already in {COMPACT_RESULTS_FILE}, nothing to do")
+        return
+
+    prev_results = None
+    if resume:
+        prev_results = _load_previous_results(checksum, timesteps_days)
+
+    if prev_results is None:
+        completed_steps = 0
+        with open(CHECKSUM_FILE, 'w') as f:
+            json.dump(checksum, f, indent=2)
+    else:
+        # The last entry in the results holds the compositions the next step starts from
+        completed_steps = len(prev_results) - 1
+        if completed_steps >= len(timesteps_days):
+            print(f"All {len(timesteps_days)} timesteps already in {RESULTS_FILE}, nothing to do")
+            return
+        print(f"Resuming from timestep {completed_steps} of {len(timesteps_days)}")
+
+    profiler = DepletionProfiler(particles_per_transport=model.settings.particles * model.settings.batches)
+
+    with profiler.phase('chain_reduction'):
+        chain_file = reduced_chain_file(model.geometry.get_all_materials().values(), reduce_chain_level)
+
+    with profiler.phase('operator_setup'):
+        op = openmc.deplete.CoupledOperator(model, 
+                                        chain_file=chain_file,
+                                        prev_results=prev_results,
+                                        normalization_mode='source-rate')
+    
+    integrator_class = openmc.deplete.CECMIntegrator
+    integrator_kwargs = {}
+    if classifier is not None:
+        integrator_class = classifying(integrator_class)
+        integrator_kwargs['classifier'] = classifier
+
+    # Profiling wraps classification, so the steps are still timed when classification ends the run early
+    profiled(integrator_class)(op, 
+                               timesteps_days[completed_steps:], 
+                               source_rates=source_rates[completed_steps:], 
+                               timestep_units='d',
+                               profiler=profiler,
+                               **integrator_kwargs).integrate()
+
+    if compact:
+        with profiler.phase('compaction'):
+            checkpoint_steps = [0, -1]
+            if checkpoint_interval is not None:
+                checkpoint_steps.extend(range(0, len(timesteps_days) + 1, checkpoint_interval))
+            tracked_nuclides = select_tracked_nuclides(RESULTS_FILE, extra_nuclides=TABLE_NUCLIDES)
+            compact_results(RESULTS_FILE, COMPACT_RESULTS_FILE, tracked_nuclides, checkpoint_steps, attributes=compact_attributes)
+            os.remove(RESULTS_FILE)
+
+    # Per-step timings go next to the results
+    profiler.write()
+    profiler.print_summary()
+
+def _compact_results_match(compact_attributes):
+    """Whether a finished compact results file is from a run with the same checksum and timesteps"""
+    if not os.path.exists(COMPACT_RESULTS_FILE):
+        return False
+    with h5py.File(COMPACT_RESULTS_FILE, 'r') as f:
+        return (f.attrs.get('checksum') == compact_attributes['checksum']
+                and np.array_equal(f.attrs.get('timesteps_days'), compact_attributes['timesteps_days']))
+
+def run_adaptive_coupled_depletion(model, total_years, fusion_power, tolerance=1e-3, initial_step_years=0.1, max_step_years=None, tracked_nuclides=TABLE_NUCLIDES):
+    """ Run coupled depletion with timesteps chosen to keep the local error in the tracked nuclides below a tolerance
+    Results are saved in 'depletion_results.h5' file in whatever directory called this function
+
+    The error of each step is estimated by comparing the CE/CM corrector with a predictor using only the
+    beginning of step reaction rates, which costs an extra CRAM solve but no extra transport.
+    The next step then grows or shrinks to meet the tolerance, so transport solves go where the composition changes fast.
+
+    Unlike run_coupled_depletion, an interrupted run isn't resumed.
+
+    Parameters
+    ----------
+    model : openmc.model.Model
+        Model to run depletion for
+    total_years : float
+        Total irradiation time (in years)
+    fusion_power : float
+        Fusion power in GW
+    tolerance : float, optional
+        Largest relative change in any tracked nuclide between predictor and corrector
+    initial_step_years : float, optional
+        Length of the first timestep (in years)
+    max_step_years : float, optional
+        Longest allowed timestep (in years). Default is no limit.
+    tracked_nuclides : list of str, optional
+        Nuclides the error is measured on. Default is the nuclides named in the waste classification tables.
+    """
 
-    source_rates = np.ones_like(timesteps_years) * gw_to_neutron_rate(fusion_power)
+    reduce_chain_level = 5
 
     op = openmc.deplete.CoupledOperator(model, 
-                                    reduce_chain=True, 
-                                    reduce_chain_level=5, 
+                                    chain_file=reduced_chain_file(model.geometry.get_all_materials().values(), reduce_chain_level),
                                     normalization_mode='source-rate')
-    
-    openmc.deplete.CECMIntegrator(op, timesteps_days, source_rates=source_rates, timestep_units='d').integrate()
 
-def postprocess_coupled_depletion(flibe_material_index, remove_C14=False):
+    max_step_days = None if max_step_years is None else max_step_years * 365
+
+    _AdaptiveCECMIntegrator(op,
+                            total_years * 365,
+                            gw_to_neutron_rate(fusion_power),
+                            initial_step_years * 365,
+                            tolerance,
+                            tracked_nuclides,
+                            max_step_days=max_step_days).integrate()
+
+class _AdaptiveStepping:
+    """Mixin for openmc.deplete integrators that picks each timestep from the error estimate of the previous one.
+
+    The integrate loop of openmc.deplete.Integrator asks for the next timestep after the previous
+    one has been solved, so the timesteps are generated as it goes instead of being fixed up front.
+    A step over the tolerance is kept, and the next step shrinks to make up for it.
+    The next step grows or shrinks by SAFETY_FACTOR * sqrt(tolerance / error), clipped to between
+    MIN_FACTOR and MAX_FACTOR, and never past the longest step allowed.
+    """
+
+    # Limits on how much a step can change from one to the next
+    SAFETY_FACTOR = 0.9
+    MIN_FACTOR = 0.2
+    MAX_FACTOR = 5.0
+
+    # Atoms of a tracked nuclide below this fraction of all the atoms in a material don't count towards the error
+    ABSOLUTE_TOLERANCE = 1e-12
+
+    def __init__(self, operator, total_days, source_rate, initial_step_days, tolerance, tracked_nuclides, max_step_days=None):
+        super().__init__(operator, [initial_step_days], source_rates=[source_rate], timestep_units='d')
+
+        self._total_time = total_days * SECONDS_PER_DAY
+        self._source_rate = source_rate
+        self._next_step = initial_step_days * SECONDS_PER_DAY
+        self._max_step = np.inf if max_step_days is None else max_step_days * SECONDS_PER_DAY
+        self._tolerance = tolerance
+        self._error = None
+
+        number = operator.number
+        self._tracked_indices = [number.index_nuc[nuclide] for nuclide in tracked_nuclides
+                                 if nuclide in number.index_nuc and number.index_nuc[nuclide] < number.n_nuc_burn]
+
+    def __iter__(self):
+        self.timesteps = []
+        self.source_rates = []
+        time = 0.0
+
+        while self._total_time - time > 1e-6 * self._total_time:
+            remaining = self._total_time - time
+            step = min(self._next_step, self._max_step, remaining)
+            # Avoid leaving a sliver of a step at the end, by taking the rest in one step,
+            # or two equal ones if one would be longer than the longest step allowed
+            if remaining - step < self.MIN_FACTOR * step:
+                step = remaining if remaining <= self._max_step else remaining / 2
+
+            self.timesteps.append(step)
+            self.source_rates.append(self._source_rate)
+            yield step, self._source_rate
+
+            # The step has been solved by now, so its error is known
+            time += step
+            if self._error > 0.0:
+                factor = self.SAFETY_FACTOR * np.sqrt(self._tolerance / self._error)
+            else:
+                factor = self.MAX_FACTOR
+            self._next_step = step * np.clip(factor, self.MIN_FACTOR, self.MAX_FACTOR)
+            print(f"Step of {step/SECONDS_PER_DAY:0.4g} d had error {self._error:0.3g}, next step up to {self._next_step/SECONDS_PER_DAY:0.4g} d")
+
+    def __len__(self):
+        return len(self.timesteps)
+
+    def __call__(self, n, rates, dt, source_rate, _i=None):
+        proc_time, n_list, res_list = super().__call__(n, rates, dt, source_rate, _i)
+
+        # Predictor with only the beginning of step rates, which is first order where CE/CM is second order
+        predictor_time, n_predictor = self._timed_deplete(n, rates, dt)
+        self._error = self._local_error(n_predictor, n_list[-1])
+
+        return proc_time + predictor_time, n_list, res_list
+
+    def _local_error(self, n_predictor, n_corrector):
+        """Largest relative difference in the tracked nuclides of any material"""
+        error = 0.0
+        for predictor, corrector in zip(n_predictor, n_corrector):
+            scale = np.abs(corrector[self._tracked_indices]) + self.ABSOLUTE_TOLERANCE * np.sum(np.abs(corrector))
+            if np.all(scale == 0.0):
+                continue
+            difference = np.abs(predictor[self._tracked_indices] - corrector[self._tracked_indices])
+            error = max(error, np.max(difference / np.where(scale > 0.0, scale, np.inf)))
+        return error
+
+class _AdaptiveCECMIntegrator(_AdaptiveStepping, openmc.deplete.CECMIntegrator):
+    """CE/CM integrator that picks each timestep from the error estimate of the previous one, see _AdaptiveStepping"""
+
+def _load_previous_results(checksum, timesteps_days):
+    """Load the results of a previous run in this directory if it can be continued
+
+    Parameters
+    ----------
+    checksum : dict
+        Fingerprints of the model and chain, and the fusion power, for the run about to start
+    timesteps_days : numpy.ndarray
+        Timesteps of the run about to start, in days
+
+    Returns
+    -------
+    prev_results : openmc.deplete.Results or None
+        The previous results, or None if the run has to start from the beginning
+    """
+
+    if not os.path.exists(RESULTS_FILE):
+        return None
+
+    if not os.path.exists(CHECKSUM_FILE):
+        print(f"No {CHECKSUM_FILE} for the existing {RESULTS_FILE}, starting from the beginning")
+        return None
+
+    with open(CHECKSUM_FILE, 'r') as f:
+        previous_checksum = json.load(f)
+    if previous_checksum != checksum:
+        print(f"Model, chain or fusion power changed since {RESULTS_FILE} was written, starting from the beginning")
+        return None
+
+    try:
+        prev_results = openmc.deplete.Results(RESULTS_FILE)
+    except Exception as e:
+        print(f"Could not read {RESULTS_FILE} ({e}), starting from the beginning")
+        return None
+
+    # The times already run must be the start of the times requested now
+    previous_times = prev_results.get_times(time_units='d')
+    requested_times = np.concatenate(([0], np.cumsum(timesteps_days)))
+    if len(previous_times) > len(requested_times) or not np.allclose(previous_times, requested_times[:len(previous_times)]):
+        print(f"Timesteps changed since {RESULTS_FILE} was written, starting from the beginning")
+        return None
+
+    return prev_results
+
+def run_independent_depletion(model, timesteps_years, fusion_power, refresh_interval=None):
+    """ Run depletion with fluxes and microscopic cross sections from a single transport solve
+    Results are saved in 'depletion_results.h5' file in whatever directory called this function
+
+    Much faster than run_coupled_depletion since there is no transport solve at each step,
+    which is fine as long as the flux spectrum in the depletable materials barely changes.
+
+    Parameters
+    ----------
+    model : openmc.model.Model
+        Model to run depletion for
+    timesteps_years : numpy.ndarray
+        Array of timesteps to run depletion for (in years)
+    fusion_power : float
+        Fusion power in GW
+    refresh_interval : int, optional
+        Recalculate the fluxes and cross sections with the depleted compositions every this many timesteps.
+        Default is None, which uses the fluxes and cross sections of the initial compositions throughout.
+    """
+
+    timesteps_days = np.array(timesteps_years) * 365  # convert to days
+
+    source_rates = np.ones_like(timesteps_days) * gw_to_neutron_rate(fusion_power)
+
+    if refresh_interval is None:
+        refresh_interval = len(timesteps_days)
+
+    depletable_materials = [material for material in model.geometry.get_all_materials().values() if material.depletable]
+
+    for chunk_start in range(0, len(timesteps_days), refresh_interval):
+        chunk_end = min(chunk_start + refresh_interval, len(timesteps_days))
+
+        if chunk_start == 0:
+            prev_results = None
+            fluxes, micros = openmc.deplete.get_microxs_and_flux(model, depletable_materials)
+        else:
+            print(f"Refreshing fluxes and cross sections at timestep {chunk_start}")
+            prev_results = openmc.deplete.Results(RESULTS_FILE)
+            fluxes, micros = _depleted_microxs_and_flux(model, depletable_materials)
+
+        # The original materials are always passed so the reduced chain is the same for every chunk,
+        # while the compositions come from the previous results
+        op = openmc.deplete.IndependentOperator(openmc.Materials(depletable_materials),
+                                                fluxes,
+                                                micros,
+                                                chain_file=reduced_chain_file(depletable_materials, 5),
+                                                normalization_mode='source-rate',
+                                                prev_results=prev_results)
+
+        if prev_results is not None:
+            _refresh_restart_rates(op, source_rates[chunk_start])
+
+        openmc.deplete.PredictorIntegrator(op,
+                                           timesteps_days[chunk_start:chunk_end],
+                                           source_rates=source_rates[chunk_start:chunk_end],
+                                           timestep_units='d').integrate()
+
+def _depleted_microxs_and_flux(model, depletable_materials):
+    """Calculate fluxes and microscopic cross sections with the latest compositions in the depletion results
+    by temporarily filling the model's cells with the depleted materials
+
+    Returns the same as openmc.deplete.get_microxs_and_flux, in the order of depletable_materials
+    """
+
+    nuc_with_data = available_cross_section_nuclides()
+
+    depleted_materials = {}
+    for material in depletable_materials:
+        _, nuclides, atoms, volume = read_material_atoms(material.id, RESULTS_FILE)
+        depleted_material = material_from_atoms(nuclides, atoms[-1], volume, nuc_with_data=nuc_with_data)
+        depleted_material.temperature = material.temperature
+        depleted_materials[material.id] = depleted_material
+
+    cells = [cell for cell in model.geometry.get_all_material_cells().values() if cell.fill.id in depleted_materials]
+    original_fills = [cell.fill for cell in cells]
+    original_materials = model.materials
+    try:
+        for cell in cells:
+            cell.fill = depleted_materials[cell.fill.id]
+        if len(original_materials) > 0:
+            model.materials = openmc.Materials([depleted_materials.get(material.id, material) for material in original_materials])
+
+        fluxes, micros = openmc.deplete.get_microxs_and_flux(model, [depleted_materials[material.id] for material in depletable_materials])
+    finally:
+        for cell, fill in zip(cells, original_fills):
+            cell.fill = fill
+        model.materials = original_materials
+
+    return fluxes, micros
+
+class StreamingClassifier:
+    """Classifies the blanket after each depletion step from the in-memory compositions,
+    the same way postprocess_coupled_depletion does, and logs the sums of fractions as it goes
+
+    Parameters
+    ----------
+    material_id : int or str
+        ID of the blanket material
+    remove_C14 : bool, optional
+        Leave C14 out of the table 1 sum of fractions
+    log_file : str, optional
+        CSV file each step's classification is appended to
+    stop_condition : callable, optional
+        Called with the list of every classification so far after each step,
+        the run stops early if it returns True. See sums_of_fractions_above.
+    """
+
+    LOG_FIELDS = ['step', 'time_years', 'table_1_sum_of_fractions', 'table_2_sum_of_fractions', 'class_c_or_better']
+
+    def __init__(self, material_id, remove_C14=False, log_file=CLASSIFICATION_LOG_FILE, stop_condition=None):
+        self.material_id = str(material_id)
+        self.remove_C14 = remove_C14
+        self.log_file = log_file
+        self.stop_condition = stop_condition
+        self.history = []
+        self._nuc_with_data = None
+
+    def classify(self, step, time_seconds, nuclides, atoms, volume):
+        """Classify one composition, returning True if the run should stop"""
+
+        # export_to_materials only keeps nuclides which have cross sections, so do the same here
+        if self._nuc_with_data is None:
+            self._nuc_with_data = available_cross_section_nuclides()
+
+        blanket_material = material_from_atoms(nuclides, atoms, volume, nuc_with_data=self._nuc_with_data)
+        sample_material = remove_flibe(remove_tritium(blanket_material, 0.9), 0.9)
+
+        table_1_sum_of_fractions, _ = cached_sum_of_fractions(sample_material, 1, None, remove_C14=self.remove_C14)
+        table_2_sum_of_fractions, _ = cached_sum_of_fractions(sample_material, 2, 3)
+
+        record = {'step': step,
+                  'time_years': time_seconds / SECONDS_PER_DAY / 365,
+                  'table_1_sum_of_fractions': table_1_sum_of_fractions,
+                  'table_2_sum_of_fractions': table_2_sum_of_fractions,
+                  'class_c_or_better': table_1_sum_of_fractions < 1 and table_2_sum_of_fractions < 1}
+        self.history.append(record)
+
+        write_header = not os.path.exists(self.log_file)
+        with open(self.log_file, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.LOG_FIELDS)
+            if write_header:
+                writer.writeheader()
+            writer.writerow(record)
+
+        print(f"Step {step} at {record['time_years']:0.2f} years: "
+              f"table 1 sum of fractions {table_1_sum_of_fractions:0.2f}, table 2 sum of fractions {table_2_sum_of_fractions:0.2f}")
+
+        return self.stop_condition is not None and self.stop_condition(self.history)
+
+def sums_of_fractions_above(threshold=10, consecutive_steps=3):
+    """Stop condition for StreamingClassifier: both sums of fractions above a threshold
+    for some number of steps in a row, i.e. the blanket is clearly not going to be Class C"""
+
+    def condition(history):
+        recent = history[-consecutive_steps:]
+        return (len(recent) == consecutive_steps
+                and all(record['table_1_sum_of_fractions'] > threshold and record['table_2_sum_of_fractions'] > threshold
+                        for record in recent))
+
+    return condition
+
+class _ClassifyingIntegrator:
+    """Mixin for openmc.deplete integrators that passes the blanket composition at the end of each step
+    to a StreamingClassifier, and ends the run early if it says to"""
+
+    def __init__(self, *args, classifier, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._classifier = classifier
+        self._end_of_step = None
+
+    def __call__(self, *args, **kwargs):
+        result = super().__call__(*args, **kwargs)
+        # The last concentrations are the ones the next step starts from
+        self._end_of_step = result[1][-1]
+        return result
+
+    def __iter__(self):
+        number = self.operator.number
+        material_index = number.index_mat[self._classifier.material_id]
+
+        if self.operator.prev_res is None:
+            step, time = 0, 0.0
+        else:
+            step, time = len(self.operator.prev_res) - 1, self.operator.prev_res[-1].time[0]
+
+        for i, (dt, source_rate) in enumerate(super().__iter__()):
+            yield dt, source_rate
+
+            # The step has been solved by now
+            step += 1
+            time += dt
+            stop = self._classifier.classify(step, time, number.burnable_nuclides,
+                                             self._end_of_step[material_index], number.volume[material_index])
+            if stop:
+                print(f"Stopping early after step {step}")
+                # integrate saves the final compositions at len(self), so drop the steps that won't be run
+                # or the results get empty steps and the final compositions land at the wrong index
+                self.timesteps = self.timesteps[:i + 1]
+                self.source_rates = self.source_rates[:i + 1]
+                return
+
+def classifying(integrator_class):
+    """Subclass of an openmc.deplete integrator that takes a classifier keyword argument, see StreamingClassifier"""
+    return type(f"Classifying{integrator_class.__name__}", (_ClassifyingIntegrator, integrator_class), {})
+
+def _refresh_restart_rates(operator, source_rate):
+    """Replace the reaction rates stored with the last previous result by the operator evaluated at its compositions
+
+    An integrator continuing from previous results reuses the rates stored in them for its first step,
+    so this makes it use the refreshed fluxes and cross sections from the first continued step instead.
+
+    Parameters
+    ----------
+    operator : openmc.deplete.abc.TransportOperator
+        Operator with prev_results, e.g. an IndependentOperator with refreshed fluxes and cross sections
+    source_rate : float
+        Source rate of the first continued step
+    """
+
+    last_result = operator.prev_res[-1]
+    rates = operator(operator.initial_condition(), source_rate).rates
+
+    # The integrator scales the stored rates by the new source rate over the stored one
+    if last_result.source_rate != 0.0:
+        rates = rates * (last_result.source_rate / source_rate)
+    last_result.rates[0] = rates
+
+def run_batched_depletion(model, compositions, timesteps_years, fusion_power, output_directory="."):
+    """ Deplete many blanket compositions against the fluxes and cross sections of one transport solve
+
+    The transport is solved once with the model as given, then every composition is depleted
+    as a copy of the blanket material with the same volume, flux and cross sections.
+    Each composition then gets its own '<output_directory>/<name>/depletion_results.h5' and 'materials.xml'
+    laid out as if run_coupled_depletion had been run on it, so postprocess_coupled_depletion works as usual.
+
+    Only suitable when the compositions are similar enough to the one in the model
+    that they barely change the flux spectrum, e.g. small fractions of waste in the same carrier.
+
+    Parameters
+    ----------
+    model : openmc.model.Model
+        Model with the reference blanket composition to solve the transport for
+    compositions : dict
+        Maps the name of each case to its blanket material
+    timesteps_years : numpy.ndarray
+        Array of timesteps to run depletion for (in years)
+    fusion_power : float
+        Fusion power in GW
+    output_directory : str, optional
+        Directory to put the results of each composition in
+    """
+
+    timesteps_days = np.array(timesteps_years) * 365  # convert to days
+
+    source_rates = np.ones_like(timesteps_days) * gw_to_neutron_rate(fusion_power)
+
+    blanket_material = next(cell.fill for cell in model.geometry.get_all_cells().values() if cell.name == 'blanket_cell')
+
+    fluxes, micros = openmc.deplete.get_microxs_and_flux(model, [blanket_material])
+
+    batch_materials = {}
+    for name, composition in compositions.items():
+        batch_material = composition.clone()
+        batch_material.name = name
+        batch_material.volume = blanket_material.volume
+        batch_material.depletable = True
+        batch_materials[name] = batch_material
+
+    op = openmc.deplete.IndependentOperator(openmc.Materials(batch_materials.values()),
+                                            fluxes * len(batch_materials),
+                                            micros * len(batch_materials),
+                                            chain_file=reduced_chain_file(batch_materials.values(), 5),
+                                            normalization_mode='source-rate')
+
+    openmc.deplete.PredictorIntegrator(op,
+                                       timesteps_days,
+                                       source_rates=source_rates,
+                                       timestep_units='d').integrate()
+
+    # Every case keeps the model's materials so the blanket is found at the same index when postprocessing
+    model_materials = openmc.Materials(model.geometry.get_all_materials().values())
+    outputs = {}
+    for name, batch_material in batch_materials.items():
+        case_directory = os.path.join(output_directory, name)
+        os.makedirs(case_directory, exist_ok=True)
+        model_materials.export_to_xml(os.path.join(case_directory, "materials.xml"))
+        outputs[batch_material.id] = (os.path.join(case_directory, RESULTS_FILE), blanket_material.id)
+
+    split_results_by_material(RESULTS_FILE, outputs)
+
+def postprocess_coupled_depletion(flibe_material_index, remove_C14=False, cache_file='classification_cache.pkl', results_file='waste_classification_results.pkl'):
     """Postprocess the results of a coupled depletion run
     
     Assumed to be ran in the same directory as the depletion results
+
+    Parameters
+    ----------
+    flibe_material_index : int
+        Index of the blanket material in the exported materials
+    remove_C14 : bool, optional
+        Leave C14 out of the table 1 sum of fractions
+    cache_file : str, optional
+        Pickle of previously calculated sums of fractions, read before and written after classification.
+        Set to None to only use the in-memory cache.
+    results_file : str, optional
+        Pickle to write the classification results to
     """
 
-    # Load the results
-    results = openmc.deplete.Results("depletion_results.h5")
+    if cache_file is not None:
+        load_classification_cache(cache_file)
 
-    times_days = results.get_times()
-    times_years = times_days / 365
+    # Only the blanket is needed, so read its number densities straight out of the results file
+    # instead of exporting every material in the model at every timestep
+    materials = openmc.Materials.from_xml('materials.xml')
+    blanket_material_id = materials[flibe_material_index].id
+    # Compact results only have the tracked nuclides at most steps, which include everything that counts towards the classification
+    results_path = RESULTS_FILE if os.path.exists(RESULTS_FILE) else COMPACT_RESULTS_FILE
+    times_seconds, nuclides, atoms, volume = read_material_atoms(blanket_material_id, results_path)
+
+    times_years = times_seconds / SECONDS_PER_DAY / 365
     # round to nearest int
     times_years = np.round(times_years).astype(int)
 
+    # export_to_materials only keeps nuclides which have cross sections, so do the same here
+    nuc_with_data = available_cross_section_nuclides()
+
     blanket_composition_at_time = []
 
     for i, time in enumerate(times_years):
-        materials = results.export_to_materials(burnup_index=i, path='materials.xml')
-        blanket_composition_at_time.append(materials[flibe_material_index])
+        blanket_composition_at_time.append(material_from_atoms(nuclides, atoms[i], volume,
+                                                               nuc_with_data=nuc_with_data))
 
     blanket_result_dictionary = {}
     for blanket_material, time in zip(blanket_composition_at_time, times_years):
@@ -77,8 +663,8 @@ def postprocess_coupled_depletion(flibe_material_index, remove_C14=False):
         sample_material = removed_flibe
 
 
-        table_1_sum_of_fractions, table_1_culprits = sum_of_fractions(sample_material, 1, None, remove_C14=remove_C14)
-        table_2_sum_of_fractions, table_2_culprits = sum_of_fractions(sample_material, 2, 3)
+        table_1_sum_of_fractions, table_1_culprits = cached_sum_of_fractions(sample_material, 1, None, remove_C14=remove_C14)
+        table_2_sum_of_fractions, table_2_culprits = cached_sum_of_fractions(sample_material, 2, 3)
 
         print(f"Time: {time} years")
         print(f"Table 1 sum of fractions: {table_1_sum_of_fractions:0.2f}")
@@ -91,13 +677,16 @@ def postprocess_coupled_depletion(flibe_material_index, remove_C14=False):
         
     full_result_dictionary = {'blanket': blanket_result_dictionary}
 
+    if cache_file is not None:
+        save_classification_cache(cache_file)
+
     # Pickle the results
-    with open('waste_classification_results.pkl', 'wb') as f:
+    with open(results_file, 'wb') as f:
         pkl.dump(full_result_dictionary, f)
 
-def plot_results(case:str, print_name:str):
+def plot_results(case:str, print_name:str, results_file='waste_classification_results.pkl'):
 
-    with open(f'waste_classification_results.pkl', 'rb') as f:
+    with open(results_file, 'rb') as f:
         result_dictionary = pkl.load(f)
 
     for cell in result_dictionary.keys():
@@ -132,6 +721,7 @@ def plot_results(case:str, print_name:str):
 
         # Save figure to file
         fig.savefig(f'{case}_sum_of_fractions.png')
+        plt.close(fig)
 
         # Culprits in Table 1
 
@@ -151,4 +741,5 @@ def plot_results(case:str, print_name:str):
 
         # Save figure to file
         fig.savefig(f'{case}_table_1_culprits.png')
+        plt.close(fig)
         
\ No newline at end of file
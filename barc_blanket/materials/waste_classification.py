@@ -1,3 +1,8 @@
+import os
+import hashlib
+import pickle as pkl
+from collections import OrderedDict
+
 import openmc
 import openmc.data
 
@@ -53,6 +58,14 @@ TABLE_2_VOLUME_CONCENTRATION = {
     }
 }
 
+# Nuclides named in the tables, taken before sum_of_fractions fills the tables in
+TABLE_NUCLIDES = sorted({nuclide for table in [TABLE_1_VOLUME_CONCENTRATION, TABLE_1_MASS_CONCENTRATION, *TABLE_2_VOLUME_CONCENTRATION.values()]
+                         for nuclide in table if nuclide[-1].isdigit()})
+
+# Most recently used sum of fractions results, keyed by composition_fingerprint
+CLASSIFICATION_CACHE_SIZE = 4096
+_classification_cache = OrderedDict()
+
 def sum_of_fractions(material:openmc.Material, table, column, remove_C14=False):
     """Calculate the sum of fractions of a material
     See paragraph 7 on this page:
@@ -151,7 +164,7 @@ def sum_of_fractions(material:openmc.Material, table, column, remove_C14=False):
 
     return sum_of_fractions, nuclide_fractions
 
-def check_class_c(material:openmc.Material):
+def check_class_c(material:openmc.Material, use_cache=False):
     """Determine if the material is Class C waste according to the NRC
 
     https://www.nrc.gov/reading-rm/doc-collections/cfr/part061/part061-0055.html
@@ -160,8 +173,8 @@ def check_class_c(material:openmc.Material):
     -----------
     material: openmc.Material
         The material to check
-    verbose: bool
-        Return dictionary of results if True
+    use_cache: bool
+        Look up the sums of fractions with cached_sum_of_fractions instead of recalculating them
     
     Returns:
     --------
@@ -169,6 +182,11 @@ def check_class_c(material:openmc.Material):
         True if the material is Class C waste, False otherwise
     """
 
+    if use_cache:
+        sum_of_fractions_function = cached_sum_of_fractions
+    else:
+        sum_of_fractions_function = sum_of_fractions
+
     # Stepping through the logic on the page linked above
 
     # Since we will likely be dealing with a mixture of long and short-lived waste,
@@ -184,9 +202,9 @@ def check_class_c(material:openmc.Material):
     # - The sum of fractions for table 1 does not exceed 1
     # - The sum of fractions for column 3 of table 2 does not exceed 1
 
-    table_1_sum_of_fractions, _ = sum_of_fractions(material, 1, None)
+    table_1_sum_of_fractions, _ = sum_of_fractions_function(material, 1, None)
     if table_1_sum_of_fractions < 1:
-        table_2_sum_of_fractions, _ = sum_of_fractions(material, 2, 3)
+        table_2_sum_of_fractions, _ = sum_of_fractions_function(material, 2, 3)
         if table_2_sum_of_fractions < 1:
             class_c = True
         else:
@@ -196,6 +214,101 @@ def check_class_c(material:openmc.Material):
 
     return class_c
 
+def composition_fingerprint(material:openmc.Material, table, column, remove_C14=False):
+    """Hash the nuclide densities of a material together with the sum of fractions options
+
+    Two materials with identical nuclide atom densities get the same fingerprint,
+    regardless of their name, id, or how the composition was specified.
+    The chain file is included because it determines the half lives used for classification.
+
+    Parameters:
+    -----------
+    material: openmc.Material
+        The material to fingerprint
+    table: int
+        The table used for the sum of fractions
+    column: int
+        The column used for the sum of fractions
+    remove_C14: bool
+        Whether C14 is removed from the sum of fractions
+
+    Returns:
+    --------
+    fingerprint: str
+        Hex digest identifying the composition and options
+    """
+
+    nuclide_atom_densities = material.get_nuclide_atom_densities()
+
+    hasher = hashlib.sha256()
+    for nuclide in sorted(nuclide_atom_densities.keys()):
+        # repr of a float round trips exactly, so equal densities always hash the same
+        hasher.update(f"{nuclide}:{float(nuclide_atom_densities[nuclide])!r};".encode())
+    hasher.update(repr((table, column, bool(remove_C14), str(openmc.config.get('chain_file')))).encode())
+
+    return hasher.hexdigest()
+
+def cached_sum_of_fractions(material:openmc.Material, table, column, remove_C14=False):
+    """Same as sum_of_fractions, but results are stored in a least recently used cache
+    keyed by the composition fingerprint, so classifying an identical composition again is a lookup.
+
+    Parameters and return values are the same as sum_of_fractions.
+    """
+
+    key = composition_fingerprint(material, table, column, remove_C14=remove_C14)
+
+    if key in _classification_cache:
+        _classification_cache.move_to_end(key)
+        result_sum_of_fractions, nuclide_fractions = _classification_cache[key]
+    else:
+        result_sum_of_fractions, nuclide_fractions = sum_of_fractions(material, table, column, remove_C14=remove_C14)
+        _classification_cache[key] = (result_sum_of_fractions, nuclide_fractions)
+        while len(_classification_cache) > CLASSIFICATION_CACHE_SIZE:
+            _classification_cache.popitem(last=False)
+
+    # Hand out a copy so callers can't modify what's in the cache
+    return result_sum_of_fractions, dict(nuclide_fractions)
+
+def load_classification_cache(cache_file):
+    """Add previously saved sum of fractions results to the cache
+    
+    Parameters:
+    -----------
+    cache_file: str
+        Path to a pickle written by save_classification_cache. Nothing happens if it doesn't exist.
+    """
+
+    if not os.path.exists(cache_file):
+        return
+
+    with open(cache_file, 'rb') as f:
+        saved_cache = pkl.load(f)
+
+    for key, value in saved_cache.items():
+        if key not in _classification_cache:
+            _classification_cache[key] = value
+    while len(_classification_cache) > CLASSIFICATION_CACHE_SIZE:
+        _classification_cache.popitem(last=False)
+
+def save_classification_cache(cache_file):
+    """Write the sum of fractions cache to disk so later runs can reuse it
+    
+    Parameters:
+    -----------
+    cache_file: str
+        Path of the pickle to write
+    """
+
+    # Write to a temporary file first so a process reading the cache never sees a partial pickle
+    temporary_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(temporary_file, 'wb') as f:
+        pkl.dump(dict(_classification_cache), f)
+    os.replace(temporary_file, cache_file)
+
+def clear_classification_cache():
+    """Remove every entry from the sum of fractions cache"""
+    _classification_cache.clear()
+
 def separate_nuclides(original_material:openmc.Material, nuclide_removal_efficiencies:dict):
     """Remove nuclides from a material with a given efficiency and return it as a new material
     with the remaining nuclides adjusted to maintain the same number of atoms,
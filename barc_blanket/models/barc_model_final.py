@@ -1,6 +1,8 @@
 import openmc
 import numpy as np
 from .materials import dt_plasma, tungsten, v4cr4ti, flibe
+from barc_blanket.multigroup import generate_mgxs_library, multigroup_model
+from barc_blanket.tally_results import HEATING_LAYERS
 
 DEFAULT_PARAMETERS = {
 
@@ -28,7 +30,15 @@ DEFAULT_PARAMETERS = {
     'inactive_batches': 5,
     'particles': int(1e5),
 
-    'photon_transport': False
+    'photon_transport': False,
+
+    # 'separate' gives each tally its own id (1-8), 'consolidated' puts the heating of every layer
+    # in one tally and the blanket flux and TBR in another, see barc_blanket.tally_results
+    'tally_layout': 'separate',
+
+    # Run in multigroup mode with a library made from the default geometry, see barc_blanket.multigroup
+    'multigroup': False,
+    'mgxs_group_structure': 'VITAMIN-J-175',
 }
 
 BLANKET_MATERIAL_ID = 5
@@ -59,6 +69,13 @@ def make_model(new_model_config=None):
             else:
                 print(f"Using set value for {key}:\t {model_config[key]}")
 
+    if model_config['multigroup']:
+        # One continuous energy run of the default geometry with these materials makes the library for any geometry
+        reference_config = {key: value for key, value in model_config.items()
+                            if key.endswith('_material') or key in ['batches', 'inactive_batches', 'particles']}
+        library_path = generate_mgxs_library(make_model(reference_config), model_config['mgxs_group_structure'])
+        return multigroup_model(make_model(dict(model_config, multigroup=False)), library_path)
+
     #####################
     ## Define Geometry ##
     #####################
@@ -207,61 +224,86 @@ def make_model(new_model_config=None):
     ## Define Tallies  ##
     #####################
 
-    first_wall_cell_filter = openmc.CellFilter([first_wall_cell])
-    vacuum_vessel_cell_filter = openmc.CellFilter([vacuum_vessel_cell])
-    cooling_channel_cell_filter = openmc.CellFilter([cooling_channel_cell])
-    cooling_vessel_cell_filter = openmc.CellFilter([cooling_vessel_cell])
-    blanket_cell_filter = openmc.CellFilter([blanket_cell])
-    blanket_vessel_cell_filter = openmc.CellFilter([blanket_vessel_cell])
-
     # Tallies for flux and TBR in flibe mixture
     flibe_cell_filter = openmc.CellFilter([cooling_channel_cell, blanket_cell])
     energy_filter = openmc.EnergyFilter(np.logspace(0,7)) # 1eV to 100MeV
 
-    flux_tally = openmc.Tally(tally_id=1, name="flux_blanket")
-    flux_tally.filters = [flibe_cell_filter,energy_filter]
-    flux_tally.scores = ["flux"]
-
-    tbr_tally = openmc.Tally(tally_id=2, name='TBR')
-    tbr_tally.filters = [flibe_cell_filter]
-    tbr_tally.scores = ['(n,Xt)']
-
-    # Tallies for neutron power deposition in each layer
-    first_wall_heating_tally = openmc.Tally(tally_id=3, name='neutron_heating_first_wall')
-    first_wall_heating_tally.filters = [first_wall_cell_filter]
-    first_wall_heating_tally.scores = ['heating']
-
-    cooling_channel_heating_tally = openmc.Tally(tally_id=4, name='neutron_heating_cooling_channel')
-    cooling_channel_heating_tally.filters = [cooling_channel_cell_filter]
-    cooling_channel_heating_tally.scores = ['heating']
-
-    cooling_vessel_heating_tally = openmc.Tally(tally_id=5, name='neutron_heating_cooling_vessel')
-    cooling_vessel_heating_tally.filters = [cooling_vessel_cell_filter]
-    cooling_vessel_heating_tally.scores = ['heating']
-
-    vacuum_vessel_heating_tally = openmc.Tally(tally_id=6, name='neutron_heating_vacuum_vessel')
-    vacuum_vessel_heating_tally.filters = [vacuum_vessel_cell_filter]
-    vacuum_vessel_heating_tally.scores = ['heating']
-
-    blanket_heating_tally = openmc.Tally(tally_id=7, name='neutron_heating_blanket')
-    blanket_heating_tally.filters = [blanket_cell_filter]
-    blanket_heating_tally.scores = ['heating']
+    if model_config['tally_layout'] == 'consolidated':
+        # One filter for flux and TBR, the TBR is the sum over the energy bins
+        flux_tbr_tally = openmc.Tally(name='flux_tbr_blanket')
+        flux_tbr_tally.filters = [flibe_cell_filter, energy_filter]
+        flux_tbr_tally.scores = ['flux', '(n,Xt)']
+
+        # Neutron power deposition in every layer, one bin per layer in the order of HEATING_LAYERS
+        layer_cells = {
+            'first_wall': first_wall_cell,
+            'cooling_channel': cooling_channel_cell,
+            'cooling_vessel': cooling_vessel_cell,
+            'vacuum_vessel': vacuum_vessel_cell,
+            'blanket': blanket_cell,
+            'blanket_vessel': blanket_vessel_cell,
+        }
+        heating_tally = openmc.Tally(name='neutron_heating')
+        heating_tally.filters = [openmc.CellFilter([layer_cells[layer] for layer in HEATING_LAYERS])]
+        heating_tally.scores = ['heating']
+
+        tallies = openmc.Tallies([flux_tbr_tally, heating_tally])
+
+    elif model_config['tally_layout'] == 'separate':
+        first_wall_cell_filter = openmc.CellFilter([first_wall_cell])
+        vacuum_vessel_cell_filter = openmc.CellFilter([vacuum_vessel_cell])
+        cooling_channel_cell_filter = openmc.CellFilter([cooling_channel_cell])
+        cooling_vessel_cell_filter = openmc.CellFilter([cooling_vessel_cell])
+        blanket_cell_filter = openmc.CellFilter([blanket_cell])
+        blanket_vessel_cell_filter = openmc.CellFilter([blanket_vessel_cell])
+
+        flux_tally = openmc.Tally(tally_id=1, name="flux_blanket")
+        flux_tally.filters = [flibe_cell_filter,energy_filter]
+        flux_tally.scores = ["flux"]
+
+        tbr_tally = openmc.Tally(tally_id=2, name='TBR')
+        tbr_tally.filters = [flibe_cell_filter]
+        tbr_tally.scores = ['(n,Xt)']
+
+        # Tallies for neutron power deposition in each layer
+        first_wall_heating_tally = openmc.Tally(tally_id=3, name='neutron_heating_first_wall')
+        first_wall_heating_tally.filters = [first_wall_cell_filter]
+        first_wall_heating_tally.scores = ['heating']
+
+        cooling_channel_heating_tally = openmc.Tally(tally_id=4, name='neutron_heating_cooling_channel')
+        cooling_channel_heating_tally.filters = [cooling_channel_cell_filter]
+        cooling_channel_heating_tally.scores = ['heating']
+
+        cooling_vessel_heating_tally = openmc.Tally(tally_id=5, name='neutron_heating_cooling_vessel')
+        cooling_vessel_heating_tally.filters = [cooling_vessel_cell_filter]
+        cooling_vessel_heating_tally.scores = ['heating']
+
+        vacuum_vessel_heating_tally = openmc.Tally(tally_id=6, name='neutron_heating_vacuum_vessel')
+        vacuum_vessel_heating_tally.filters = [vacuum_vessel_cell_filter]
+        vacuum_vessel_heating_tally.scores = ['heating']
+
+        blanket_heating_tally = openmc.Tally(tally_id=7, name='neutron_heating_blanket')
+        blanket_heating_tally.filters = [blanket_cell_filter]
+        blanket_heating_tally.scores = ['heating']
     
-    blanket_vessel_heating_tally = openmc.Tally(tally_id=8, name='neutron_heating_blanket_vessel')
-    blanket_vessel_heating_tally.filters = [blanket_vessel_cell_filter]
-    blanket_vessel_heating_tally.scores = ['heating']
-
-
-    tallies = openmc.Tallies([
-        flux_tally,
-        tbr_tally,
-        first_wall_heating_tally,
-        cooling_channel_heating_tally,
-        cooling_vessel_heating_tally,
-        vacuum_vessel_heating_tally,
-        blanket_heating_tally,
-        blanket_vessel_heating_tally
-    ])
+        blanket_vessel_heating_tally = openmc.Tally(tally_id=8, name='neutron_heating_blanket_vessel')
+        blanket_vessel_heating_tally.filters = [blanket_vessel_cell_filter]
+        blanket_vessel_heating_tally.scores = ['heating']
+
+
+        tallies = openmc.Tallies([
+            flux_tally,
+            tbr_tally,
+            first_wall_heating_tally,
+            cooling_channel_heating_tally,
+            cooling_vessel_heating_tally,
+            vacuum_vessel_heating_tally,
+            blanket_heating_tally,
+            blanket_vessel_heating_tally
+        ])
+
+    else:
+        raise ValueError(f"Invalid tally layout: {model_config['tally_layout']}")
 
     model = openmc.model.Model(
         geometry=geometry,
@@ -0,0 +1,153 @@
+import os
+import ast
+import sys
+import glob
+import shutil
+import hashlib
+import xml.etree.ElementTree as ET
+
+import openmc
+
+from barc_blanket.utilities import file_fingerprint, cache_directory, atomic_write
+
+# Exported models shared by every run, see cached_make_model
+MODEL_CACHE_DIRECTORY = cache_directory('model_cache', 'BARC_MODEL_CACHE')
+
+def merged_config(make_model, new_model_config=None):
+    """Configuration make_model ends up using, the DEFAULT_PARAMETERS of its module with new_model_config on top"""
+    model_config = dict(sys.modules[make_model.__module__].DEFAULT_PARAMETERS)
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+    return model_config
+
+def _config_value(value):
+    """Text that changes whenever a configuration value does, including the composition of materials"""
+    if isinstance(value, openmc.Material):
+        return ET.tostring(value.to_xml_element()).decode()
+    return repr(value)
+
+def _module_path(module_name, root_directory):
+    """Source file of a module under root_directory, or None if it isn't one of them"""
+    base = os.path.join(root_directory, *module_name.split('.'))
+    for path in [f"{base}.py", os.path.join(base, '__init__.py')]:
+        if os.path.exists(path):
+            return path
+    return None
+
+def package_dependencies(module_name, package='barc_blanket'):
+    """Source files of a module and every module of the package it imports, directly or through the others
+
+    Parameters
+    ----------
+    module_name : str
+        Module to start from, e.g. 'barc_blanket.models.barc_model_final'
+    package : str, optional
+        Only modules of this package are followed
+
+    Returns
+    -------
+    paths : list of str
+        Sorted paths of the source files
+    """
+
+    root_directory = os.path.dirname(sys.modules[package].__path__[0])
+    paths = set()
+    to_visit = [module_name]
+    while to_visit:
+        name = to_visit.pop()
+        path = _module_path(name, root_directory)
+        if path is None or path in paths:
+            continue
+        paths.add(path)
+
+        # Importing a module runs the __init__ of every package it's in
+        parts = name.split('.')
+        to_visit.extend('.'.join(parts[:i]) for i in range(1, len(parts)))
+
+        # Relative imports are relative to the package the module is in
+        current_package = name if path.endswith('__init__.py') else name.rpartition('.')[0]
+        with open(path, 'r') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                to_visit.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                if node.level > 0:
+                    base = '.'.join(current_package.split('.')[:len(current_package.split('.')) - node.level + 1])
+                    imported = f"{base}.{node.module}" if node.module else base
+                else:
+                    imported = node.module
+                to_visit.append(imported)
+                # from package import module
+                to_visit.extend(f"{imported}.{alias.name}" for alias in node.names)
+
+    return sorted(paths)
+
+def model_config_key(make_model, new_model_config=None):
+    """SHA-256 hex digest of the merged configuration of a model and the code that builds it
+
+    Parameters
+    ----------
+    make_model : callable
+        Function that makes the model from a configuration, e.g. barc_model_final.make_model
+    new_model_config : dict, optional
+        Configuration passed to make_model
+
+    Returns
+    -------
+    key : str
+        Hex digest, the same for the same configuration and model code
+    """
+
+    hasher = hashlib.sha256()
+    hasher.update(f"{make_model.__module__}.{make_model.__name__} {openmc.__version__}".encode())
+
+    # The model's module, every barc_blanket module it uses, and the tank inventories burner_mixture reads
+    package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tank_inventories = sorted(glob.glob(os.path.join(package_directory, 'materials', '*.xml')))
+    for path in package_dependencies(make_model.__module__) + tank_inventories:
+        hasher.update(file_fingerprint(path).encode())
+
+    for name, value in sorted(merged_config(make_model, new_model_config).items()):
+        hasher.update(f"{name}={_config_value(value)}\n".encode())
+
+    return hasher.hexdigest()
+
+def cached_make_model(make_model, new_model_config=None, model_path="model.xml", cache_directory=MODEL_CACHE_DIRECTORY):
+    """Make a model and export it to model_path, or copy the model.xml exported the last time
+    the same configuration was made and load that instead
+
+    Use this in place of make_model followed by export_to_model_xml.
+
+    Parameters
+    ----------
+    make_model : callable
+        Function that makes the model from a configuration, e.g. barc_model_final.make_model
+    new_model_config : dict, optional
+        Configuration to pass to make_model
+    model_path : str, optional
+        Where to put the model.xml
+    cache_directory : str, optional
+        Directory to keep the exported models in
+
+    Returns
+    -------
+    model : openmc.Model
+        The model, as exported to model_path
+    """
+
+    key = model_config_key(make_model, new_model_config)
+    cached_path = os.path.join(cache_directory, f"model_{key[:16]}.xml")
+
+    if os.path.exists(cached_path):
+        print(f"Reusing model from {cached_path}")
+        shutil.copyfile(cached_path, model_path)
+        return openmc.Model.from_model_xml(model_path)
+
+    model = make_model(new_model_config)
+    model.export_to_model_xml(model_path)
+
+    with atomic_write(cached_path) as temporary_path:
+        shutil.copyfile(model_path, temporary_path)
+
+    return model
@@ -0,0 +1,296 @@
+import os
+import copy
+import hashlib
+import warnings
+import xml.etree.ElementTree as ET
+
+import h5py
+import numpy as np
+
+import openmc
+import openmc.mgxs
+
+from barc_blanket.utilities import working_directory, file_fingerprint, cache_directory, atomic_write
+from barc_blanket.tally_results import read_tbr
+
+# MGXS libraries shared by every run, see generate_mgxs_library
+MGXS_CACHE_DIRECTORY = cache_directory('mgxs_cache', 'BARC_MGXS_CACHE')
+
+GROUP_STRUCTURE = 'VITAMIN-J-175'
+
+# Cross sections for transport, as needed by openmc.mgxs.Library.create_mg_library for a fixed source problem
+MGXS_TYPES = ['total', 'absorption', 'nu-scatter matrix', 'multiplicity matrix']
+
+# Scores multigroup mode can't tally, collapsed per material and group from the reference run
+# and folded with the multigroup flux instead
+RESPONSE_SCORES = ['(n,Xt)', 'heating']
+
+# Cells whose (n,Xt) rate is the TBR, the same as the 'TBR' tally of barc_model_final
+BREEDING_CELLS = ['cooling_channel_cell', 'blanket_cell']
+
+def _xsdata_name(material):
+    return f"material_{material.id}"
+
+def _composition(material):
+    """Material XML without the volume, which make_model sets from the geometry"""
+    element = material.to_xml_element()
+    element.attrib.pop('volume', None)
+    return ET.tostring(element)
+
+def mgxs_library_key(materials, group_structure=GROUP_STRUCTURE, legendre_order=3):
+    """SHA-256 hex digest of what a multigroup library depends on, apart from the reference geometry"""
+    hasher = hashlib.sha256()
+    hasher.update(file_fingerprint(openmc.config['cross_sections']).encode())
+    hasher.update(repr((group_structure, legendre_order, openmc.__version__)).encode())
+    for material in sorted(materials, key=lambda material: material.id):
+        hasher.update(_composition(material))
+    return hasher.hexdigest()
+
+def responses_path(library_path):
+    """File with the response cross sections that goes with a multigroup library"""
+    return library_path.replace('.h5', '_responses.h5')
+
+def response_cross_sections(tally, n_materials, n_groups):
+    """Collapse the 'multigroup_responses' tally of a reference run into a cross section for each of RESPONSE_SCORES
+
+    Parameters
+    ----------
+    tally : openmc.Tally
+        Tally with a MaterialFilter then an EnergyFilter, and the flux then RESPONSE_SCORES as scores
+    n_materials : int
+        Number of materials in the MaterialFilter
+    n_groups : int
+        Number of energy groups
+
+    Returns
+    -------
+    response_xs : numpy.ndarray
+        Rate of each score per unit flux, shape (materials, groups, scores), zero where there is no flux
+    """
+
+    # The energy bins vary fastest, as in every tally with more than one filter
+    rates = tally.mean.reshape(n_materials, n_groups, len(RESPONSE_SCORES) + 1)
+    flux = rates[..., :1]
+    return np.divide(rates[..., 1:], flux, out=np.zeros_like(rates[..., 1:]), where=flux > 0)
+
+def generate_mgxs_library(reference_model, group_structure=GROUP_STRUCTURE, legendre_order=3,
+                          cache_directory=MGXS_CACHE_DIRECTORY, force=False):
+    """Make a macroscopic multigroup library of every material from one continuous energy run of a reference model,
+    only running it the first time a set of material compositions and group structure is seen
+
+    Along with the library, the (n,Xt) and heating cross sections of each material are collapsed to the same groups,
+    since multigroup mode can't tally them, see multigroup_estimates.
+
+    Parameters
+    ----------
+    reference_model : openmc.Model
+        Continuous energy model to collapse the cross sections with, e.g. barc_model_final.make_model()
+    group_structure : str, optional
+        Name of a group structure in openmc.mgxs.GROUP_STRUCTURES
+    legendre_order : int, optional
+        Order of the scattering expansion
+    cache_directory : str, optional
+        Directory to keep the libraries in
+    force : bool, optional
+        Run the reference again even if the library is already there
+
+    Returns
+    -------
+    path : str
+        Path to the multigroup library, for openmc.Materials.cross_sections
+    """
+
+    materials = list(reference_model.geometry.get_all_materials().values())
+    key = mgxs_library_key(materials, group_structure, legendre_order)
+    path = os.path.abspath(os.path.join(cache_directory, f"mgxs_{key[:16]}.h5"))
+
+    if os.path.exists(path) and os.path.exists(responses_path(path)) and not force:
+        return path
+
+    groups = openmc.mgxs.EnergyGroups(group_structure)
+
+    library = openmc.mgxs.Library(reference_model.geometry)
+    library.energy_groups = groups
+    library.mgxs_types = MGXS_TYPES
+    library.domain_type = 'material'
+    library.domains = materials
+    library.by_nuclide = False
+    library.scatter_format = 'legendre'
+    library.legendre_order = legendre_order
+    library.correction = None
+    library.build_library()
+
+    reference = copy.deepcopy(reference_model)
+    reference.tallies = openmc.Tallies()
+    library.add_to_tallies_file(reference.tallies, merge=True)
+
+    response_tally = openmc.Tally(name='multigroup_responses')
+    response_tally.filters = [openmc.MaterialFilter(materials), openmc.EnergyFilter(groups.group_edges)]
+    response_tally.scores = ['flux'] + RESPONSE_SCORES
+    reference.tallies.append(response_tally)
+
+    reference_directory = os.path.join(cache_directory, f"reference_{key[:16]}")
+    os.makedirs(reference_directory, exist_ok=True)
+    with working_directory(reference_directory):
+        statepoint_path = reference.run()
+
+        with openmc.StatePoint(statepoint_path) as statepoint:
+            library.load_from_statepoint(statepoint)
+            response_xs = response_cross_sections(statepoint.get_tally(name='multigroup_responses'),
+                                                  len(materials), groups.num_groups)
+
+    # The responses are moved into place before the library, which is what marks the cache entry as done
+    mgxs_file = library.create_mg_library(xs_type='macro', xsdata_names=[_xsdata_name(material) for material in materials])
+    with atomic_write(path) as temporary_path, atomic_write(responses_path(path)) as temporary_responses_path:
+        mgxs_file.export_to_hdf5(temporary_path)
+        with h5py.File(temporary_responses_path, 'w') as f:
+            f.attrs['scores'] = RESPONSE_SCORES
+            f.create_dataset('group_edges', data=groups.group_edges)
+            for material, material_xs in zip(materials, response_xs):
+                f.create_dataset(_xsdata_name(material), data=material_xs)
+
+    return path
+
+def multigroup_model(model, library_path):
+    """Copy of a continuous energy model that runs in multigroup mode with a library from generate_mgxs_library
+
+    Every material becomes the macroscopic data of the material it replaces, named after it,
+    and the tallies become one tally of the group flux in each cell, see multigroup_estimates.
+
+    Parameters
+    ----------
+    model : openmc.Model
+        Continuous energy model, made from the same materials as the library
+    library_path : str
+        Path to the multigroup library
+
+    Returns
+    -------
+    model : openmc.Model
+        Multigroup model
+    """
+
+    model = copy.deepcopy(model)
+
+    multigroup_materials = {}
+    for material in model.geometry.get_all_materials().values():
+        multigroup_material = openmc.Material(name=_xsdata_name(material))
+        multigroup_material.set_density('macro', 1.0)
+        multigroup_material.add_macroscopic(_xsdata_name(material))
+        multigroup_materials[material.id] = multigroup_material
+
+    material_cells = list(model.geometry.get_all_material_cells().values())
+    for cell in material_cells:
+        cell.fill = multigroup_materials[cell.fill.id]
+
+    model.materials = openmc.Materials(multigroup_materials.values())
+    model.materials.cross_sections = library_path
+
+    model.settings.energy_mode = 'multi-group'
+    model.settings.photon_transport = False
+
+    with h5py.File(responses_path(library_path), 'r') as f:
+        group_edges = f['group_edges'][()]
+    flux_tally = openmc.Tally(name='multigroup_flux')
+    flux_tally.filters = [openmc.CellFilter(material_cells), openmc.EnergyFilter(group_edges)]
+    flux_tally.scores = ['flux']
+    model.tallies = openmc.Tallies([flux_tally])
+
+    return model
+
+def multigroup_estimates(model, statepoint_path):
+    """Fold the group flux of a multigroup run with the response cross sections of its library
+
+    Parameters
+    ----------
+    model : openmc.Model
+        Multigroup model from multigroup_model
+    statepoint_path : str
+        Statepoint of the run
+
+    Returns
+    -------
+    estimates : dict
+        'tbr' and the rate of each of RESPONSE_SCORES in each cell, keyed by score then cell name,
+        per source particle like the continuous energy tallies
+    """
+
+    cells = model.geometry.get_all_cells()
+    with openmc.StatePoint(statepoint_path) as statepoint:
+        tally = statepoint.get_tally(name='multigroup_flux')
+        cell_ids = tally.find_filter(openmc.CellFilter).bins
+        flux = tally.mean.reshape(len(cell_ids), -1)
+
+    estimates = {score: {} for score in RESPONSE_SCORES}
+    with h5py.File(responses_path(model.materials.cross_sections), 'r') as f:
+        for cell_id, cell_flux in zip(cell_ids, flux):
+            cell = cells[cell_id]
+            response_xs = f[cell.fill.name][()]
+            for i, score in enumerate(RESPONSE_SCORES):
+                estimates[score][cell.name] = float(cell_flux @ response_xs[:, i])
+
+    estimates['tbr'] = sum(estimates['(n,Xt)'].get(name, 0.0) for name in BREEDING_CELLS)
+    return estimates
+
+class MultigroupEstimator:
+    """Fast multigroup TBR and heating estimates for barc_model_final configurations,
+    with every check_interval-th estimate also run in continuous energy to keep it honest
+
+    Parameters
+    ----------
+    check_interval : int, optional
+        Run a continuous energy check on the first estimate and every check_interval-th after it
+    tolerance : float, optional
+        Relative difference in TBR above which a check warns
+    directory : str, optional
+        Directory to run in
+    """
+
+    def __init__(self, check_interval=10, tolerance=0.02, directory="multigroup"):
+        self.check_interval = check_interval
+        self.tolerance = tolerance
+        self.directory = directory
+        self.estimates = 0
+        self.checks = []
+
+    def estimate(self, model_config=None):
+        """Estimate the TBR and heating of a configuration in multigroup mode, see multigroup_estimates"""
+        # Imported here since barc_model_final uses this module for its multigroup option
+        from barc_blanket.models.barc_model_final import make_model
+
+        model_config = dict(model_config or {}, multigroup=True)
+        run_directory = os.path.join(self.directory, f"estimate_{self.estimates}")
+        os.makedirs(run_directory, exist_ok=True)
+        with working_directory(run_directory):
+            model = make_model(model_config)
+            estimates = multigroup_estimates(model, model.run())
+
+        if self.estimates % self.check_interval == 0:
+            self.check(model_config, estimates)
+        self.estimates += 1
+
+        return estimates
+
+    def check(self, model_config, estimates):
+        """Run a configuration in continuous energy and compare its TBR with the multigroup estimate"""
+        from barc_blanket.models.barc_model_final import make_model
+
+        check_directory = os.path.join(self.directory, f"check_{self.estimates}")
+        os.makedirs(check_directory, exist_ok=True)
+        with working_directory(check_directory):
+            model = make_model(dict(model_config, multigroup=False))
+            with openmc.StatePoint(model.run()) as statepoint:
+                continuous_energy_tbr = read_tbr(statepoint)
+
+        relative_difference = abs(estimates['tbr'] - continuous_energy_tbr) / continuous_energy_tbr
+        self.checks.append({'estimate': self.estimates,
+                            'multigroup_tbr': estimates['tbr'],
+                            'continuous_energy_tbr': continuous_energy_tbr,
+                            'relative_difference': relative_difference})
+
+        if relative_difference > self.tolerance:
+            warnings.warn(f"Multigroup TBR {estimates['tbr']:0.4f} is {100*relative_difference:0.1f}% off "
+                          f"the continuous energy TBR {continuous_energy_tbr:0.4f}, "
+                          f"consider regenerating the library with a closer reference geometry")
+
+        return relative_difference
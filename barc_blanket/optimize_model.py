@@ -1,5 +1,7 @@
 import openmc
 
+from barc_blanket.tally_results import read_first_cell_tbr
+
 
 def evaluate_metric(model:openmc.Model, metric):
     """ Evaluate the metric for the given model
@@ -34,6 +36,10 @@ def tritium_breeding_ratio(model:openmc.Model):
     
     Calculate the tritium breeding ratio for the given model
 
+    This is only the (n,Xt) rate in the first breeding cell, the cooling channel, as in every earlier sweep,
+    so the metric stays comparable with them. The full TBR summed over both breeding cells is read_tbr,
+    which should replace this as a separate change along with rerunning the sweeps.
+
     Parameters:
     ----------
     model : openmc.Model
@@ -46,14 +52,8 @@ def tritium_breeding_ratio(model:openmc.Model):
     """
 
     # Run the model
-    model.run()
-    final_statepoint = openmc.StatePoint("statepoint.50.h5")
-
-    # Get tally results
-    # TODO: do this programmatically instead of hardcoded here
-    tallies = final_statepoint.tallies
-    tbr_tally_id = 2
-    tally_result = tallies[tbr_tally_id].mean[0][0][0]
-    
+    with openmc.StatePoint(model.run()) as final_statepoint:
+        tally_result = read_first_cell_tbr(final_statepoint)
+
     # TODO do some volume weighting or whatever to get an actual TBR
     return tally_result
\ No newline at end of file
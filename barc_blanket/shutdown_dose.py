@@ -0,0 +1,871 @@
+import os
+import copy
+import hashlib
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+
+import openmc
+import openmc.lib
+
+from barc_blanket.utilities import model_fingerprint, working_directory
+from barc_blanket.depletion_results import available_cross_section_nuclides, material_from_atoms
+
+# Photon energy group boundaries in eV for the dose response
+PHOTON_GROUP_BOUNDARIES = np.array([1e4, 5e4, 1e5, 2e5, 3e5, 4e5, 6e5, 8e5, 1e6, 1.22e6, 1.44e6,
+                                    1.66e6, 2e6, 2.5e6, 3e6, 4e6, 5e6, 6.5e6, 8e6, 1e7])
+
+DOSE_RESPONSE_FILE = "dose_response.h5"
+
+def dose_tally(mesh, geometry="AP", born_cells=None):
+    """Photon dose tally on a mesh, in pSv-cm3 per source photon
+
+    Parameters
+    ----------
+    mesh : openmc.MeshBase
+        Mesh to tally the dose on
+    geometry : str, optional
+        ICRP incident dose field direction. AP, PA, LLAT, RLAT, ROT, ISO are available, AP is front facing.
+    born_cells : list of openmc.Cell, optional
+        If provided, split the dose by the cell each photon was emitted in, as the first filter
+
+    Returns
+    -------
+    tally : openmc.Tally
+        Tally named 'photon_dose_on_mesh'
+    """
+
+    energies, pSv_cm2 = openmc.data.dose_coefficients(particle="photon", geometry=geometry)
+    dose_filter = openmc.EnergyFunctionFilter(
+        energies, pSv_cm2, interpolation="cubic" # Apparently cubic interpolation is recommended by ICRP
+    )
+    particle_filter = openmc.ParticleFilter(["photon"])
+    mesh_filter = openmc.MeshFilter(mesh)
+    tally = openmc.Tally(name="photon_dose_on_mesh")
+    tally.filters = [mesh_filter, dose_filter, particle_filter]
+    if born_cells is not None:
+        tally.filters.insert(0, openmc.CellBornFilter(born_cells))
+    tally.scores = ["flux"]
+    return tally
+
+def torus_section_mesh(model, cells=None, radial_width=5.0, vertical_width=5.0, toroidal_bins=1, margin=0.0):
+    """Cylindrical mesh around the z axis covering the toroidal section of a model, so no voxels
+    are spent on the hole of the torus or the rest of the bounding sphere like a RegularMesh.from_domain would
+
+    The mesh spans radially from the innermost to the outermost extent of the ZTorus surfaces bounding the cells,
+    vertically up to the tallest of them, and toroidally the angle between the periodic planes,
+    so tori on different major radii and elongated tori are covered too.
+
+    Parameters
+    ----------
+    model : openmc.Model
+        Toroidal section model, e.g. from barc_model_simple_toroidal
+    cells : list of openmc.Cell, optional
+        Cells to cover. Default is every cell in the model
+    radial_width : float, optional
+        Largest radial width of a voxel in cm
+    vertical_width : float, optional
+        Largest vertical width of a voxel in cm
+    toroidal_bins : int, optional
+        Number of voxels across the section toroidally
+    margin : float, optional
+        Distance in cm to extend the mesh past the outermost torus, for the dose just outside the vessels
+
+    Returns
+    -------
+    mesh : openmc.CylindricalMesh
+        Mesh aligned with the toroidal section
+    """
+
+    if cells is None:
+        cells = list(model.geometry.get_all_cells().values())
+
+    tori = [surface for cell in cells if cell.region is not None
+            for surface in cell.region.get_surfaces().values() if isinstance(surface, openmc.ZTorus)]
+
+    if len(tori) == 0:
+        raise ValueError("No ZTorus surfaces bound the cells")
+
+    phi_min, phi_max = _section_phi_bounds(cells)
+
+    # b is the vertical semi-axis of a ZTorus and c the horizontal one
+    r_min = max(min(torus.a - torus.c for torus in tori) - margin, 0.0)
+    r_max = max(torus.a + torus.c for torus in tori) + margin
+    z_max = max(torus.z0 + torus.b for torus in tori) + margin
+    z_min = min(torus.z0 - torus.b for torus in tori) - margin
+
+    r_grid = np.linspace(r_min, r_max, int(np.ceil((r_max - r_min) / radial_width)) + 1)
+    z_grid = np.linspace(z_min, z_max, int(np.ceil((z_max - z_min) / vertical_width)) + 1)
+    phi_grid = np.linspace(phi_min, phi_max, toroidal_bins + 1)
+
+    return openmc.CylindricalMesh(r_grid=r_grid, z_grid=z_grid, phi_grid=phi_grid, name="torus_section_mesh")
+
+def _section_phi_bounds(cells):
+    """Toroidal angles in radians of the periodic planes bounding the cells, or the full torus if there are none"""
+    phi_bounds = set()
+    for cell in cells:
+        if cell.region is None:
+            continue
+        for surface in cell.region.get_surfaces().values():
+            if isinstance(surface, openmc.Plane) and surface.boundary_type == 'periodic':
+                # Periodic planes contain the z axis, so this is the angle of the plane in the xy plane
+                phi_bounds.add(np.arctan2(surface.a, -surface.b) % np.pi)
+
+    if len(phi_bounds) < 2:
+        return 0.0, 2*np.pi
+    return min(phi_bounds), max(phi_bounds)
+
+def plot_section_dose(dose_rate, mesh, filename, norm=None):
+    """Plot a dose rate on a torus section mesh in the r-z plane, averaged toroidally
+
+    Parameters
+    ----------
+    dose_rate : numpy.ndarray
+        Dose rate on each voxel in µSv/h, e.g. from dose_rate_uSv_per_hour
+    mesh : openmc.CylindricalMesh
+        Mesh the dose was tallied on, e.g. from torus_section_mesh
+    filename : str
+        File to save the plot to
+    norm : matplotlib.colors.Normalize, optional
+        Colour scale. Default is a linear scale over the data
+    """
+
+    n_r, n_phi, n_z = mesh.dimension
+    section_dose_rate = np.reshape(dose_rate, (n_r, n_phi, n_z), order='F').mean(axis=1)
+
+    fig, ax = plt.subplots()
+    image = ax.pcolormesh(mesh.r_grid, mesh.z_grid, section_dose_rate.T, norm=norm)
+    fig.colorbar(image, ax=ax, label="Decay photon dose [µSv/h]")
+    ax.set_xlabel("r [cm]")
+    ax.set_ylabel("z [cm]")
+    ax.set_aspect('equal')
+    fig.savefig(filename)
+    plt.close(fig)
+
+def read_dose_tally(statepoint_path, tally_name="photon_dose_on_mesh"):
+    """Load a dose mesh tally from a statepoint as a flat array, in pSv-cm3 per source photon"""
+    with openmc.StatePoint(statepoint_path) as statepoint:
+        return statepoint.get_tally(name=tally_name).mean.ravel()
+
+def _mesh_vertices(mesh):
+    """Cartesian coordinates of the vertices of a structured mesh, x, r or first index fastest, shape (vertices, 3)"""
+    if isinstance(mesh, openmc.CylindricalMesh):
+        r, phi, z = np.meshgrid(mesh.r_grid, mesh.phi_grid, mesh.z_grid, indexing='ij')
+        vertices = [r * np.cos(phi), r * np.sin(phi), z]
+    elif isinstance(mesh, openmc.RegularMesh):
+        grids = [np.linspace(lower, upper, n + 1)
+                 for lower, upper, n in zip(mesh.lower_left, mesh.upper_right, mesh.dimension)]
+        vertices = np.meshgrid(*grids, indexing='ij')
+    else:
+        raise TypeError(f"Can't write {type(mesh).__name__} to VTK")
+    return np.column_stack([coordinate.ravel(order='F') for coordinate in vertices])
+
+def write_dose_vtk(dose_rate, mesh, filename, name="dose_rate_uSv_per_h"):
+    """Write a dose rate on a structured mesh to a binary legacy VTK file, without needing the vtk package
+
+    Parameters
+    ----------
+    dose_rate : numpy.ndarray
+        Dose rate on each voxel in µSv/h
+    mesh : openmc.CylindricalMesh or openmc.RegularMesh
+        Mesh the dose was tallied on
+    filename : str
+        File to write to, usually ending in '.vtk'
+    name : str, optional
+        Name of the data in the file
+    """
+
+    vertices = _mesh_vertices(mesh)
+    dimension = [n + 1 for n in mesh.dimension]
+
+    with open(filename, 'wb') as f:
+        f.write(b"# vtk DataFile Version 3.0\n")
+        f.write(b"Shutdown dose rate\nBINARY\nDATASET STRUCTURED_GRID\n")
+        f.write(f"DIMENSIONS {dimension[0]} {dimension[1]} {dimension[2]}\n".encode())
+        f.write(f"POINTS {len(vertices)} float\n".encode())
+        f.write(vertices.astype('>f4').tobytes())
+        f.write(f"\nCELL_DATA {np.size(dose_rate)}\nSCALARS {name} float 1\nLOOKUP_TABLE default\n".encode())
+        f.write(np.asarray(dose_rate, dtype='>f4').tobytes())
+        f.write(b"\n")
+
+def _render_step(dose_rate, mesh, png_file, vtk_file, vmin, vmax):
+    plot_section_dose(dose_rate, mesh, png_file, norm=LogNorm(vmin=vmin, vmax=vmax))
+    write_dose_vtk(dose_rate, mesh, vtk_file)
+    return png_file
+
+def render_dose_maps(dose_rates, mesh, directory="dose_maps", prefix="dose_map", workers=None):
+    """Write a PNG slice and a VTK file of the dose rate at every step, in parallel worker processes
+
+    Every PNG has the same colour scale, from the smallest positive to the largest dose rate of any step,
+    so frames can be compared directly.
+
+    Parameters
+    ----------
+    dose_rates : numpy.ndarray
+        Dose rate on each voxel in µSv/h at every step, shape (steps, voxels),
+        e.g. from dose_rate_uSv_per_hour or read_dose_tally
+    mesh : openmc.CylindricalMesh or openmc.RegularMesh
+        Mesh the dose was tallied on
+    directory : str, optional
+        Directory to write the files to
+    prefix : str, optional
+        Start of each file name, followed by '_step_<step>'
+    workers : int, optional
+        Number of worker processes. Default is the number of CPUs
+
+    Returns
+    -------
+    png_files : list of str
+        PNG written for each step
+    """
+
+    dose_rates = np.asarray(dose_rates)
+    positive = dose_rates[dose_rates > 0.0]
+    if len(positive) == 0:
+        raise ValueError("No step has a positive dose rate to plot")
+    vmin, vmax = positive.min(), positive.max()
+
+    os.makedirs(directory, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_step, step_dose_rate, mesh,
+                                   os.path.join(directory, f"{prefix}_step_{step}.png"),
+                                   os.path.join(directory, f"{prefix}_step_{step}.vtk"),
+                                   vmin, vmax)
+                   for step, step_dose_rate in enumerate(dose_rates)]
+        return [future.result() for future in futures]
+
+def photon_settings(particles, batches):
+    """Fixed source photon transport settings, without a source"""
+    settings = openmc.Settings()
+    settings.particles = particles
+    settings.batches = batches
+    settings.run_mode = "fixed source"
+    settings.photon_transport = True
+    return settings
+
+def dose_rate_uSv_per_hour(dose, mesh):
+    """Convert a dose in pSv-cm3/s on each voxel of a mesh to µSv/h
+
+    Parameters
+    ----------
+    dose : numpy.ndarray
+        Dose on each voxel in pSv-cm3/s, with voxels on the last axis
+    mesh : openmc.MeshBase
+        Mesh the dose was tallied on
+
+    Returns
+    -------
+    dose_rate : numpy.ndarray
+        Dose rate on each voxel in µSv/h
+    """
+
+    pico_to_micro = 1e-6
+    seconds_to_hours = 60*60
+    voxel_volumes = np.asarray(mesh.volumes).ravel(order='F')
+    return dose * seconds_to_hours * pico_to_micro / voxel_volumes
+
+def _dose_response_key(model, mesh, cells, group_boundaries, particles, batches):
+    """SHA-256 hex digest of everything the dose response depends on"""
+    hasher = hashlib.sha256()
+    hasher.update(model_fingerprint(model).encode())
+    hasher.update(ET.tostring(mesh.to_xml_element()))
+    hasher.update(repr(([cell.id for cell in cells], np.asarray(group_boundaries).tolist(), particles, batches)).encode())
+    return hasher.hexdigest()
+
+def build_dose_response(model, mesh, cells, group_boundaries=PHOTON_GROUP_BOUNDARIES, particles=10000, batches=10,
+                        response_file=DOSE_RESPONSE_FILE):
+    """Run one photon transport per activated cell and energy group with a unit source to get
+    the dose on the mesh from one photon per second emitted in that cell and group.
+
+    The geometry and materials don't change between cooling times, only the sources do,
+    so the dose for any number of cooling times or irradiation scenarios is then a matrix product, see dose_maps.
+    Photons are emitted uniformly in energy within each group.
+
+    The response is saved to response_file, and read back instead of running transport
+    if it was made with the same model, mesh, cells, groups, particles and batches.
+
+    Parameters
+    ----------
+    model : openmc.Model
+        Model with the geometry and materials to transport photons through
+    mesh : openmc.MeshBase
+        Mesh to tally the dose on
+    cells : list of openmc.Cell
+        Activated cells that emit decay photons
+    group_boundaries : numpy.ndarray, optional
+        Photon energy group boundaries in eV
+    particles : int, optional
+        Particles per batch of each transport
+    batches : int, optional
+        Batches of each transport
+    response_file : str, optional
+        HDF5 file to save the response to
+
+    Returns
+    -------
+    response : numpy.ndarray
+        Dose on each voxel in pSv-cm3 per source photon, shape (cells, groups, voxels)
+    """
+
+    key = _dose_response_key(model, mesh, cells, group_boundaries, particles, batches)
+
+    if os.path.exists(response_file):
+        with h5py.File(response_file, 'r') as f:
+            if f.attrs.get('key') == key:
+                print(f"Loaded dose response from {response_file}")
+                return f['response'][()]
+
+    n_groups = len(group_boundaries) - 1
+    response = None
+
+    for i, cell in enumerate(cells):
+        for group in range(n_groups):
+            settings = photon_settings(particles, batches)
+            settings.source = openmc.IndependentSource(
+                space=openmc.stats.Box(*cell.bounding_box),
+                energy=openmc.stats.Uniform(group_boundaries[group], group_boundaries[group+1]),
+                particle="photon",
+                strength=1.0,
+                domains=[cell],
+            )
+
+            response_model = openmc.Model(model.geometry, model.materials, settings, openmc.Tallies([dose_tally(mesh)]))
+            run_directory = f"dose_response/cell_{cell.id}_group_{group}"
+            os.makedirs(run_directory, exist_ok=True)
+            print(f"Dose response for cell {cell.id}, group {group+1} of {n_groups}")
+            statepoint_path = response_model.run(cwd=run_directory)
+
+            with openmc.StatePoint(statepoint_path) as statepoint:
+                mean = statepoint.get_tally(name="photon_dose_on_mesh").mean.ravel()
+
+            if response is None:
+                response = np.zeros((len(cells), n_groups, len(mean)))
+            response[i, group] = mean
+
+    with h5py.File(response_file, 'w') as f:
+        f.attrs['key'] = key
+        f.create_dataset('response', data=response)
+        f.create_dataset('group_boundaries', data=np.asarray(group_boundaries))
+        f.create_dataset('cell_ids', data=np.array([cell.id for cell in cells]))
+
+    return response
+
+def group_photon_sources(energies, intensities, group_boundaries=PHOTON_GROUP_BOUNDARIES):
+    """Sum decay photon line intensities into energy groups
+
+    Parameters
+    ----------
+    energies : numpy.ndarray
+        Photon line energies in eV
+    intensities : numpy.ndarray
+        Intensity of each line in photons/s, with lines on the last axis,
+        e.g. from DepletionResultsView.photon_intensities
+    group_boundaries : numpy.ndarray, optional
+        Photon energy group boundaries in eV
+
+    Returns
+    -------
+    group_sources : numpy.ndarray
+        Photons/s in each group, with groups on the last axis. Lines outside the groups are dropped.
+    """
+
+    n_groups = len(group_boundaries) - 1
+    groups = np.searchsorted(group_boundaries, energies, side='right') - 1
+    inside = (groups >= 0) & (groups < n_groups)
+
+    grouping = np.zeros((len(energies), n_groups))
+    grouping[np.flatnonzero(inside), groups[inside]] = 1.0
+
+    return np.asarray(intensities) @ grouping
+
+def dose_maps(response, group_sources):
+    """Dose on every voxel for any number of cooling times or scenarios from the dose response
+
+    Parameters
+    ----------
+    response : numpy.ndarray
+        Dose response from build_dose_response, shape (cells, groups, voxels)
+    group_sources : numpy.ndarray
+        Photons/s emitted in each cell and group, shape (..., cells, groups)
+
+    Returns
+    -------
+    dose : numpy.ndarray
+        Dose on each voxel in pSv-cm3/s, shape (..., voxels)
+    """
+
+    return np.einsum('...cg,cgv->...v', group_sources, response)
+
+def depleted_dose_maps(model, mesh, cells, results, group_sources, group_boundaries=PHOTON_GROUP_BOUNDARIES,
+                       particles=10000, batches=10, directory="depleted_dose"):
+    """Dose on the mesh at every step with the activated cells filled with their depleted compositions
+
+    OpenMC can't change a source once it's initialized, so there is one openmc.lib session per photon group,
+    with a unit source in every activated cell, split up again with a CellBornFilter.
+    Within a session the depleted compositions of each step are set in place with openmc.lib,
+    so the cross sections and geometry stay loaded across all the steps, and nothing is exported again.
+    Steps with no photons in a group are skipped.
+
+    Parameters
+    ----------
+    model : openmc.Model
+        Model with the geometry and materials to transport photons through
+    mesh : openmc.MeshBase
+        Mesh to tally the dose on
+    cells : list of openmc.Cell
+        Activated cells that emit decay photons, filled with materials depleted in results
+    results : barc_blanket.depletion_results.DepletionResultsView
+        Depletion results with the compositions of the activated cells at every step
+    group_sources : numpy.ndarray
+        Photons/s emitted in each cell and group at every step, shape (steps, cells, groups)
+    group_boundaries : numpy.ndarray, optional
+        Photon energy group boundaries in eV
+    particles : int, optional
+        Particles per batch of each transport
+    batches : int, optional
+        Batches of each transport
+    directory : str, optional
+        Directory to run the sessions in
+
+    Returns
+    -------
+    dose : numpy.ndarray
+        Dose on each voxel in pSv-cm3/s, shape (steps, voxels)
+    """
+
+    model = copy.deepcopy(model)
+    model_cells = model.geometry.get_all_cells()
+    cells = [model_cells[cell.id] for cell in cells]
+    n_steps, n_cells, n_groups = group_sources.shape
+
+    # Every nuclide the depleted materials ever have needs to be loaded when the session starts
+    compositions = depleted_compositions(results, [cell.fill.id for cell in cells], available_cross_section_nuclides())
+    for cell in cells:
+        material_id = cell.fill.id
+        volume = results.volumes[str(material_id)]
+        nuclides, densities = compositions[material_id]
+
+        # Densities back to atoms, since material_from_atoms takes atoms
+        depleted_material = material_from_atoms(nuclides, 1e24 * volume * np.max(densities, axis=0), volume,
+                                                material_id=material_id)
+        depleted_material.name = cell.fill.name
+        model.materials[model.materials.index(cell.fill)] = depleted_material
+        cell.fill = depleted_material
+
+    tally = dose_tally(mesh, born_cells=cells)
+    model.tallies = openmc.Tallies([tally])
+    model.settings = photon_settings(particles, batches)
+
+    dose = np.zeros((n_steps, int(np.prod(mesh.dimension))))
+    for group in range(n_groups):
+        steps = np.flatnonzero(np.any(group_sources[:, :, group] > 0.0, axis=1))
+        if len(steps) == 0:
+            continue
+
+        # Equal strengths, so each cell emits 1/n_cells of the photons
+        model.settings.source = [openmc.IndependentSource(
+            space=openmc.stats.Box(*cell.bounding_box),
+            energy=openmc.stats.Uniform(group_boundaries[group], group_boundaries[group+1]),
+            particle="photon",
+            strength=1.0,
+            domains=[cell],
+        ) for cell in cells]
+
+        group_directory = os.path.join(directory, f"group_{group}")
+        os.makedirs(group_directory, exist_ok=True)
+        with working_directory(group_directory):
+            model.export_to_model_xml()
+            with openmc.lib.run_in_memory():
+                for step in steps:
+                    print(f"Depleted dose for group {group+1} of {n_groups}, step {step}")
+                    response = _depleted_step_response(compositions, step, tally.id, n_cells)
+                    dose[step] += group_sources[step, :, group] @ response
+
+    return dose
+
+def depleted_compositions(results, material_ids, nuc_with_data):
+    """Nuclides and atom densities of depleted materials at every step, for setting with openmc.lib
+
+    Parameters
+    ----------
+    results : barc_blanket.depletion_results.DepletionResultsView
+        Depletion results with the materials
+    material_ids : iterable of int
+        IDs of the materials
+    nuc_with_data : set of str
+        Nuclides with cross sections, the others are left out like export_to_materials does
+
+    Returns
+    -------
+    compositions : dict of int to tuple
+        Nuclides with data and positive atoms at some step, and their atom densities in atom/b-cm
+        at every step, shape (steps, nuclides), for each material
+    """
+
+    compositions = {}
+    for material_id in material_ids:
+        volume = results.volumes[str(material_id)]
+        atoms = results.atoms(material_id)
+        present = (np.max(atoms, axis=0) > 0.0) & np.array([nuclide in nuc_with_data for nuclide in results.nuclides])
+        nuclides = [nuclide for nuclide, keep in zip(results.nuclides, present) if keep]
+        compositions[material_id] = (nuclides, 1e-24 * atoms[:, present] / volume)
+    return compositions
+
+def positive_densities(nuclides, densities):
+    """Only the nuclides with a positive density, as openmc.lib.Material.set_densities needs.
+    Nuclides that aren't made yet are zero, and the depletion solver can leave small negative values."""
+    positive = np.asarray(densities) > 0.0
+    return [nuclide for nuclide, keep in zip(nuclides, positive) if keep], np.asarray(densities)[positive]
+
+def _depleted_step_response(compositions, step, tally_id, n_cells):
+    """Set the compositions of one step in the running openmc.lib session, transport,
+    and return the dose per photon emitted in each cell, shape (cells, voxels)"""
+    for material_id, (nuclides, densities) in compositions.items():
+        openmc.lib.materials[material_id].set_densities(*positive_densities(nuclides, densities[step]))
+
+    openmc.lib.reset()
+    openmc.lib.run()
+
+    # Equal strengths, so each cell emits 1/n_cells of the source photons
+    return n_cells * np.reshape(openmc.lib.tallies[tally_id].mean, (n_cells, -1))
+
+# MT numbers of the photon interactions that make up the total cross section,
+# the photoelectric subshells (534 onwards) are already included in 522
+PHOTON_TOTAL_MTS = (502, 504, 515, 517, 522)
+
+def _walk_halfspaces(region):
+    """Every halfspace in a region made of intersections"""
+    if isinstance(region, openmc.Halfspace):
+        yield region
+    elif isinstance(region, openmc.Intersection):
+        for node in region:
+            yield from _walk_halfspaces(node)
+
+def torus_layers(cells):
+    """Minor radii bounding each cell that is a layer between two tori
+
+    Only circular tori sharing one major radius are supported, like those of barc_model_simple_toroidal.
+
+    Parameters
+    ----------
+    cells : iterable of openmc.Cell
+        Cells to look at, cells that aren't bounded by a ZTorus are skipped
+
+    Returns
+    -------
+    major_radius : float
+        Major radius of the tori in cm
+    layers : dict of openmc.Cell to tuple of float
+        Inner and outer minor radii of each layer in cm. Cells only inside a torus have an inner radius of 0,
+        and cells only outside a torus have an outer radius of infinity.
+    """
+
+    major_radii = set()
+    layers = {}
+    for cell in cells:
+        inner, outer = 0.0, np.inf
+        for halfspace in _walk_halfspaces(cell.region):
+            torus = halfspace.surface
+            if isinstance(torus, openmc.ZTorus):
+                if not np.isclose(torus.b, torus.c):
+                    raise ValueError(f"ZTorus {torus.id} is elliptical (b={torus.b}, c={torus.c}), only circular tori are supported")
+                major_radii.add(torus.a)
+                if halfspace.side == '+':
+                    inner = torus.b
+                else:
+                    outer = torus.b
+        if inner > 0.0 or np.isfinite(outer):
+            layers[cell] = (inner, outer)
+
+    if len(major_radii) == 0:
+        raise ValueError("No ZTorus surfaces bound the cells")
+    if not np.allclose(list(major_radii), min(major_radii)):
+        raise ValueError(f"The tori have different major radii {sorted(major_radii)}, they must share one")
+    major_radius = min(major_radii)
+
+    return major_radius, layers
+
+@lru_cache(maxsize=None)
+def _incident_photon(path):
+    return openmc.data.IncidentPhoton.from_hdf5(path)
+
+def attenuation_coefficients(material, energies, cross_sections=None):
+    """Linear attenuation coefficient of a material from the photon data OpenMC transports with
+
+    Parameters
+    ----------
+    material : openmc.Material or None
+        Material to get the attenuation of. None is a void.
+    energies : numpy.ndarray
+        Photon energies in eV
+    cross_sections : str, optional
+        Path to cross_sections.xml. Default is openmc.config['cross_sections']
+
+    Returns
+    -------
+    mu : numpy.ndarray
+        Attenuation coefficient at each energy in 1/cm
+    """
+
+    energies = np.asarray(energies, dtype=float)
+    mu = np.zeros_like(energies)
+    if material is None:
+        return mu
+
+    if cross_sections is None:
+        cross_sections = openmc.config['cross_sections']
+    library = openmc.data.DataLibrary.from_xml(cross_sections)
+
+    # Atom densities are in atom/b-cm and cross sections in barns
+    for element, atom_density in material.get_element_atom_densities().items():
+        photon_data = _incident_photon(library.get_by_material(element, data_type='photon')['path'])
+        for mt in PHOTON_TOTAL_MTS:
+            if mt not in photon_data.reactions:
+                continue
+            xs = photon_data.reactions[mt].xs
+            # Pair production is only tabulated above its threshold
+            above_threshold = energies >= xs.x[0]
+            mu[above_threshold] += atom_density * xs(energies[above_threshold])
+
+    return mu
+
+def linear_buildup(optical_thickness):
+    """Buildup factor B = 1 + mu*t, a rough fit for the scattered photons reaching a point
+    that is closest for light materials around 1 MeV, and conservative for most shields"""
+    return 1.0 + optical_thickness
+
+def layer_path_lengths(starts, ends, major_radius, boundaries):
+    """Length of each straight segment in each layer between nested tori around the z axis
+
+    The layer at a point is set by its distance from the circle of the major radius,
+    so the crossings of each torus are the real roots of a quartic along the segment.
+
+    Parameters
+    ----------
+    starts : numpy.ndarray
+        Start of each segment in cm, shape (segments, 3)
+    ends : numpy.ndarray
+        End of each segment in cm, shape (segments, 3)
+    major_radius : float
+        Major radius of the tori in cm
+    boundaries : numpy.ndarray
+        Minor radii of the tori in cm, increasing
+
+    Returns
+    -------
+    lengths : numpy.ndarray
+        Length of each segment inside each layer in cm, shape (segments, len(boundaries) + 1).
+        Layer i is between boundaries[i-1] and boundaries[i], and the last layer is outside every torus.
+    """
+
+    starts = np.atleast_2d(starts)
+    ends = np.atleast_2d(ends)
+    boundaries = np.asarray(boundaries, dtype=float)
+    n_segments = len(starts)
+
+    direction = ends - starts
+    length = np.linalg.norm(direction, axis=1)
+    direction = direction / np.where(length > 0, length, 1.0)[:, np.newaxis]
+
+    # (|p + t d|^2 + R^2 - r^2)^2 - 4 R^2 ((px + t dx)^2 + (py + t dy)^2) = 0
+    R_squared = major_radius**2
+    A = (np.sum(starts**2, axis=1) + R_squared)[:, np.newaxis] - boundaries[np.newaxis, :]**2
+    B = 2 * np.sum(starts * direction, axis=1)[:, np.newaxis]
+    D_xy = np.sum(direction[:, :2]**2, axis=1)[:, np.newaxis]
+    E_xy = 2 * np.sum(starts[:, :2] * direction[:, :2], axis=1)[:, np.newaxis]
+    F_xy = np.sum(starts[:, :2]**2, axis=1)[:, np.newaxis]
+
+    coefficients = np.stack(np.broadcast_arrays(2*B,
+                                                B**2 + 2*A - 4*R_squared*D_xy,
+                                                2*A*B - 4*R_squared*E_xy,
+                                                A**2 - 4*R_squared*F_xy), axis=-1)
+    companion = np.zeros((n_segments, len(boundaries), 4, 4))
+    companion[..., 0, :] = -coefficients
+    companion[..., 1, 0] = companion[..., 2, 1] = companion[..., 3, 2] = 1.0
+    roots = np.linalg.eigvals(companion).reshape(n_segments, -1)
+
+    segment_length = length[:, np.newaxis]
+    crossing = (np.abs(roots.imag) < 1e-6 * np.maximum(segment_length, 1.0)) \
+               & (roots.real > 0) & (roots.real < segment_length)
+    t = np.where(crossing, roots.real, segment_length)
+    t = np.sort(np.concatenate([np.zeros((n_segments, 1)), t, segment_length], axis=1), axis=1)
+
+    # Each piece between crossings is in one layer, found from its midpoint
+    pieces = np.diff(t, axis=1)
+    midpoints = starts[:, np.newaxis, :] + ((t[:, :-1] + t[:, 1:]) / 2)[..., np.newaxis] * direction[:, np.newaxis, :]
+    minor_radius = np.hypot(np.hypot(midpoints[..., 0], midpoints[..., 1]) - major_radius, midpoints[..., 2])
+    layer = np.searchsorted(boundaries, minor_radius)
+
+    lengths = np.zeros((n_segments, len(boundaries) + 1))
+    for i in range(len(boundaries) + 1):
+        lengths[:, i] = np.sum(pieces * (layer == i), axis=1)
+
+    return lengths
+
+class PointKernelDose:
+    """Deterministic estimate of the decay photon dose at chosen points around a toroidal section model
+
+    Uncollided photons are attenuated along straight lines through the nested tori of the model,
+    with a buildup factor on top for the scattered ones, so the dose at a handful of points takes milliseconds
+    instead of a photon transport run. Meant for screening designs and cooling times,
+    with the photon Monte Carlo kept for the ones worth a closer look.
+
+    Like the periodic boundaries of the model, the section is treated as part of the full torus,
+    so the sources are spread around the whole torus. The periodic planes and bounding sphere are ignored.
+
+    The tori must be circular and share one major radius, see torus_layers, so models like barc_model_final
+    with elongated tori and an offset blanket vessel raise a ValueError.
+
+    Parameters
+    ----------
+    model : openmc.Model
+        Toroidal section model made of layers between nested circular ZTorus surfaces with the same major radius,
+        e.g. from barc_model_simple_toroidal
+    group_boundaries : numpy.ndarray, optional
+        Photon energy group boundaries in eV, as used for group_photon_sources
+    geometry : str, optional
+        ICRP incident dose field direction, see dose_tally
+    buildup : callable, optional
+        Buildup factor as a function of the optical thickness. Default is linear_buildup
+    cross_sections : str, optional
+        Path to cross_sections.xml. Default is openmc.config['cross_sections']
+    """
+
+    def __init__(self, model, group_boundaries=PHOTON_GROUP_BOUNDARIES, geometry="AP", buildup=linear_buildup,
+                 cross_sections=None):
+        cells = list(model.geometry.get_all_cells().values())
+        self.major_radius, self.layers = torus_layers(cells)
+        self.buildup = buildup
+
+        # Photons are emitted uniformly in each group, like the dose response
+        group_boundaries = np.asarray(group_boundaries, dtype=float)
+        self.group_energies = (group_boundaries[:-1] + group_boundaries[1:]) / 2
+
+        # Attenuation of each layer, ordered by outer radius, then outside every torus
+        by_outer_radius = sorted(self.layers.items(), key=lambda item: item[1][1])
+        self.boundaries = np.array([outer for _, (_, outer) in by_outer_radius if np.isfinite(outer)])
+        layer_materials = [cell.fill for cell, (_, outer) in by_outer_radius if np.isfinite(outer)]
+        outside = [cell.fill for cell, (_, outer) in by_outer_radius if not np.isfinite(outer)]
+        layer_materials.append(outside[0] if len(outside) > 0 else None)
+        self.mu = np.array([attenuation_coefficients(material, self.group_energies, cross_sections)
+                            for material in layer_materials])
+
+        # Photons/cm2 to µSv/h
+        energies, pSv_cm2 = openmc.data.dose_coefficients(particle="photon", geometry=geometry)
+        pico_to_micro = 1e-6
+        seconds_to_hours = 60*60
+        self.dose_coefficients = np.exp(np.interp(np.log(self.group_energies), np.log(energies), np.log(pSv_cm2))) \
+                                 * pico_to_micro * seconds_to_hours
+
+        phi_min, phi_max = _section_phi_bounds(cells)
+        self.sections = 2*np.pi / (phi_max - phi_min)
+
+    def source_points(self, cell, n_points, seed=1):
+        """Points spread uniformly through the volume of a layer around the full torus
+
+        Parameters
+        ----------
+        cell : openmc.Cell
+            Layer to sample
+        n_points : int
+            Number of points
+        seed : int, optional
+            Random seed
+
+        Returns
+        -------
+        points : numpy.ndarray
+            Points in cm, shape (n_points, 3)
+        """
+
+        inner, outer = self.layers[cell]
+        rng = np.random.default_rng(seed)
+
+        points = np.zeros((0, 3))
+        while len(points) < n_points:
+            n_samples = 2 * (n_points - len(points))
+            minor_radius = np.sqrt(rng.uniform(inner**2, outer**2, n_samples))
+            poloidal_angle = rng.uniform(0, 2*np.pi, n_samples)
+            toroidal_angle = rng.uniform(0, 2*np.pi, n_samples)
+
+            # The volume element grows with the distance from the z axis
+            r = self.major_radius + minor_radius * np.cos(poloidal_angle)
+            keep = rng.uniform(0, 1, n_samples) < r / (self.major_radius + outer)
+
+            samples = np.column_stack([r * np.cos(toroidal_angle), r * np.sin(toroidal_angle),
+                                       minor_radius * np.sin(poloidal_angle)])
+            points = np.concatenate([points, samples[keep]])
+
+        return points[:n_points]
+
+    def kernel(self, points, cells, n_source_points=200, seed=1):
+        """Dose rate at each point from one photon per second emitted in each group of each cell of the section
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            Points to get the dose at in cm, shape (points, 3)
+        cells : list of openmc.Cell
+            Activated layers that emit decay photons
+        n_source_points : int, optional
+            Number of points each layer's source is spread over
+        seed : int, optional
+            Random seed for the source points
+
+        Returns
+        -------
+        kernel : numpy.ndarray
+            Dose rate in µSv/h per photon/s, shape (points, cells, groups)
+        """
+
+        points = np.atleast_2d(points)
+        kernel = np.zeros((len(points), len(cells), len(self.group_energies)))
+
+        for j, cell in enumerate(cells):
+            sources = self.source_points(cell, n_source_points, seed)
+
+            # Every source point to every point in one go, shape (points, sources, ...)
+            starts = np.broadcast_to(sources[np.newaxis, :, :], (len(points),) + sources.shape)
+            ends = np.broadcast_to(points[:, np.newaxis, :], starts.shape)
+            lengths = layer_path_lengths(starts.reshape(-1, 3), ends.reshape(-1, 3), self.major_radius, self.boundaries)
+            optical_thickness = (lengths @ self.mu).reshape(len(points), len(sources), -1)
+
+            # Keep points inside a source layer finite
+            distance_squared = np.maximum(np.sum((ends - starts)**2, axis=2), 1.0)[..., np.newaxis]
+            flux = self.buildup(optical_thickness) * np.exp(-optical_thickness) / (4*np.pi*distance_squared)
+            kernel[:, j] = self.sections * np.mean(flux, axis=1) * self.dose_coefficients
+
+        return kernel
+
+    def dose_rate(self, points, cells, group_sources, n_source_points=200, seed=1):
+        """Dose rate at each point from decay photon sources in each cell
+
+        The kernel only depends on the geometry, so pass every cooling step or scenario at once.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            Points to get the dose at in cm, shape (points, 3)
+        cells : list of openmc.Cell
+            Activated layers that emit decay photons
+        group_sources : numpy.ndarray
+            Photons/s emitted in each cell and group of the section, shape (..., cells, groups),
+            e.g. every step from group_photon_sources
+        n_source_points : int, optional
+            Number of points each layer's source is spread over
+        seed : int, optional
+            Random seed for the source points
+
+        Returns
+        -------
+        dose_rate : numpy.ndarray
+            Dose rate at each point in µSv/h, shape (..., points)
+        """
+
+        kernel = self.kernel(points, cells, n_source_points, seed)
+        return np.einsum('...cg,pcg->...p', group_sources, kernel)
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Layers with a heating tally, in the order of the bins of the consolidated 'neutron_heating' tally.
+# With separate tallies each is named 'neutron_heating_<layer>'
+HEATING_LAYERS = ['first_wall', 'cooling_channel', 'cooling_vessel', 'vacuum_vessel', 'blanket', 'blanket_vessel']
+
+def _tallies_by_name(statepoint):
+    return {tally.name: tally for tally in statepoint.tallies.values()}
+
+def read_layer_heating(statepoint):
+    """Heating of each layer in eV per source particle, from either tally layout
+
+    Parameters
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint of a run of one of the models
+
+    Returns
+    -------
+    heating : dict of str to float
+        Heating of each layer in HEATING_LAYERS that has a tally
+    """
+
+    tallies = _tallies_by_name(statepoint)
+
+    if 'neutron_heating' in tallies:
+        return dict(zip(HEATING_LAYERS, tallies['neutron_heating'].mean.ravel().tolist()))
+
+    return {layer: float(tallies[f'neutron_heating_{layer}'].mean.sum())
+            for layer in HEATING_LAYERS if f'neutron_heating_{layer}' in tallies}
+
+def read_tbr(statepoint):
+    """Tritium produced in the breeding cells per source particle, from either tally layout
+
+    Parameters
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint of a run of one of the models
+
+    Returns
+    -------
+    tbr : float
+        Sum of the (n,Xt) rate over the breeding cells
+    """
+
+    tallies = _tallies_by_name(statepoint)
+
+    if 'flux_tbr_blanket' in tallies:
+        return float(np.sum(tallies['flux_tbr_blanket'].get_values(scores=['(n,Xt)'])))
+
+    tbr_tally = tallies['TBR'] if 'TBR' in tallies else tallies['tbr']
+    return float(np.sum(tbr_tally.mean))
+
+def read_first_cell_tbr(statepoint):
+    """(n,Xt) rate of only the first breeding cell, the cooling channel, per source particle
+
+    This is the TBR metric optimize_model has always used, kept so new sweeps can be compared with earlier ones.
+    See read_tbr for the sum over both breeding cells. Only the separate tally layout has it.
+
+    Parameters
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint of a run of one of the models
+
+    Returns
+    -------
+    tbr : float
+        First bin of the 'TBR' or 'tbr' tally
+    """
+
+    tallies = _tallies_by_name(statepoint)
+    tbr_tally = tallies['TBR'] if 'TBR' in tallies else tallies['tbr']
+    return float(tbr_tally.mean.flat[0])
@@ -1,9 +1,14 @@
 import os
+import hashlib
+import tempfile
 from contextlib import contextmanager
 
 CROSS_SECTIONS = os.environ['OPENMC_CROSS_SECTIONS']
 CHAIN_FILE = os.environ['OPENMC_CHAIN_FILE']
 
+# Top of the repository, where the caches shared by every run are kept by default
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 @contextmanager
 def working_directory(directory):
     owd = os.getcwd()
@@ -11,4 +16,41 @@ def working_directory(directory):
         os.chdir(directory)
         yield directory
     finally:
-        os.chdir(owd)
\ No newline at end of file
+        os.chdir(owd)
+
+def file_fingerprint(path):
+    """SHA-256 hex digest of the contents of a file"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def cache_directory(name, env_var):
+    """Directory to keep a cache in, taken from the env_var environment variable if it is set,
+    otherwise name at the top of the repository"""
+    return os.environ.get(env_var, os.path.join(REPOSITORY_DIRECTORY, name))
+
+@contextmanager
+def atomic_write(path):
+    """Yield a temporary path to write to that replaces path when the block finishes,
+    so other processes never read a partial file or write over each other.
+    The temporary file is removed if the block raises, leaving path as it was"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield temporary_path
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+def model_fingerprint(model):
+    """SHA-256 hex digest of the geometry, materials, settings and tallies of an openmc.Model,
+    taken from the model.xml it would export"""
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = os.path.join(directory, 'model.xml')
+        model.export_to_model_xml(model_path)
+        return file_fingerprint(model_path)
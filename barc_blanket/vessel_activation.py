@@ -1,18 +1,30 @@
 import openmc
 import openmc.stats
 import openmc.deplete
+from openmc.deplete.cram import CRAM48
 import numpy as np
+import scipy.sparse as sp
 
 import os
+import h5py
+import hashlib
+import tempfile
 
-from barc_blanket.utilities import CROSS_SECTIONS, CHAIN_FILE
+from barc_blanket.utilities import CROSS_SECTIONS, CHAIN_FILE, file_fingerprint, cache_directory, atomic_write
+from barc_blanket.depletion_results import write_results, DepletionResultsView, strip_nan_steps, SECONDS_PER_DAY
+from barc_blanket.depletion_chain import reduced_chain_file
+from barc_blanket.irradiation_history import IrradiationHistory
+from barc_blanket.depletion_profiling import DepletionProfiler, profiled
 
 from openmc_regular_mesh_plotter import plot_mesh_tally
 from matplotlib.colors import LogNorm
 
+# Fluxes and microscopic cross sections shared by every run, see cached_microxs_and_flux
+FLUX_CACHE_DIRECTORY = cache_directory('flux_microxs_cache', 'BARC_FLUX_CACHE')
+
 # Heavily based on John's stuff here: https://github.com/jlball/arc-nonproliferation/tree/master/openmc-scripts/arc-1/independent_depletion
 
-def run_independent_vessel_activation(model:openmc.Model, days=365, num_timesteps=50, times=None, source_rate=3.6e20):
+def run_independent_vessel_activation(model:openmc.Model, days=365, num_timesteps=50, times=None, source_rate=3.6e20, history:IrradiationHistory=None):
     """ Run the vessel activation after a certain number of days.
 
     Parameters:
@@ -27,6 +39,9 @@ def run_independent_vessel_activation(model:openmc.Model, days=365, num_timestep
         The times to evaluate activation. Default is None. If not none, it will override days and num_timesteps.
     source_rate : float
         The source rate of neutrons in the model. Default is 3.6e20 (for 1 GW fusion power)
+    history : IrradiationHistory
+        Campaigns, outages and duty cycles at fractions of source_rate. Default is None.
+        If not none, it will override days, num_timesteps and times.
     """
 
     openmc.config['cross_sections'] = CROSS_SECTIONS
@@ -37,63 +52,132 @@ def run_independent_vessel_activation(model:openmc.Model, days=365, num_timestep
     vacuum_vessel_cell = next(iter(model._cells_by_name["vacuum_vessel_cell"]))
     blanket_vessel_cell = next(iter(model._cells_by_name["blanket_vessel_cell"]))
 
-    # Check if flux and microscopic cross sections are present.
-    # If not, calculate them
-    # Otherwise, load them from file
-    fluxes_file = 'fluxes.npy'
-    # TODO: should be able to programmatically put all the microxs in one file, but for now we'll just do it separately
-    first_wall_file = 'first_wall_microxs.csv'
-    vacuum_vessel_microxs_file = 'vacuum_vessel_microxs.csv'
-    blanket_vessel_microxs_file = 'blanket_vessel_microxs.csv'
-    if os.path.exists(fluxes_file) and os.path.exists(first_wall_file) and os.path.exists(vacuum_vessel_microxs_file) and os.path.exists(blanket_vessel_microxs_file):
-        with open(fluxes_file, 'rb') as f:
-            fluxes = np.load(fluxes_file)
-        with open(first_wall_file, 'rb') as f:
-            first_wall_microxs = openmc.deplete.MicroXS.from_csv(first_wall_file)
-        with open(vacuum_vessel_microxs_file, 'rb') as f:
-            vacuum_vessel_microxs = openmc.deplete.MicroXS.from_csv(vacuum_vessel_microxs_file)
-        with open(blanket_vessel_microxs_file, 'rb') as f:
-            blanket_vessel_microxs = openmc.deplete.MicroXS.from_csv(blanket_vessel_microxs_file)
-    else:
-        fluxes, microxs = openmc.deplete.get_microxs_and_flux(model, [first_wall_cell, vacuum_vessel_cell, blanket_vessel_cell])
-        np.save(fluxes_file, fluxes)
-        first_wall_microxs = microxs[0]
-        vacuum_vessel_microxs = microxs[1]
-        blanket_vessel_microxs = microxs[2]
-        first_wall_microxs.to_csv(first_wall_file)
-        vacuum_vessel_microxs.to_csv(vacuum_vessel_microxs_file)
-        blanket_vessel_microxs.to_csv(blanket_vessel_microxs_file)
+    profiler = DepletionProfiler()
+
+    with profiler.phase('flux_microxs'):
+        fluxes, microxs = cached_microxs_and_flux(model, [first_wall_cell, vacuum_vessel_cell, blanket_vessel_cell])
 
     # Perform depletion (CHECK NORMALIZATION MODE)
-    operator = openmc.deplete.IndependentOperator(openmc.Materials([first_wall_cell.fill, vacuum_vessel_cell.fill, blanket_vessel_cell.fill]),
-                                                    fluxes,
-                                                    [first_wall_microxs, vacuum_vessel_microxs, blanket_vessel_microxs],
-                                                    normalization_mode='source-rate',
-                                                    reduce_chain=True,
-                                                    reduce_chain_level=5) # TODO: figure out what this does and why we set to 5
+    # The chain is reduced to nuclides reachable within 5 decays or reactions of the initial ones
+    vessel_materials = [first_wall_cell.fill, vacuum_vessel_cell.fill, blanket_vessel_cell.fill]
+    with profiler.phase('chain_reduction'):
+        chain_file = reduced_chain_file(vessel_materials, 5)
+
+    with profiler.phase('operator_setup'):
+        operator = openmc.deplete.IndependentOperator(openmc.Materials(vessel_materials),
+                                                        fluxes,
+                                                        microxs,
+                                                        chain_file=chain_file,
+                                                        normalization_mode='source-rate')
     
     # 'timestep' is the actual time of the depletion step
     # 'timediff' is the difference in time between the current and previous depletion step
-    if times is None:
-        timesteps = [days/num_timesteps] * num_timesteps
+    if history is not None:
+        timesteps, source_rates = history.steps(source_rate)
     else:
-        timesteps = np.diff(times)
-    source_rates = np.ones(len(timesteps)) * source_rate
+        if times is None:
+            timesteps = [days/num_timesteps] * num_timesteps
+        else:
+            timesteps = np.diff(times)
+        source_rates = np.ones(len(timesteps)) * source_rate
     
-    integrator = openmc.deplete.PredictorIntegrator(operator, 
-                                                       timesteps,
-                                                       source_rates=source_rates,
-                                                       timestep_units='d')
+    integrator = profiled(openmc.deplete.PredictorIntegrator)(operator, 
+                                                                timesteps,
+                                                                source_rates=source_rates,
+                                                                timestep_units='d',
+                                                                profiler=profiler)
     
     integrator.integrate()
 
+    # Per-step timings go next to the results
+    profiler.write()
+    profiler.print_summary()
+
+def cached_microxs_and_flux(model:openmc.Model, domains, cache_directory=FLUX_CACHE_DIRECTORY, **kwargs):
+    """ Get the fluxes and microscopic cross sections in some domains, only running transport if they aren't cached.
+
+    Results are stored in one HDF5 file per hash of the model geometry, materials and settings,
+    the cross section library, the depletion chain and the domains, so any change to the model
+    runs the transport again while an unchanged model never does, wherever this is called from.
+
+    Parameters:
+    -----------
+    model : openmc.Model
+        The model to run transport on.
+    domains : list of openmc.Cell or openmc.Material
+        The domains to get the fluxes and microscopic cross sections in.
+    cache_directory : str
+        The directory to store the results in. Default is FLUX_CACHE_DIRECTORY.
+    **kwargs
+        Passed on to openmc.deplete.get_microxs_and_flux, and part of the hash.
+
+    Returns:
+    --------
+    fluxes : list of numpy.ndarray
+        The flux in each domain.
+    microxs : list of openmc.deplete.MicroXS
+        The microscopic cross sections in each domain.
+    """
+
+    key = _flux_cache_key(model, domains, kwargs)
+    cache_file = os.path.join(cache_directory, f"flux_microxs_{key[:16]}.h5")
+
+    if os.path.exists(cache_file):
+        with h5py.File(cache_file, 'r') as f:
+            fluxes = []
+            microxs = []
+            for i in range(len(domains)):
+                domain_group = f[str(i)]
+                fluxes.append(domain_group['flux'][()])
+                microxs.append(openmc.deplete.MicroXS(domain_group['microxs'][()],
+                                                      [nuclide.decode() for nuclide in domain_group['nuclides'][()]],
+                                                      [reaction.decode() for reaction in domain_group['reactions'][()]]))
+        print(f"Loaded fluxes and microxs from {cache_file}")
+        return fluxes, microxs
+
+    fluxes, microxs = openmc.deplete.get_microxs_and_flux(model, domains, **kwargs)
+
+    with atomic_write(cache_file) as temporary_file, h5py.File(temporary_file, 'w') as f:
+        for i, (flux, domain_microxs) in enumerate(zip(fluxes, microxs)):
+            domain_group = f.create_group(str(i))
+            domain_group.create_dataset('flux', data=flux)
+            domain_group.create_dataset('microxs', data=domain_microxs.data)
+            domain_group.create_dataset('nuclides', data=np.array(domain_microxs.nuclides, dtype='S'))
+            domain_group.create_dataset('reactions', data=np.array(domain_microxs.reactions, dtype='S'))
+
+    return fluxes, microxs
+
+def _flux_cache_key(model:openmc.Model, domains, kwargs):
+    """ SHA-256 hex digest of everything that changes the fluxes and microscopic cross sections. """
+
+    hasher = hashlib.sha256()
+
+    # Tallies and plots don't change the transport, so only these are hashed
+    with tempfile.TemporaryDirectory() as directory:
+        model.export_to_xml(directory)
+        for xml_file in ['geometry.xml', 'materials.xml', 'settings.xml']:
+            hasher.update(file_fingerprint(os.path.join(directory, xml_file)).encode())
+
+    hasher.update(file_fingerprint(openmc.config['cross_sections']).encode())
+    hasher.update(file_fingerprint(openmc.config['chain_file']).encode())
+    hasher.update(repr([(type(domain).__name__, domain.id) for domain in domains]).encode())
+    hasher.update(repr(sorted(kwargs.items())).encode())
+
+    return hasher.hexdigest()
+
 def run_independent_vessel_decay(model:openmc.Model, results, days=365, num_timesteps=50, times=None):
     """ Run the vessel decay after a certain number of days.
 
+    Only decay happens after shutdown, so instead of running the depletion solver with no flux,
+    the decay matrix is built once and every cooling time is evaluated directly from the activated compositions.
+    The results are written to 'depletion_results.h5' with the same layout as a depletion run.
+
     Parameters:
     -----------
     model : openmc.Model
         The model to get the vessel activation from.
+    results : openmc.deplete.Results
+        The results of the vessel activation. The last step is taken as the composition at shutdown.
     days : int
         The number of days to run the model for.
     num_timesteps : int
@@ -109,65 +193,81 @@ def run_independent_vessel_decay(model:openmc.Model, results, days=365, num_time
     first_wall_cell = next(iter(model._cells_by_name["first_wall_cell"]))
     vacuum_vessel_cell = next(iter(model._cells_by_name["vacuum_vessel_cell"]))
     blanket_vessel_cell = next(iter(model._cells_by_name["blanket_vessel_cell"]))
+    material_ids = [str(cell.fill.id) for cell in [first_wall_cell, vacuum_vessel_cell, blanket_vessel_cell]]
 
-    # This is a hack until I can figure out how to make it actually work
-    fluxes_file = '../independent_vessel_activation/fluxes.npy'
-    # TODO: should be able to programmatically put all the microxs in one file, but for now we'll just do it separately
-    first_wall_file = '../independent_vessel_activation/first_wall_microxs.csv'
-    vacuum_vessel_microxs_file = '../independent_vessel_activation/vacuum_vessel_microxs.csv'
-    blanket_vessel_microxs_file = '../independent_vessel_activation/blanket_vessel_microxs.csv'
-    if os.path.exists(fluxes_file) and os.path.exists(first_wall_file) and os.path.exists(vacuum_vessel_microxs_file) and os.path.exists(blanket_vessel_microxs_file):
-        with open(fluxes_file, 'rb') as f:
-            fluxes = np.load(fluxes_file)
-        with open(first_wall_file, 'rb') as f:
-            first_wall_microxs = openmc.deplete.MicroXS.from_csv(first_wall_file)
-        with open(vacuum_vessel_microxs_file, 'rb') as f:
-            vacuum_vessel_microxs = openmc.deplete.MicroXS.from_csv(vacuum_vessel_microxs_file)
-        with open(blanket_vessel_microxs_file, 'rb') as f:
-            blanket_vessel_microxs = openmc.deplete.MicroXS.from_csv(blanket_vessel_microxs_file)
-
-    fluxes = np.zeros(fluxes.shape)
+    # Activated compositions at shutdown
+    shutdown = results[-1]
+    nuclides = sorted(shutdown.index_nuc, key=shutdown.index_nuc.get)
+    shutdown_atoms = np.array([shutdown.data[0, shutdown.index_mat[material_id], :] for material_id in material_ids])
+    volumes = [shutdown.volume[material_id] for material_id in material_ids]
 
-    # Perform depletion (CHECK NORMALIZATION MODE)
-    operator = openmc.deplete.IndependentOperator(openmc.Materials([first_wall_cell.fill, vacuum_vessel_cell.fill, blanket_vessel_cell.fill]),
-                                                    fluxes,
-                                                    [first_wall_microxs, vacuum_vessel_microxs, blanket_vessel_microxs],
-                                                    normalization_mode='source-rate',
-                                                    prev_results=results,
-                                                    reduce_chain=True,
-                                                    reduce_chain_level=5) # TODO: figure out what this does and why we set to 5
-    
     if times is None:
         timesteps = [days/num_timesteps] * num_timesteps
     else:
         timesteps = np.diff(times)
-    source_rates = np.ones(len(timesteps)) # source rate is very close to 0 so decay can happen
+    cooling_times = np.concatenate([[0.0], np.cumsum(timesteps)]) * SECONDS_PER_DAY
 
-    integrator = openmc.deplete.PredictorIntegrator(operator, 
-                                                       timesteps,
-                                                       source_rates=source_rates,
-                                                       timestep_units='d')
-    
-    integrator.integrate()
+    # The activation used the same reduced chain, so it has every nuclide in the results
+    vessel_materials = [first_wall_cell.fill, vacuum_vessel_cell.fill, blanket_vessel_cell.fill]
+    decay_matrix = _decay_matrix(openmc.deplete.Chain.from_xml(reduced_chain_file(vessel_materials, 5)), nuclides)
+
+    atoms = np.empty((len(cooling_times), len(material_ids), len(nuclides)))
+    atoms[0] = shutdown_atoms
+    for i, cooling_time in enumerate(cooling_times[1:], start=1):
+        for j in range(len(material_ids)):
+            atoms[i, j] = CRAM48(decay_matrix, shutdown_atoms[j], cooling_time)
+
+    # Times continue on from the end of the activation, like a depletion run restarted from it would
+    write_results("depletion_results.h5", shutdown.time[0] + cooling_times, material_ids, volumes, nuclides, atoms)
+
+def _decay_matrix(chain, nuclides):
+    """ Build the matrix of decay constants between the given nuclides, in 1/s.
+
+    This is the burnup matrix of the chain with no reaction rates, so it has the same
+    decay, alpha and proton terms as the depletion solver it stands in for.
+    Decay products that aren't in the list of nuclides are dropped,
+    like they are from a reduced chain.
+
+    Parameters:
+    -----------
+    chain : openmc.deplete.Chain
+        The depletion chain with the decay data.
+    nuclides : list of str
+        The nuclides in the order of the rows and columns of the matrix.
+
+    Returns:
+    --------
+    matrix : scipy.sparse.csc_matrix
+        Decay matrix such that dN/dt = matrix @ N
+    """
+
+    # No nuclides in the rates means no reactions, only decay
+    zero_rates = openmc.deplete.ReactionRates(['0'], [], [])[0]
+    chain_matrix = chain.form_matrix(zero_rates)
+
+    # Picks the chain nuclides out in the order of the given nuclides
+    selected = [(chain.nuclide_dict[nuclide], j) for j, nuclide in enumerate(nuclides) if nuclide in chain.nuclide_dict]
+    chain_indices, indices = zip(*selected) if selected else ((), ())
+    selection = sp.csc_matrix((np.ones(len(selected)), (chain_indices, indices)), shape=(len(chain), len(nuclides)))
+
+    return (selection.T @ chain_matrix @ selection).tocsc()
 
-def extract_activities(model:openmc.Model, cell_name:str="blanket_vessel_cell"):
-    # Get the total activity from a specified cell
+def extract_activities(model:openmc.Model, cell_name:str="blanket_vessel_cell", view:DepletionResultsView=None, units:str="Bq/cm3"):
+    # Get the activity from a specified cell, per cm3 by default like openmc.deplete.Results.get_activity, or 'Bq' for the total
     # Another thing taken from John: https://github.com/jlball/arc-nonproliferation/commit/04de395e19fd30344d9e5b2366918e149593b5d0
+    # Pass the same view when extracting from several cells so the results are only read once
     openmc.config['cross_sections'] = CROSS_SECTIONS
     openmc.config['chain_file'] = CHAIN_FILE
 
-    # load results
-    results = openmc.deplete.Results("depletion_results.h5")
-    
-    times = results.get_times()
-    activities = np.empty(len(times))
+    if view is None:
+        view = DepletionResultsView("depletion_results.h5")
 
     cell = next(iter(model._cells_by_name[cell_name]))
-    activities = results.get_activity(cell.fill)
+    activities = (view.times, view.activity(cell.fill, units=units))
 
-    return times, activities
+    return view.times / SECONDS_PER_DAY, activities
 
-def extract_decay_heat(model:openmc.Model, cell_name:str="blanket_vessel_cell"):
+def extract_decay_heat(model:openmc.Model, cell_name:str="blanket_vessel_cell", view:DepletionResultsView=None):
     """ Get the decay heat from a specified cell.
     
     Parameters:
@@ -176,85 +276,71 @@ def extract_decay_heat(model:openmc.Model, cell_name:str="blanket_vessel_cell"):
         The model to get the decay heat from.
     cell_name : str
         The name of the cell to get the decay heat from.
+    view : DepletionResultsView
+        The results to get the decay heat from. Pass the same view for several cells
+        so the results are only read once. Default is None, which reads 'depletion_results.h5'.
 
     Returns:
     --------
-    times : list
+    times : numpy.ndarray
         The times at which the decay heat was calculated.
         Starts at 0, which is either the initial activation time or the initial decay time.
-    decay_heats : list
+    decay_heats : numpy.ndarray
         The decay heat at each time, in Watts.
     """
 
     openmc.config['cross_sections'] = CROSS_SECTIONS
     openmc.config['chain_file'] = CHAIN_FILE
     
-    results = openmc.deplete.Results("depletion_results.h5")
+    if view is None:
+        view = DepletionResultsView("depletion_results.h5")
 
     cell = next(iter(model._cells_by_name[cell_name]))
-    decay_heat_array = results.get_decay_heat(cell.fill)
-
-    # Limit real times to only where decay_heat_array[1] is not nan
-    times = []
-    decay_heats = []
-    for i, heat in enumerate(decay_heat_array[1]):
-        if not np.isnan(decay_heat_array[1][i]):
-            times.append(decay_heat_array[0][i])
-            decay_heats.append(decay_heat_array[1][i])
-    
-    times = times - times[0]  # start at 0
-    return times, decay_heats
 
-def extract_decay_photon_energies():
-    # Get the decay photon energies from the depletion results
-    
-    results = openmc.deplete.Results("depletion_results.h5")
-    times = results.get_times()
-    activities = np.empty(len(times))
+    # Limit real times to only where the decay heat is not nan
+    return strip_nan_steps(view.times, view.decay_heat(cell.fill))
 
-    dists = []
+def extract_decay_photon_energies(view:DepletionResultsView=None, material=None, clip_tolerance:float=1e-6):
+    # Get the decay photon energies of a material from the depletion results, by default the first one in the results
+    openmc.config['cross_sections'] = CROSS_SECTIONS
+    openmc.config['chain_file'] = CHAIN_FILE
 
-    for i, time in enumerate(times):
-        materials = results.export_to_materials(i)
+    if view is None:
+        view = DepletionResultsView("depletion_results.h5")
 
-        vacuum_vessel_material = materials[0]
+    if material is None:
+        material = view.material_ids[0]
 
-        activities[i] = vacuum_vessel_material.get_activity()
-        dists.append(vacuum_vessel_material.get_decay_photon_energy())
+    dists = view.decay_photon_energies(material, clip_tolerance=clip_tolerance)
 
-    return times, dists
+    return view.times / SECONDS_PER_DAY, dists
 
-def extract_original_nuclides(model:openmc.Model, cell_name:str="blanket_vessel_cell"):
+def extract_original_nuclides(model:openmc.Model, cell_name:str="blanket_vessel_cell", view:DepletionResultsView=None):
     openmc.config['cross_sections'] = CROSS_SECTIONS
     openmc.config['chain_file'] = CHAIN_FILE
 
-    results = openmc.deplete.Results("depletion_results.h5")
-    times = results.get_times()
+    if view is None:
+        view = DepletionResultsView("depletion_results.h5")
+
     cell = next(iter(model._cells_by_name[cell_name]))
-    
-    nuc_atoms = {}
-    for nuclide_tuple in cell.fill.nuclides:
-        nuclide_name = nuclide_tuple[0]
-        nuc_atoms[nuclide_name] = results.get_atoms(cell.fill, nuc=nuclide_name)[1]
+    nuc_atoms = view.nuclide_atoms(cell.fill, [nuclide_tuple[0] for nuclide_tuple in cell.fill.nuclides])
 
-    return times, nuc_atoms
+    return view.times / SECONDS_PER_DAY, nuc_atoms
 
-def extract_nuclides(model:openmc.Model, cell_name:str="blanket_vessel_cell", nuclide_names:list=["H-3", "He-4"]):
+def extract_nuclides(model:openmc.Model, cell_name:str="blanket_vessel_cell", nuclide_names:list=["H-3", "He-4"], view:DepletionResultsView=None):
     openmc.config['cross_sections'] = CROSS_SECTIONS
     openmc.config['chain_file'] = CHAIN_FILE
 
-    results = openmc.deplete.Results("depletion_results.h5")
-    times = results.get_times()
+    if view is None:
+        view = DepletionResultsView("depletion_results.h5")
+
     cell = next(iter(model._cells_by_name[cell_name]))
-    
-    nuc_atoms = {}
-    for nuclide_name in nuclide_names:
-        nuc_atoms[nuclide_name] = np.empty(len(times))
-        nuc_atoms[nuclide_name] = results.get_atoms(cell.fill, nuc=nuclide_name)[1]
+    nuc_atoms = view.nuclide_atoms(cell.fill, nuclide_names)
 
-    return times, nuc_atoms
+    return view.times / SECONDS_PER_DAY, nuc_atoms
 
-def plot_2d_dose(statepoint, mesh):
+def plot_2d_dose(statepoint, mesh, i_cool):
+    """Plot the dose tally of one statepoint on a regular mesh, see shutdown_dose.render_dose_maps for every step at once"""
     photon_tally = statepoint.get_tally(name="photon_dose_on_mesh")
 
     # normalising this tally is a little different to other examples as the source strength has been using units of photons per second.
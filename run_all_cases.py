@@ -1,60 +1,272 @@
 # Run every case we are interested in.
 # To be looked at tomorrow morning
+#
+# By default several cases run at once, each in its own process and working directory,
+# with the core budget split between them:
+#     python run_all_cases.py --cores 128 --concurrent 8
+# A single case can also be run in this process:
+#     python run_all_cases.py --case waste_01_flibe --threads 16
+# For quick screening, --independent depletes with fluxes and cross sections from one transport solve:
+#     python run_all_cases.py --independent --refresh-interval 5
+# or --batched depletes every case with the same carrier against one transport solve of its pure carrier:
+#     python run_all_cases.py --batched
 import os
+import sys
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import openmc.deplete.pool
 
 from barc_blanket.utilities import working_directory
-from barc_blanket.models.barc_model_final import make_model, mo
-from barc_blanket.materials.blanket_depletion import run_coupled_depletion
+from barc_blanket.models.barc_model_final import make_model
+from barc_blanket.models.model_cache import cached_make_model
+from barc_blanket.materials.blanket_depletion import run_coupled_depletion, run_adaptive_coupled_depletion, run_independent_depletion, run_batched_depletion
+from barc_blanket.materials.blanket_depletion import StreamingClassifier, sums_of_fractions_above
 from barc_blanket.models.materials import flibe, lid, pbli, burner_mixture
 
 CASES = {
     'pure_flibe': {'blanket_material': flibe(),
-                   'name': "Pure FLiBe"},
+                   'name': "Pure FLiBe",
+                   'carrier': 'flibe'},
     'pure_lid': {'blanket_material': lid(),
-                 "name": "Pure LiD"},
+                 "name": "Pure LiD",
+                 'carrier': 'lid'},
     'pure_pbli': {'blanket_material': pbli(),
-                  "name": "Pure PbLi"},
+                  "name": "Pure PbLi",
+                  'carrier': 'pbli'},
     'waste_01_flibe': {'blanket_material': burner_mixture(0.01, flibe=flibe()),
-                       "name": "FLiBe 1% Full Tank Inventory"},
+                       "name": "FLiBe 1% Full Tank Inventory",
+                       'carrier': 'flibe'},
     'waste_01_lid': {'blanket_material': burner_mixture(0.01, flibe=lid()),
-                     "name": "LiD 1% Full Tank Inventory"},
+                     "name": "LiD 1% Full Tank Inventory",
+                     'carrier': 'lid'},
     'waste_01_pbli': {'blanket_material': burner_mixture(0.01, flibe=pbli()),
-                      "name": "PbLi 1% Full Tank Inventory"},
+                      "name": "PbLi 1% Full Tank Inventory",
+                      'carrier': 'pbli'},
     'waste_05_flibe': {'blanket_material': burner_mixture(0.05, flibe=flibe()),
-                       "name": "FLiBe 5% Full Tank Inventory"},
+                       "name": "FLiBe 5% Full Tank Inventory",
+                       'carrier': 'flibe'},
     'waste_05_lid': {'blanket_material': burner_mixture(0.05, flibe=lid()),
-                     "name": "LiD 5% Full Tank Inventory"},
+                     "name": "LiD 5% Full Tank Inventory",
+                     'carrier': 'lid'},
     'waste_05_pbli': {'blanket_material': burner_mixture(0.05, flibe=pbli()),
-                      "name": "PbLi 5% Full Tank Inventory"},
+                      "name": "PbLi 5% Full Tank Inventory",
+                      'carrier': 'pbli'},
     'waste_10_flibe': {'blanket_material': burner_mixture(0.10, flibe=flibe()),
-                       "name": "FLiBe 10% Full Tank Inventory"},
+                       "name": "FLiBe 10% Full Tank Inventory",
+                       'carrier': 'flibe'},
     'waste_10_lid': {'blanket_material': burner_mixture(0.10, flibe=lid()),
-                     "name": "LiD 10% Full Tank Inventory"},
+                     "name": "LiD 10% Full Tank Inventory",
+                     'carrier': 'lid'},
     'waste_10_pbli': {'blanket_material': burner_mixture(0.10, flibe=pbli()),
-                      "name": "PbLi 10% Full Tank Inventory"},
+                      "name": "PbLi 10% Full Tank Inventory",
+                      'carrier': 'pbli'},
 }
 
 BATCHES = 20
 PARTICLES = 1e3
 PHOTON_TRANSPORT = False
 
-def main():
-    for case, config in CASES.items():
-        # create a working directory for each case
-        os.makedirs(f"depletion_results/{case}", exist_ok=True)
-        with working_directory(f"depletion_results/{case}"):
+# Used to pick how many cases run at once when --concurrent isn't given
+DEFAULT_THREADS_PER_CASE = 16
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Run the coupled depletion for every case")
+    parser.add_argument("--case", type=str, default=None, help="Run only this case, in this process")
+    parser.add_argument("--threads", type=int, default=None, help="Threads for a single --case run")
+    parser.add_argument("--cases", type=str, nargs="+", default=list(CASES.keys()), help="Cases to schedule")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="Total cores to split between concurrent cases")
+    parser.add_argument("--concurrent", type=int, default=None, help="Number of cases to run at once")
+    parser.add_argument("--retries", type=int, default=1, help="Number of times to retry a failed case")
+    parser.add_argument("--independent", action="store_true", help="Use fluxes and cross sections from one transport solve instead of coupled depletion")
+    parser.add_argument("--adaptive-tolerance", type=float, default=None, help="Choose coupled depletion timesteps to keep the local error below this tolerance")
+    parser.add_argument("--compact", action="store_true", help="Keep compressed coupled depletion results with every nuclide only at checkpoints")
+    parser.add_argument("--stop-above", type=float, default=None, help="Classify the blanket after every coupled depletion step and stop once both sums of fractions are above this for 3 steps")
+    parser.add_argument("--batched", action="store_true", help="Deplete every case with the same carrier against one transport solve of the pure carrier")
+    parser.add_argument("--refresh-interval", type=int, default=None, help="With --independent, recalculate fluxes and cross sections every this many timesteps")
+    return parser.parse_args()
+
+def run_case(case, threads=None, independent=False, refresh_interval=None, adaptive_tolerance=None, compact=False, stop_above=None):
+    """Run the depletion for one case in its own working directory
+
+    Parameters
+    ----------
+    case : str
+        Key of the case in CASES
+    threads : int, optional
+        Number of processes for the depletion solver. OpenMC transport threads are
+        set through OMP_NUM_THREADS before this process starts.
+    independent : bool, optional
+        Run run_independent_depletion instead of run_coupled_depletion
+    refresh_interval : int, optional
+        Timesteps between flux and cross section updates for run_independent_depletion
+    adaptive_tolerance : float, optional
+        Run run_adaptive_coupled_depletion over the same total time with this tolerance
+    compact : bool, optional
+        Keep compact results from run_coupled_depletion
+    stop_above : float, optional
+        Classify the blanket as run_coupled_depletion goes, stopping once both sums of fractions
+        are above this for 3 steps in a row
+    """
+
+    if threads is not None:
+        openmc.deplete.pool.NUM_PROCESSES = threads
+
+    config = CASES[case]
+
+    # create a working directory for each case
+    os.makedirs(f"depletion_results/{case}", exist_ok=True)
+    with working_directory(f"depletion_results/{case}"):
+        model_config = {"batches": BATCHES,
+                        "particles": PARTICLES,
+                        "photon_transport": PHOTON_TRANSPORT,
+                        "blanket_material": config['blanket_material']}
+
+        model = cached_make_model(make_model, model_config)
+
+        fusion_power = 2.2  # GW
+        timesteps_years = [10] * 10 # 10 year timesteps for 100 years
+
+        if independent:
+            run_independent_depletion(model, timesteps_years, fusion_power, refresh_interval=refresh_interval)
+        elif adaptive_tolerance is not None:
+            run_adaptive_coupled_depletion(model, sum(timesteps_years), fusion_power, tolerance=adaptive_tolerance)
+        else:
+            classifier = None
+            if stop_above is not None:
+                blanket_material = next(cell.fill for cell in model.geometry.get_all_cells().values() if cell.name == 'blanket_cell')
+                classifier = StreamingClassifier(blanket_material.id, stop_condition=sums_of_fractions_above(stop_above, 3))
+            run_coupled_depletion(model, timesteps_years, fusion_power, compact=compact, classifier=classifier)
+
+def run_batched_cases(cases, threads=None):
+    """Deplete the cases grouped by carrier, with one transport solve per carrier
+
+    Each carrier is solved with its pure case in 'depletion_results/batched_<carrier>',
+    and the results of every case end up in its usual 'depletion_results/<case>' directory.
+
+    Parameters
+    ----------
+    cases : list of str
+        Keys of the cases in CASES to run
+    threads : int, optional
+        Number of processes for the depletion solver
+    """
+
+    if threads is not None:
+        openmc.deplete.pool.NUM_PROCESSES = threads
+
+    carriers = {}
+    for case in cases:
+        carriers.setdefault(CASES[case]['carrier'], []).append(case)
+
+    for carrier, carrier_cases in carriers.items():
+        reference_case = f"pure_{carrier}"
+        os.makedirs(f"depletion_results/batched_{carrier}", exist_ok=True)
+        with working_directory(f"depletion_results/batched_{carrier}"):
             model_config = {"batches": BATCHES,
                             "particles": PARTICLES,
                             "photon_transport": PHOTON_TRANSPORT,
-                            "blanket_material": config['blanket_material']}
-            
-            model = make_model(model_config)
-            model.export_to_model_xml()
+                            "blanket_material": CASES[reference_case]['blanket_material']}
+
+            model = cached_make_model(make_model, model_config)
 
             fusion_power = 2.2  # GW
             timesteps_years = [10] * 10 # 10 year timesteps for 100 years
 
-            run_coupled_depletion(model, timesteps_years, fusion_power)
+            compositions = {case: CASES[case]['blanket_material'] for case in carrier_cases}
+            run_batched_depletion(model, compositions, timesteps_years, fusion_power, output_directory="..")
+
+def _run_case_subprocess(case, threads, retries, extra_arguments=()):
+    """Run a case in a separate process with its own thread budget, retrying if it fails
+
+    Returns
+    -------
+    succeeded : bool
+        True if any attempt finished successfully
+    attempts : int
+        Number of attempts made
+    """
+
+    os.makedirs(f"depletion_results/{case}", exist_ok=True)
+    environment = dict(os.environ, OMP_NUM_THREADS=str(threads))
+    command = [sys.executable, os.path.abspath(__file__), "--case", case, "--threads", str(threads), *extra_arguments]
+
+    for attempt in range(1, retries + 2):
+        start_time = time.perf_counter()
+        with open(f"depletion_results/{case}/run_attempt_{attempt}.log", 'w') as log:
+            return_code = subprocess.call(command, env=environment, stdout=log, stderr=subprocess.STDOUT)
+        elapsed_time = time.perf_counter() - start_time
+
+        if return_code == 0:
+            print(f"{case}: finished in {elapsed_time/3600:0.2f} h (attempt {attempt})")
+            return True, attempt
+        print(f"{case}: failed with code {return_code} after {elapsed_time/3600:0.2f} h (attempt {attempt})")
+
+    return False, retries + 1
+
+def schedule_cases(cases, cores, concurrent=None, retries=1, extra_arguments=()):
+    """Run several cases at once, splitting the cores between them
+
+    Parameters
+    ----------
+    cases : list of str
+        Keys of the cases in CASES to run
+    cores : int
+        Total number of cores available
+    concurrent : int, optional
+        Number of cases to run at the same time.
+        Default is enough cases to give each DEFAULT_THREADS_PER_CASE threads.
+    retries : int, optional
+        Number of times to retry a failed case. Other cases keep running in the meantime.
+    extra_arguments : list of str, optional
+        Extra command line arguments passed to each case's run
+
+    Returns
+    -------
+    failed_cases : list of str
+        Cases that failed on every attempt
+    """
+
+    if concurrent is None:
+        concurrent = max(1, cores // DEFAULT_THREADS_PER_CASE)
+    concurrent = max(1, min(concurrent, len(cases)))
+    threads = max(1, cores // concurrent)
+
+    print(f"Running {len(cases)} cases, {concurrent} at a time with {threads} threads each")
+
+    with ThreadPoolExecutor(max_workers=concurrent) as executor:
+        outcomes = dict(zip(cases, executor.map(lambda case: _run_case_subprocess(case, threads, retries, extra_arguments), cases)))
+
+    failed_cases = [case for case, (succeeded, _) in outcomes.items() if not succeeded]
+    for case in failed_cases:
+        print(f"{case} failed, see depletion_results/{case}/run_attempt_*.log")
+
+    return failed_cases
+
+def main():
+    args = _parse_args()
+
+    if args.batched:
+        run_batched_cases(args.cases, args.threads)
+    elif args.case is not None:
+        run_case(args.case, args.threads, args.independent, args.refresh_interval, args.adaptive_tolerance, args.compact, args.stop_above)
+    else:
+        extra_arguments = []
+        if args.independent:
+            extra_arguments.append("--independent")
+        if args.refresh_interval is not None:
+            extra_arguments.extend(["--refresh-interval", str(args.refresh_interval)])
+        if args.compact:
+            extra_arguments.append("--compact")
+        if args.stop_above is not None:
+            extra_arguments.extend(["--stop-above", str(args.stop_above)])
+        if args.adaptive_tolerance is not None:
+            extra_arguments.extend(["--adaptive-tolerance", str(args.adaptive_tolerance)])
+        failed_cases = schedule_cases(args.cases, args.cores, args.concurrent, args.retries, extra_arguments)
+        if len(failed_cases) > 0:
+            sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,16 +1,126 @@
+"""Classify the waste for every case in run_all_cases.py, with and without C14.
+
+Each (case, option) pair is postprocessed in its own worker process.
+Timing and any errors for every task are written to 'depletion_results/postprocess_report.json',
+and pairs whose depletion results haven't changed since the last successful run are skipped.
+"""
+
+import os
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from run_all_cases import CASES
 
 from barc_blanket.utilities import working_directory
 from barc_blanket.materials.blanket_depletion import postprocess_coupled_depletion, plot_results
 from barc_blanket.models.barc_model_final import BLANKET_MATERIAL_ID
 
-for case, config in CASES.items():
+RESULTS_DIRECTORY = "depletion_results"
+REPORT_FILE = f"{RESULTS_DIRECTORY}/postprocess_report.json"
+# Either of the alternatives in a tuple will do, the compact results are only there if the full ones were removed
+INPUT_FILES = [("depletion_results.h5", "depletion_results_compact.h5"), "materials.xml"]
+
+# option name: (remove_C14, results file, plot name suffix, print name suffix)
+OPTIONS = {
+    'with_C14': (False, 'waste_classification_results.pkl', "", ""),
+    'no_C14': (True, 'waste_classification_results_no_C14.pkl', "_no_C14", " (no C14)"),
+}
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Postprocess every depletion case in parallel")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("-f", "--force", action="store_true", help="Postprocess every case even if its inputs are unchanged")
+    return parser.parse_args()
+
+def _input_signature(case):
+    """Size and modification time of each input file of a case, or None if any are missing"""
+    signature = {}
+    for alternatives in INPUT_FILES:
+        if isinstance(alternatives, str):
+            alternatives = (alternatives,)
+        existing = [input_file for input_file in alternatives if os.path.exists(f"{RESULTS_DIRECTORY}/{case}/{input_file}")]
+        if len(existing) == 0:
+            return None
+        stat = os.stat(f"{RESULTS_DIRECTORY}/{case}/{existing[0]}")
+        signature[existing[0]] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+def postprocess_case(case, option):
+    """Postprocess a single case with a single option, returning a report of how it went"""
+    remove_C14, results_file, plot_suffix, name_suffix = OPTIONS[option]
+
+    report = {'case': case,
+              'option': option,
+              'inputs': _input_signature(case),
+              'status': 'ok',
+              'error': None}
+
+    start_time = time.perf_counter()
     try:
-        with working_directory(f"depletion_results/{case}"):
-            postprocess_coupled_depletion(BLANKET_MATERIAL_ID, remove_C14=False)
-            plot_results(case, config['name'])
-            postprocess_coupled_depletion(BLANKET_MATERIAL_ID, remove_C14=True)
-            plot_results(f"{case}_no_C14", f"{config['name']} (no C14)")
-    except:
-        pass
+        with working_directory(f"{RESULTS_DIRECTORY}/{case}"):
+            postprocess_coupled_depletion(BLANKET_MATERIAL_ID, remove_C14=remove_C14, results_file=results_file)
+            plot_results(f"{case}{plot_suffix}", f"{CASES[case]['name']}{name_suffix}", results_file=results_file)
+    except Exception:
+        report['status'] = 'failed'
+        report['error'] = traceback.format_exc()
+    report['wall_time_seconds'] = time.perf_counter() - start_time
+
+    return report
+
+def main():
+    args = _parse_args()
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+
+    if os.path.exists(REPORT_FILE):
+        with open(REPORT_FILE, 'r') as f:
+            previous_report = json.load(f)
+    else:
+        previous_report = {}
+
+    report = {}
+    tasks = []
+    for case in CASES:
+        for option, (_, results_file, _, _) in OPTIONS.items():
+            task_name = f"{case}/{option}"
+            inputs = _input_signature(case)
+            previous = previous_report.get(task_name)
+
+            if inputs is None:
+                report[task_name] = {'case': case, 'option': option, 'inputs': None,
+                                     'status': 'missing inputs', 'error': None, 'wall_time_seconds': 0.0}
+            elif (not args.force
+                  and previous is not None
+                  and previous['status'] in ('ok', 'skipped')
+                  and previous['inputs'] == inputs
+                  and os.path.exists(f"{RESULTS_DIRECTORY}/{case}/{results_file}")):
+                report[task_name] = dict(previous, status='skipped')
+            else:
+                tasks.append((case, option))
+
+    print(f"Postprocessing {len(tasks)} tasks, skipping {len(report)}")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(postprocess_case, case, option): f"{case}/{option}" for case, option in tasks}
+        for future in as_completed(futures):
+            task_name = futures[future]
+            task_report = future.result()
+            report[task_name] = task_report
+            print(f"{task_name}: {task_report['status']} in {task_report['wall_time_seconds']:0.1f} s")
+
+            # Write after every task so the report is useful even if the run is interrupted
+            with open(REPORT_FILE, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    with open(REPORT_FILE, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    failed = [task_name for task_name, task_report in report.items() if task_report['status'] == 'failed']
+    for task_name in failed:
+        print(f"\n{task_name} failed:\n{report[task_name]['error']}")
+    print(f"{len(failed)} of {len(report)} tasks failed, see {REPORT_FILE}")
 
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 import matplotlib as mpl
 from barc_blanket.utilities import working_directory
 from barc_blanket.models.barc_model_simple_toroidal import make_model
+from barc_blanket.models.model_cache import cached_make_model
 
 # Create a place to put all the files we'll be working with for depletion
 with working_directory("independent_vessel_activation"):
@@ -13,9 +14,8 @@ with working_directory("independent_vessel_activation"):
                     "particles": 1000,
                     "slurry_ratio": 0,
                     "section_angle": 10,}
-    model = make_model(model_config)
-    # Save model as xml
-    model.export_to_model_xml()
+    # Saves the model as xml, or reuses the one from a previous run with the same config
+    model = cached_make_model(make_model, model_config)
 
     rerun_depletion = True
     times = np.geomspace(0.01, 365, 100)
@@ -49,7 +49,7 @@ with working_directory("independent_vessel_activation"):
     plt.plot(activity_times, blanket_vessel_activities[1], label="Blanket Vessel")
     plt.legend(loc='right')
     plt.xlabel("Time [days]")
-    plt.ylabel("Activity [Bq]")
+    plt.ylabel("Activity [Bq/cm3]")
     plt.title("Vessel Activation")
     plt.yscale('symlog', linthresh=1e12)
     plt.xlim(0, max(activity_times))
@@ -2,6 +2,7 @@ import openmc
 import openmc.model
 import openmc.deplete
 from barc_blanket.vessel_activation import run_independent_vessel_decay, extract_activities, extract_decay_heat
+from barc_blanket.depletion_results import DepletionResultsView
 import os
 import numpy as np
 import pandas as pd
@@ -81,9 +82,11 @@ with working_directory("independent_vessel_decay"):
 
     plt.rcParams.update(mpl.rcParamsDefault)
 
-    heat_times, blanket_vessel_decay_heat = extract_decay_heat(decay_model, "blanket_vessel_cell")
-    heat_times, vacuum_vessel_decay_heat = extract_decay_heat(decay_model, "vacuum_vessel_cell")
-    heat_times, first_wall_decay_heat = extract_decay_heat(decay_model, "first_wall_cell")
+    # Read the results once for all three cells
+    decay_view = DepletionResultsView("depletion_results.h5")
+    heat_times, blanket_vessel_decay_heat = extract_decay_heat(decay_model, "blanket_vessel_cell", view=decay_view)
+    heat_times, vacuum_vessel_decay_heat = extract_decay_heat(decay_model, "vacuum_vessel_cell", view=decay_view)
+    heat_times, first_wall_decay_heat = extract_decay_heat(decay_model, "first_wall_cell", view=decay_view)
 
     # Convert times to days
     heat_times_days = np.array(heat_times) / (60*60*24)
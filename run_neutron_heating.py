@@ -4,6 +4,7 @@ import openmc
 from barc_blanket.models.barc_model_simple_toroidal import make_model, DEFAULT_PARAMETERS
 from barc_blanket.models.barc_model_tungsten_cooling_channel import make_model_tungsten_cooling
 from barc_blanket.utilities import working_directory
+from barc_blanket.tally_results import read_layer_heating
 
 JOULES_PER_EV = 1.60218e-19
 SOURCE_PARTICLES_PER_GW = 3.55e20
@@ -29,36 +30,13 @@ with working_directory("neutron_heating"):
                                         "cooling_vessel_thickness": 0.3,
                                         })
 
-    model.run()
-    final_statepoint = openmc.StatePoint("statepoint.20.h5")
+    final_statepoint = openmc.StatePoint(model.run())
 
-    # Get tally results
-    # TODO: do this programmatically instead of hardcoded here
-    tallies = final_statepoint.tallies
-
-    neutron_heating_first_wall_id = 3
-    neutron_heating_first_wall_ev = tallies[neutron_heating_first_wall_id].mean[0][0][0]
-    neutron_heating_first_wall_joules = neutron_heating_first_wall_ev * JOULES_PER_EV
-    neutron_heating_first_wall_watts_per_gw = neutron_heating_first_wall_joules * SOURCE_PARTICLES_PER_GW
-    print(f"First wall total neutron heating: {neutron_heating_first_wall_watts_per_gw/1e6} MW/GW")
-
-    neutron_heating_vacuum_vessel_id = 4
-    neutron_heating_vacuum_vessel_ev = tallies[neutron_heating_vacuum_vessel_id].mean[0][0][0]
-    neutron_heating_vacuum_vessel_joules = neutron_heating_vacuum_vessel_ev * JOULES_PER_EV
-    neutron_heating_vacuum_vessel_watts_per_gw = neutron_heating_vacuum_vessel_joules * SOURCE_PARTICLES_PER_GW
-    print(f"Vacuum vessel neutron heating: {neutron_heating_vacuum_vessel_watts_per_gw/1e6} MW/GW")
-
-    neutron_heating_cooling_channel_id = 5
-    neutron_heating_cooling_channel_ev = tallies[neutron_heating_cooling_channel_id].mean[0][0][0]
-    neutron_heating_cooling_channel_joules = neutron_heating_cooling_channel_ev * JOULES_PER_EV
-    neutron_heating_cooling_channel_watts_per_gw = neutron_heating_cooling_channel_joules * SOURCE_PARTICLES_PER_GW
-    print(f"Cooling channel neutron heating: {neutron_heating_cooling_channel_watts_per_gw/1e6} MW/GW")
-
-    neutron_heating_cooling_vessel_id = 6
-    neutron_heating_cooling_vessel_ev = tallies[neutron_heating_cooling_vessel_id].mean[0][0][0]
-    neutron_heating_cooling_vessel_joules = neutron_heating_cooling_vessel_ev * JOULES_PER_EV
-    neutron_heating_cooling_vessel_watts_per_gw = neutron_heating_cooling_vessel_joules * SOURCE_PARTICLES_PER_GW
-    print(f"Cooling vessel neutron heating: {neutron_heating_cooling_vessel_watts_per_gw/1e6} MW/GW")
+    # Heating of every layer in one read, whichever tally layout the model uses
+    for layer, neutron_heating_ev in read_layer_heating(final_statepoint).items():
+        neutron_heating_joules = neutron_heating_ev * JOULES_PER_EV
+        neutron_heating_watts_per_gw = neutron_heating_joules * SOURCE_PARTICLES_PER_GW
+        print(f"{layer.replace('_', ' ').capitalize()} neutron heating: {neutron_heating_watts_per_gw/1e6} MW/GW")
 
     
     # TODO do some volume weighting or whatever to get an actual TBR
@@ -0,0 +1,170 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from barc_blanket.materials.blanket_depletion import sums_of_fractions_above, classifying, _refresh_restart_rates, _AdaptiveStepping
+from barc_blanket.depletion_results import SECONDS_PER_DAY
+
+class _SavingIntegrator:
+    """Stands in for openmc.deplete.Integrator, saving results at the same indices its integrate loop does"""
+
+    def __init__(self, operator, timesteps, source_rates):
+        self.operator = operator
+        self.timesteps = np.asarray(timesteps)
+        self.source_rates = np.asarray(source_rates)
+        self._i_res = 0
+        self.saved_steps = []
+
+    def __iter__(self):
+        return zip(self.timesteps, self.source_rates)
+
+    def __len__(self):
+        return len(self.timesteps)
+
+    def __call__(self, n, rates, dt, source_rate, _i=None):
+        return 0.0, [n, n + 1.0], [None]
+
+    def integrate(self):
+        n = np.zeros((1, 2))
+        for i, (dt, source_rate) in enumerate(self):
+            _, n_list, _ = self(n, None, dt, source_rate, i)
+            n = n_list[-1]
+            self.saved_steps.append(self._i_res + i)
+        # The final compositions
+        self.saved_steps.append(self._i_res + len(self))
+
+class _StoppingClassifier:
+    """Says to stop after a given step"""
+
+    material_id = '1'
+
+    def __init__(self, stop_step):
+        self.stop_step = stop_step
+        self.steps = []
+
+    def classify(self, step, time_seconds, nuclides, atoms, volume):
+        self.steps.append(step)
+        return step == self.stop_step
+
+class _RefreshedOperator:
+    """Stands in for an IndependentOperator continuing from previous results, recording when it is evaluated"""
+
+    def __init__(self, prev_res):
+        self.prev_res = prev_res
+        self.calls = []
+
+    def initial_condition(self):
+        return [np.array([1.0, 2.0])]
+
+    def __call__(self, vec, source_rate):
+        self.calls.append((vec, source_rate))
+        return SimpleNamespace(k=None, rates=np.full((1, 2, 1), 3.0 * source_rate))
+
+class _StubCECMIntegrator:
+    """Stands in for openmc.deplete.CECMIntegrator, recording the predictor solves and the steps integrate runs"""
+
+    def __init__(self, operator, timesteps, source_rates, timestep_units):
+        self.operator = operator
+        self.timesteps = timesteps
+        self.source_rates = source_rates
+        self.predictor_steps = []
+
+    def __call__(self, n, rates, dt, source_rate, _i=None):
+        return 0.0, [n, n], [None]
+
+    def _timed_deplete(self, n, rates, dt):
+        self.predictor_steps.append(dt)
+        return 0.0, n
+
+    def integrate(self):
+        n = [np.ones(2)]
+        steps = [dt for i, (dt, source_rate) in enumerate(self) if self(n, None, dt, source_rate, i)]
+        return steps, len(self)
+
+def adaptive_integrator(errors, total_days, initial_step_days, max_step_days=None):
+    """_AdaptiveStepping over the stub integrator, with the error of each step given up front"""
+    errors = iter(errors)
+    integrator_class = type("StubAdaptiveIntegrator", (_AdaptiveStepping, _StubCECMIntegrator),
+                            {'_local_error': lambda self, n_predictor, n_corrector: next(errors)})
+    number = SimpleNamespace(index_nuc={'Li6': 0, 'H3': 1}, n_nuc_burn=2)
+    return integrator_class(SimpleNamespace(number=number), total_days, 1.0, initial_step_days,
+                            tolerance=1e-3, tracked_nuclides=['H3'], max_step_days=max_step_days)
+
+class TestSumsOfFractionsAbove:
+
+    def test_needs_consecutive_steps(self):
+        """Ensure the run only stops after both sums are above the threshold for enough steps in a row"""
+        condition = sums_of_fractions_above(threshold=10, consecutive_steps=3)
+
+        def record(table_1, table_2):
+            return {'table_1_sum_of_fractions': table_1, 'table_2_sum_of_fractions': table_2}
+
+        history = [record(20, 20), record(20, 5), record(20, 20), record(20, 20)]
+        assert not condition(history)
+
+        history.append(record(11, 12))
+        assert condition(history)
+
+        assert not condition(history[:2])
+
+class TestClassifyingIntegrator:
+
+    def test_early_stop_saves_only_steps_run(self):
+        """Ensure stopping early leaves no empty steps and saves the final compositions right after the last step run"""
+        number = SimpleNamespace(index_mat={'1': 0}, burnable_nuclides=['Li6', 'Li7'], volume=[1.0])
+        operator = SimpleNamespace(number=number, prev_res=None)
+        classifier = _StoppingClassifier(stop_step=2)
+
+        integrator = classifying(_SavingIntegrator)(operator, [1.0, 2.0, 3.0, 4.0, 5.0], [1.0]*5, classifier=classifier)
+        integrator.integrate()
+
+        assert classifier.steps == [1, 2]
+        assert integrator.saved_steps == [0, 1, 2]
+        assert len(integrator) == 2
+        assert list(integrator.timesteps) == [1.0, 2.0]
+
+class TestRefreshRestartRates:
+
+    def test_first_continued_step_evaluates_operator(self):
+        """Ensure the operator is evaluated at the previous compositions and its rates replace the stored ones,
+        scaled so the integrator's source rate scaling gives back the refreshed rates"""
+        stale_rates = np.zeros((1, 2, 1))
+        last_result = SimpleNamespace(rates=[stale_rates], source_rate=2.0)
+        operator = _RefreshedOperator(prev_res=[SimpleNamespace(), last_result])
+
+        _refresh_restart_rates(operator, 4.0)
+
+        assert len(operator.calls) == 1
+        assert operator.calls[0][1] == 4.0
+        assert np.allclose(operator.calls[0][0][0], [1.0, 2.0])
+
+        # What the integrator uses for the first continued step
+        restart_rates = last_result.rates[0] * 4.0 / last_result.source_rate
+        assert np.allclose(restart_rates, 12.0)
+
+class TestAdaptiveStepping:
+
+    def test_steps_follow_error(self):
+        """Ensure each step grows or shrinks by the clipped factor, steps over the tolerance are kept,
+        the steps never pass the longest allowed and add up to the total"""
+        # No error grows 5x, far over the tolerance shrinks 5x, at the tolerance shrinks to 0.9x,
+        # far under grows 5x at most
+        integrator = adaptive_integrator([0.0, 1e-1, 1e-3, 1e-5, 0.0, 0.0], total_days=10, initial_step_days=1, max_step_days=3)
+
+        steps, length = integrator.integrate()
+
+        expected_days = [1, 3, 0.6, 0.54, 2.7, 10 - (1 + 3 + 0.6 + 0.54 + 2.7)]
+        assert np.allclose(np.array(steps) / SECONDS_PER_DAY, expected_days)
+        assert np.allclose(np.array(integrator.timesteps) / SECONDS_PER_DAY, expected_days)
+        assert length == len(expected_days)
+        assert integrator.predictor_steps == steps
+
+    def test_sliver_never_passes_max_step(self):
+        """Ensure a sliver at the end is merged into the last step, or split with it when merging would be too long"""
+        merged = adaptive_integrator([0.0, 0.0], total_days=3.5, initial_step_days=3)
+        steps, _ = merged.integrate()
+        assert np.allclose(np.array(steps) / SECONDS_PER_DAY, [3.5])
+
+        split = adaptive_integrator([0.0, 0.0, 0.0], total_days=3.5, initial_step_days=3, max_step_days=3)
+        steps, _ = split.integrate()
+        assert np.allclose(np.array(steps) / SECONDS_PER_DAY, [1.75, 1.75])
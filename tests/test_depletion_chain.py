@@ -0,0 +1,43 @@
+import os
+import openmc
+import openmc.deplete
+
+from barc_blanket.utilities import CHAIN_FILE
+from barc_blanket.depletion_chain import reduced_chain_file
+
+class TestReducedChainFile:
+
+    def test_reused_for_same_nuclides(self, tmp_path):
+        """Ensure the chain is only reduced once for the same nuclides and level, whatever the material"""
+        first_material = openmc.Material()
+        first_material.add_nuclide("Fe56", 0.9)
+        first_material.add_nuclide("Co59", 0.1)
+        first_material.depletable = True
+
+        second_material = openmc.Material()
+        second_material.add_nuclide("Co59", 0.5)
+        second_material.add_nuclide("Fe56", 0.5)
+        second_material.depletable = True
+
+        first_path = reduced_chain_file([first_material], 2, chain_file=CHAIN_FILE, cache_directory=str(tmp_path))
+        modified_time = os.stat(first_path).st_mtime_ns
+        second_path = reduced_chain_file([second_material], 2, chain_file=CHAIN_FILE, cache_directory=str(tmp_path))
+
+        assert first_path == second_path
+        assert os.stat(second_path).st_mtime_ns == modified_time
+
+        chain = openmc.deplete.Chain.from_xml(first_path)
+        assert "Fe56" in chain
+        assert "Co60" in chain
+
+    def test_level_changes_chain(self, tmp_path):
+        """Ensure a different level gives a different reduced chain"""
+        material = openmc.Material()
+        material.add_nuclide("Fe56", 1.0)
+        material.depletable = True
+
+        shallow_path = reduced_chain_file([material], 1, chain_file=CHAIN_FILE, cache_directory=str(tmp_path))
+        deep_path = reduced_chain_file([material], 3, chain_file=CHAIN_FILE, cache_directory=str(tmp_path))
+
+        assert shallow_path != deep_path
+        assert len(openmc.deplete.Chain.from_xml(shallow_path)) < len(openmc.deplete.Chain.from_xml(deep_path))
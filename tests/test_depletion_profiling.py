@@ -0,0 +1,59 @@
+import csv
+import json
+import time
+
+from barc_blanket.depletion_profiling import DepletionProfiler, profiled
+
+class _SleepingIntegrator:
+    """Stands in for the integrate loop of openmc.deplete.Integrator"""
+
+    def __init__(self, timesteps):
+        self.timesteps = timesteps
+
+    def __iter__(self):
+        return iter([(dt, 1.0) for dt in self.timesteps])
+
+    def _get_bos_data_from_operator(self, step_index, source_rate, n):
+        time.sleep(0.02)
+        return n, None
+
+    def _timed_deplete(self, n, rates, dt):
+        time.sleep(0.01)
+        return 0.01, n
+
+    def __call__(self, n, rates, dt, source_rate, _i=None):
+        _, n = self._timed_deplete(n, rates, dt / 2)
+        time.sleep(0.02)
+        return 0.01, [n], [None]
+
+    def integrate(self):
+        n = 0
+        for i, (dt, source_rate) in enumerate(self):
+            n, rates = self._get_bos_data_from_operator(i, source_rate, n)
+            self(n, rates, dt, source_rate, i)
+
+class TestDepletionProfiler:
+
+    def test_step_phases(self, tmp_path):
+        """Ensure each step gets its transport and depletion time and the sidecar files are written"""
+        profiler = DepletionProfiler(particles_per_transport=1000)
+        with profiler.phase('chain_reduction'):
+            time.sleep(0.01)
+
+        profiled(_SleepingIntegrator)([1.0, 2.0, 3.0], profiler=profiler).integrate()
+
+        assert len(profiler.steps) == 3
+        for step in profiler.steps:
+            assert step['transport_calls'] == 2
+            assert step['transport_seconds'] >= 0.04
+            assert step['depletion_seconds'] >= 0.01
+            assert step['step_seconds'] >= step['transport_seconds'] + step['depletion_seconds']
+            assert step['particles_per_second'] > 0
+        assert profiler.setup['chain_reduction'] >= 0.01
+
+        path = str(tmp_path / "depletion_performance")
+        profiler.write(path)
+        with open(f"{path}.json") as f:
+            assert json.load(f)['summary']['steps'] == 3
+        with open(f"{path}.csv") as f:
+            assert [float(row['dt_seconds']) for row in csv.DictReader(f)] == [1.0, 2.0, 3.0]
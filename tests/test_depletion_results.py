@@ -0,0 +1,200 @@
+import h5py
+import numpy as np
+import pytest
+import openmc
+import openmc.data
+import openmc.deplete
+import openmc.stats
+
+from barc_blanket.depletion_results import read_material_atoms, material_from_atoms, split_results_by_material, write_results, DepletionResultsView, strip_nan_steps, photon_line_matrix
+from barc_blanket.depletion_results import compact_results, read_checkpoint_atoms, select_tracked_nuclides
+
+def write_fake_results(path, atoms, times, material_ids, nuclides, volumes):
+    """Write a file with the same layout openmc.deplete uses for depletion_results.h5
+    atoms has shape (steps, materials, nuclides)"""
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('number', data=atoms[:, np.newaxis, :, :])
+        f.create_dataset('time', data=np.column_stack([times, np.append(times[1:], times[-1])]))
+        f.create_dataset('source_rate', data=np.ones((len(times), 1)))
+        materials_group = f.create_group('materials')
+        for i, (material_id, volume) in enumerate(zip(material_ids, volumes)):
+            material_group = materials_group.create_group(str(material_id))
+            material_group.attrs['index'] = i
+            material_group.attrs['volume'] = volume
+        nuclides_group = f.create_group('nuclides')
+        for i, nuclide in enumerate(nuclides):
+            nuclides_group.create_group(nuclide).attrs['atom number index'] = i
+
+class TestReadMaterialAtoms:
+
+    def test_reads_single_material(self, tmp_path):
+        """Ensure only the requested material is read, with nuclides in index order"""
+        path = str(tmp_path / "depletion_results.h5")
+        atoms = np.arange(2*3*4, dtype=float).reshape(2, 3, 4)
+        times = np.array([0.0, 10.0])
+        # Deliberately out of alphabetical order
+        nuclides = ['O16', 'H1', 'Sr90', 'Cs137']
+        write_fake_results(path, atoms, times, [7, 12, 3], nuclides, [1.0, 2.0, 3.0])
+
+        read_times, read_nuclides, read_atoms, volume = read_material_atoms(12, path)
+
+        assert np.allclose(read_times, times)
+        assert read_nuclides == nuclides
+        assert np.allclose(read_atoms, atoms[:, 1, :])
+        assert volume == pytest.approx(2.0)
+
+class TestMaterialFromAtoms:
+
+    def test_atom_densities(self):
+        """Ensure atoms are converted to atom/b-cm and nuclides without atoms are skipped"""
+        material = material_from_atoms(['H1', 'O16', 'Sr90'], np.array([2e24, 1e24, 0.0]), 2.0)
+
+        densities = material.get_nuclide_atom_densities()
+        assert densities['H1'] == pytest.approx(1.0)
+        assert densities['O16'] == pytest.approx(0.5)
+        assert 'Sr90' not in densities
+
+class TestSplitResultsByMaterial:
+
+    def test_split_matches_original(self, tmp_path):
+        """Ensure each split file holds just its material's atoms under the new ID"""
+        path = str(tmp_path / "depletion_results.h5")
+        atoms = np.random.default_rng(42).random((3, 2, 4))
+        times = np.array([0.0, 10.0, 20.0])
+        nuclides = ['H1', 'O16', 'Sr90', 'Cs137']
+        write_fake_results(path, atoms, times, [1, 2], nuclides, [5.0, 6.0])
+
+        outputs = {1: (str(tmp_path / "first.h5"), 11),
+                   2: (str(tmp_path / "second.h5"), 11)}
+        split_results_by_material(path, outputs)
+
+        for original_index, (output_path, new_material_id) in enumerate(outputs.values()):
+            read_times, read_nuclides, read_atoms, volume = read_material_atoms(new_material_id, output_path)
+            assert np.allclose(read_times, times)
+            assert read_nuclides == nuclides
+            assert np.allclose(read_atoms, atoms[:, original_index, :])
+            assert volume == pytest.approx([5.0, 6.0][original_index])
+
+class TestWriteResults:
+
+    def test_round_trip(self, tmp_path):
+        """Ensure written atoms are read back for each material"""
+        path = str(tmp_path / "depletion_results.h5")
+        atoms = np.random.default_rng(7).random((4, 2, 3))
+        times = np.array([0.0, 1.0, 10.0, 100.0])
+        nuclides = ['Co60', 'Fe55', 'Mn54']
+
+        write_results(path, times, [3, 8], [2.0, 4.0], nuclides, atoms)
+
+        for i, material_id in enumerate([3, 8]):
+            read_times, read_nuclides, read_atoms, _ = read_material_atoms(material_id, path)
+            assert np.allclose(read_times, times)
+            assert read_nuclides == nuclides
+            assert np.allclose(read_atoms, atoms[:, i, :])
+
+    def test_loads_with_openmc(self, tmp_path):
+        """Ensure openmc.deplete.Results reads the same times, volumes and atoms that were written"""
+        path = str(tmp_path / "depletion_results.h5")
+        atoms = np.random.default_rng(11).random((3, 2, 2))
+        times = np.array([0.0, 3600.0, 86400.0])
+
+        write_results(path, times, [3, 8], [2.0, 4.0], ['Co60', 'Fe55'], atoms)
+        results = openmc.deplete.Results(path)
+
+        assert len(results) == len(times)
+        assert results[-1].volume == {'3': 2.0, '8': 4.0}
+        for i, material_id in enumerate(['3', '8']):
+            for j, nuclide in enumerate(['Co60', 'Fe55']):
+                read_times, read_atoms = results.get_atoms(material_id, nuclide)
+                assert np.allclose(read_times, times)
+                assert np.allclose(read_atoms, atoms[:, i, j])
+
+class TestDepletionResultsView:
+
+    def test_atoms_and_nan_strip(self, tmp_path):
+        """Ensure atoms are sliced per material and NaN steps are removed in bulk"""
+        path = str(tmp_path / "depletion_results.h5")
+        atoms = np.arange(3*2*2, dtype=float).reshape(3, 2, 2)
+        times = np.array([5.0, 15.0, 25.0])
+        write_results(path, times, [4, 9], [1.0, 1.0], ['Co60', 'Fe55'], atoms)
+
+        view = DepletionResultsView(path)
+
+        assert np.allclose(view.atoms(9), atoms[:, 1, :])
+        assert np.allclose(view.nuclide_atoms(4, ['Fe55'])['Fe55'], atoms[:, 0, 1])
+
+        stripped_times, stripped_values = strip_nan_steps(view.times, np.array([np.nan, 2.0, 3.0]))
+        assert np.allclose(stripped_times, [0.0, 10.0])
+        assert np.allclose(stripped_values, [2.0, 3.0])
+
+    def test_material_ids_in_results_order(self, tmp_path):
+        """Ensure material IDs follow their index in the results rather than the sorted group names"""
+        path = str(tmp_path / "depletion_results.h5")
+        material_ids = [2, 10, 1]
+        atoms = np.ones((2, 3, 1))
+        write_results(path, np.array([0.0, 1.0]), material_ids, [1.0]*3, ['Co60'], atoms)
+
+        view = DepletionResultsView(path)
+
+        assert view.material_ids == ['2', '10', '1']
+
+class TestPhotonLineMatrix:
+
+    def test_matches_combined_spectrum(self, monkeypatch):
+        """Ensure the matrix product gives the same lines as combining each nuclide's spectrum"""
+        sources = {'Co60': openmc.stats.Discrete([1.17e6, 1.33e6], [4.2e-9, 4.2e-9]),
+                   'Cs137': openmc.stats.Discrete([6.62e5, 1.33e6], [6.4e-10, 1.0e-12]),
+                   'Fe56': None}
+        monkeypatch.setattr(openmc.data, 'decay_photon_energy', lambda nuclide: sources[nuclide])
+
+        nuclides = ['Fe56', 'Co60', 'Cs137']
+        energies, matrix = photon_line_matrix(nuclides)
+        atoms = np.array([1e24, 2e10, 3e12])
+        intensities = matrix @ atoms
+
+        assert np.allclose(energies, [6.62e5, 1.17e6, 1.33e6])
+        assert np.allclose(intensities, [3e12*6.4e-10, 2e10*4.2e-9, 2e10*4.2e-9 + 3e12*1.0e-12])
+
+class TestCompactResults:
+
+    def test_tracked_and_checkpoints(self, tmp_path):
+        """Ensure tracked nuclides are kept at every step and every nuclide at the checkpoints"""
+        path = str(tmp_path / "depletion_results.h5")
+        compact_path = str(tmp_path / "depletion_results_compact.h5")
+        atoms = np.random.default_rng(3).random((5, 2, 4))
+        times = np.arange(5, dtype=float)
+        nuclides = ['H1', 'O16', 'Sr90', 'Cs137']
+        write_fake_results(path, atoms, times, [1, 2], nuclides, [1.0, 2.0])
+
+        compact_results(path, compact_path, ['Cs137', 'H1'], checkpoint_steps=[0, -1])
+
+        read_times, read_nuclides, read_atoms, volume = read_material_atoms(2, compact_path)
+        assert np.allclose(read_times, times)
+        assert read_nuclides == ['H1', 'Cs137']
+        assert np.allclose(read_atoms, atoms[:, 1, [0, 3]])
+        assert volume == pytest.approx(2.0)
+
+        checkpoint_times, checkpoint_nuclides, checkpoint_atoms, _ = read_checkpoint_atoms(1, compact_path)
+        assert np.allclose(checkpoint_times, [0.0, 4.0])
+        assert checkpoint_nuclides == nuclides
+        assert np.allclose(checkpoint_atoms, atoms[[0, 4], 0, :])
+
+    def test_select_tracked_nuclides(self, tmp_path, monkeypatch):
+        """Ensure the most active nuclides, the abundant ones and the extra ones are tracked"""
+        path = str(tmp_path / "depletion_results.h5")
+        nuclides = ['H1', 'O16', 'Co60', 'Sr90', 'Cs137']
+        decay_constants = {'H1': 0.0, 'O16': 0.0, 'Co60': 4.2e-9, 'Sr90': 7.6e-10, 'Cs137': 7.3e-10}
+        monkeypatch.setattr(openmc.data, 'decay_constant', lambda nuclide: decay_constants[nuclide])
+        monkeypatch.setattr(openmc.data, 'zam', lambda nuclide: (1, 1, 0))
+
+        # Co60 is only active in the second material at the last step
+        atoms = np.zeros((3, 2, 5))
+        atoms[:, :, 0] = 1e24
+        atoms[:, :, 1] = 1e10
+        atoms[:, :, 3] = 1e5
+        atoms[2, 1, 2] = 1e12
+        write_fake_results(path, atoms, np.arange(3, dtype=float), [1, 2], nuclides, [1.0, 1.0])
+
+        tracked = select_tracked_nuclides(path, extra_nuclides=['Cs137'], top_activity=1, atom_fraction=1e-9)
+
+        assert tracked == ['H1', 'Co60', 'Cs137']
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from barc_blanket.irradiation_history import IrradiationHistory, Campaign, Outage, DutyCycle
+
+class TestIrradiationHistory:
+
+    def test_short_cycles_are_averaged(self):
+        """Ensure short cycles become one averaged step with the last cycle kept as it is"""
+        history = IrradiationHistory([DutyCycle(on_days=9, off_days=1, cycles=100)])
+
+        timesteps_days, source_rates = history.steps(full_source_rate=1e20, resolve_days=30)
+
+        assert np.allclose(timesteps_days, [990, 9, 1])
+        assert np.allclose(source_rates, [0.9e20, 1e20, 0])
+        assert np.sum(timesteps_days) == pytest.approx(history.duration_days)
+
+        # Same neutron fluence as running every cycle
+        assert np.sum(timesteps_days * source_rates) == pytest.approx(100 * 9 * 1e20)
+
+    def test_long_cycles_are_kept(self):
+        """Ensure cycles longer than resolve_days aren't averaged"""
+        history = IrradiationHistory([DutyCycle(on_days=300, off_days=65, cycles=3)])
+
+        timesteps_days, source_rates = history.steps(full_source_rate=1.0, resolve_days=30)
+
+        assert np.allclose(timesteps_days, [300, 65] * 3)
+        assert np.allclose(source_rates, [1, 0] * 3)
+
+    def test_merge_and_split(self):
+        """Ensure neighbouring periods at the same power merge and long periods split"""
+        history = IrradiationHistory([Campaign(100), Campaign(100), Outage(30), Outage(20), Campaign(50, power_fraction=0.5)])
+
+        timesteps_days, source_rates = history.steps(full_source_rate=2.0, max_step_days=80)
+
+        assert np.allclose(timesteps_days, [200/3]*3 + [50] + [50])
+        assert np.allclose(source_rates, [2, 2, 2, 0, 1])
@@ -0,0 +1,56 @@
+import os
+
+from barc_blanket.models.barc_model_simple_toroidal import make_model
+from barc_blanket.models.model_cache import cached_make_model, model_config_key, package_dependencies
+from barc_blanket.models.materials import flibe
+from barc_blanket.utilities import file_fingerprint
+
+make_model_calls = []
+
+def counting_make_model(new_model_config=None):
+    make_model_calls.append(new_model_config)
+    return make_model(new_model_config)
+
+# Uses the DEFAULT_PARAMETERS of the simple toroidal model
+counting_make_model.__module__ = make_model.__module__
+
+class TestModelCache:
+
+    def test_repeat_config_reuses_model(self, tmp_path):
+        """Ensure a repeated configuration copies the cached model.xml instead of making the model again"""
+        cache_directory = tmp_path / "cache"
+        config = {'batches': 2, 'particles': 100, 'section_angle': 10}
+        make_model_calls.clear()
+
+        first_path = str(tmp_path / "first.xml")
+        second_path = str(tmp_path / "second.xml")
+        cached_make_model(counting_make_model, config, model_path=first_path, cache_directory=cache_directory)
+        model = cached_make_model(counting_make_model, config, model_path=second_path, cache_directory=cache_directory)
+
+        assert len(make_model_calls) == 1
+        assert file_fingerprint(first_path) == file_fingerprint(second_path)
+        assert len(os.listdir(cache_directory)) == 1
+        assert any(cell.name == 'blanket_cell' for cell in model.geometry.get_all_cells().values())
+
+    def test_key_depends_on_config(self):
+        """Ensure the key changes with any setting, defaults fill in missing settings, and materials are compared by composition"""
+        key = model_config_key(make_model, {'section_angle': 10})
+
+        assert model_config_key(make_model, {'section_angle': 10}) == key
+        assert model_config_key(make_model, {'section_angle': 20}) != key
+        assert model_config_key(make_model, None) == model_config_key(make_model, {'section_angle': 45})
+
+        flibe_material = flibe()
+        material_key = model_config_key(make_model, {'extra_material': flibe_material})
+        flibe_material.set_density('g/cm3', 1.0)
+        assert model_config_key(make_model, {'extra_material': flibe_material}) != material_key
+
+    def test_dependencies_outside_models(self):
+        """Ensure the modules outside barc_blanket/models that a model is built with are part of the key"""
+        final_paths = package_dependencies('barc_blanket.models.barc_model_final')
+        for module_path in [('barc_blanket', 'multigroup.py'), ('barc_blanket', 'tally_results.py'), ('models', 'materials.py')]:
+            assert any(path.endswith(os.path.join(*module_path)) for path in final_paths)
+
+        simple_paths = package_dependencies('barc_blanket.models.barc_model_simple_toroidal')
+        assert any(path.endswith(os.path.join('materials', 'waste_classification.py')) for path in simple_paths)
+        assert not any(path.endswith('multigroup.py') for path in simple_paths)
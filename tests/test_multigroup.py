@@ -0,0 +1,119 @@
+from types import SimpleNamespace
+
+import h5py
+import numpy as np
+import pytest
+import openmc
+
+import barc_blanket.multigroup as multigroup
+from barc_blanket.models.materials import flibe, tungsten
+from barc_blanket.multigroup import mgxs_library_key, response_cross_sections, multigroup_estimates, MultigroupEstimator, RESPONSE_SCORES
+
+class FakeStatePoint:
+    """Just enough of an openmc.StatePoint for reading one tally"""
+
+    def __init__(self, tally):
+        self.tally = tally
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def get_tally(self, name):
+        return self.tally
+
+class TestMgxsLibraryKey:
+
+    def test_key_ignores_volume(self):
+        """Ensure a library is reused across geometries, which only change the volumes of the materials,
+        but not across compositions"""
+        materials = [flibe(), tungsten()]
+        key = mgxs_library_key(materials)
+
+        materials[0].volume = 1234.0
+        assert mgxs_library_key(materials) == key
+
+        materials[1].set_density('g/cm3', 1.0)
+        assert mgxs_library_key(materials) != key
+        assert mgxs_library_key(materials, group_structure='CASMO-8') != mgxs_library_key(materials)
+
+class TestMultigroupEstimates:
+
+    def test_response_cross_sections(self):
+        """Ensure the reference tally is split by material then group, and divided by the flux"""
+        # 2 materials, 3 groups, flux then one rate per score, as (bins, nuclides, scores) like Tally.mean
+        flux = np.array([[1.0, 2.0, 0.0], [4.0, 5.0, 6.0]])
+        xs = np.arange(2*3*len(RESPONSE_SCORES), dtype=float).reshape(2, 3, len(RESPONSE_SCORES)) + 1.0
+        mean = np.concatenate([flux[..., np.newaxis], flux[..., np.newaxis] * xs], axis=-1)
+        tally = SimpleNamespace(mean=mean.reshape(2*3, 1, len(RESPONSE_SCORES) + 1))
+
+        response_xs = response_cross_sections(tally, 2, 3)
+
+        assert response_xs.shape == (2, 3, len(RESPONSE_SCORES))
+        assert np.allclose(response_xs[0, :2], xs[0, :2])
+        assert np.allclose(response_xs[0, 2], 0.0)
+        assert np.allclose(response_xs[1], xs[1])
+
+    def test_fold_flux_with_responses(self, tmp_path, monkeypatch):
+        """Ensure each cell's group flux is folded with the response cross sections of its material,
+        and the TBR is the (n,Xt) rate of the breeding cells"""
+        library_path = str(tmp_path / "mgxs.h5")
+        response_xs = {'material_1': np.array([[1.0, 10.0], [2.0, 20.0]]),
+                       'material_2': np.array([[0.5, 1.0], [0.0, 3.0]])}
+        with h5py.File(multigroup.responses_path(library_path), 'w') as f:
+            for name, xs in response_xs.items():
+                f.create_dataset(name, data=xs)
+
+        cells = {11: SimpleNamespace(name='blanket_cell', fill=SimpleNamespace(name='material_1')),
+                 12: SimpleNamespace(name='cooling_channel_cell', fill=SimpleNamespace(name='material_1')),
+                 13: SimpleNamespace(name='first_wall_cell', fill=SimpleNamespace(name='material_2'))}
+        model = SimpleNamespace(geometry=SimpleNamespace(get_all_cells=lambda: cells),
+                                materials=SimpleNamespace(cross_sections=library_path))
+
+        flux = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+        tally = SimpleNamespace(mean=flux.reshape(6, 1, 1),
+                                find_filter=lambda filter_type: SimpleNamespace(bins=[11, 12, 13]))
+        monkeypatch.setattr(openmc, 'StatePoint', lambda path: FakeStatePoint(tally))
+
+        estimates = multigroup_estimates(model, "statepoint.h5")
+
+        assert estimates['(n,Xt)'] == pytest.approx({'blanket_cell': 5.0, 'cooling_channel_cell': 11.0, 'first_wall_cell': 2.5})
+        assert estimates['heating'] == pytest.approx({'blanket_cell': 50.0, 'cooling_channel_cell': 110.0, 'first_wall_cell': 23.0})
+        assert estimates['tbr'] == pytest.approx(16.0)
+
+class TestMultigroupEstimator:
+
+    def test_check_cadence(self, tmp_path, monkeypatch):
+        """Ensure the first estimate and every check_interval-th after it are checked in continuous energy"""
+        monkeypatch.setattr('barc_blanket.models.barc_model_final.make_model',
+                            lambda model_config: SimpleNamespace(run=lambda: "statepoint.h5"))
+        monkeypatch.setattr(multigroup, 'multigroup_estimates', lambda model, statepoint_path: {'tbr': 1.0})
+
+        checked = []
+        monkeypatch.setattr(MultigroupEstimator, 'check',
+                            lambda self, model_config, estimates: checked.append(self.estimates))
+
+        estimator = MultigroupEstimator(check_interval=3, directory=str(tmp_path))
+        for _ in range(7):
+            estimator.estimate()
+
+        assert checked == [0, 3, 6]
+
+    def test_check_warns_past_tolerance(self, tmp_path, monkeypatch):
+        """Ensure a check records the difference from continuous energy and only warns past the tolerance"""
+        continuous_energy_tbr = 1.0
+        monkeypatch.setattr('barc_blanket.models.barc_model_final.make_model',
+                            lambda model_config: SimpleNamespace(run=lambda: "statepoint.h5"))
+        monkeypatch.setattr(openmc, 'StatePoint', lambda path: FakeStatePoint(None))
+        monkeypatch.setattr(multigroup, 'read_tbr', lambda statepoint: continuous_energy_tbr)
+
+        estimator = MultigroupEstimator(tolerance=0.02, directory=str(tmp_path))
+
+        assert estimator.check({}, {'tbr': 1.01}) == pytest.approx(0.01)
+
+        with pytest.warns(UserWarning, match="Multigroup TBR"):
+            estimator.check({}, {'tbr': 1.1})
+
+        assert [check['relative_difference'] for check in estimator.checks] == pytest.approx([0.01, 0.1])
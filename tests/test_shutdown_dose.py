@@ -0,0 +1,180 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import openmc
+import openmc.lib
+
+from barc_blanket.shutdown_dose import torus_section_mesh, write_dose_vtk, torus_layers, layer_path_lengths, group_photon_sources, dose_maps
+from barc_blanket.shutdown_dose import depleted_compositions, positive_densities, _depleted_step_response
+from barc_blanket.models.barc_model_simple_toroidal import make_model, DEFAULT_PARAMETERS
+
+class TestGroupPhotonSources:
+
+    def test_lines_summed_into_groups(self):
+        """Ensure line intensities are summed into their groups and lines outside the groups are dropped"""
+        group_boundaries = np.array([1e4, 1e5, 1e6, 1e7])
+        energies = np.array([5e3, 2e4, 5e4, 6e5, 1e6, 2e7])
+        intensities = np.array([[1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                                [0.0, 1.0, 0.0, 0.0, 0.0, 0.0]])
+
+        group_sources = group_photon_sources(energies, intensities, group_boundaries)
+
+        assert np.allclose(group_sources, [[5.0, 4.0, 5.0],
+                                           [1.0, 0.0, 0.0]])
+
+class TestDoseMaps:
+
+    def test_superposition(self):
+        """Ensure the dose is the source-weighted sum of the responses of every cell and group"""
+        rng = np.random.default_rng(42)
+        response = rng.random((2, 3, 5))
+        group_sources = rng.random((4, 2, 3))
+
+        dose = dose_maps(response, group_sources)
+
+        assert dose.shape == (4, 5)
+        for step in range(4):
+            expected = sum(group_sources[step, c, g] * response[c, g] for c in range(2) for g in range(3))
+            assert np.allclose(dose[step], expected)
+
+class _RecordingMaterial:
+    """Stands in for an openmc.lib.Material, recording what set_densities is called with"""
+
+    def __init__(self):
+        self.calls = []
+
+    def set_densities(self, nuclides, densities):
+        self.calls.append((list(nuclides), np.array(densities)))
+
+class TestDepletedDoseMaps:
+
+    def test_compositions_and_positive_densities(self):
+        """Ensure nuclides never present or without data are left out, atoms become atom/b-cm,
+        and each step only sets the positive densities"""
+        atoms = np.array([[1e24, 0.0, 0.0, 5e23],
+                          [1e24, 2e22, -1e10, 5e23],
+                          [1e24, 4e22, 0.0, 5e23]])
+        results = SimpleNamespace(volumes={'3': 2.0}, nuclides=['Fe56', 'Co60', 'Mn54', 'Xx99'],
+                                  atoms=lambda material_id: atoms)
+
+        nuclides, densities = depleted_compositions(results, [3], {'Fe56', 'Co60', 'Mn54'})[3]
+
+        assert nuclides == ['Fe56', 'Co60']
+        assert np.allclose(densities, 1e-24 * atoms[:, :2] / 2.0)
+
+        step_nuclides, step_densities = positive_densities(['Fe56', 'Co60', 'Mn54'], [0.5, 0.0, -1e-30])
+        assert step_nuclides == ['Fe56']
+        assert np.allclose(step_densities, [0.5])
+
+    def test_step_response_split_by_born_cell(self, monkeypatch):
+        """Ensure each step sets only positive densities, and the tally split by born cell
+        is scaled by the number of cells to the dose per photon emitted in each cell"""
+        material = _RecordingMaterial()
+        calls = []
+        mean = np.arange(6.0).reshape(6, 1, 1)
+        monkeypatch.setattr(openmc.lib, 'materials', {3: material})
+        monkeypatch.setattr(openmc.lib, 'tallies', {9: SimpleNamespace(mean=mean)})
+        monkeypatch.setattr(openmc.lib, 'reset', lambda: calls.append('reset'))
+        monkeypatch.setattr(openmc.lib, 'run', lambda: calls.append('run'))
+
+        compositions = {3: (['Fe56', 'Co60'], np.array([[0.1, 0.0], [0.1, 0.02]]))}
+        response = _depleted_step_response(compositions, 0, 9, n_cells=2)
+
+        assert material.calls[0][0] == ['Fe56']
+        assert np.allclose(material.calls[0][1], [0.1])
+        assert calls == ['reset', 'run']
+        assert np.allclose(response, 2 * np.array([[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]))
+
+class TestTorusSectionMesh:
+
+    def test_mesh_covers_section(self):
+        """Ensure the mesh spans the outermost torus and the section angle with fewer voxels than the old regular mesh"""
+        model = make_model({'section_angle': 10})
+
+        mesh = torus_section_mesh(model, radial_width=5.0, vertical_width=5.0)
+
+        outer_minor_radius = (DEFAULT_PARAMETERS['plasma_minor_radius'] + DEFAULT_PARAMETERS['sol_width']
+                              + DEFAULT_PARAMETERS['first_wall_thickness'] + DEFAULT_PARAMETERS['vacuum_vessel_thickness']
+                              + DEFAULT_PARAMETERS['cooling_channel_width'] + DEFAULT_PARAMETERS['cooling_vessel_thickness']
+                              + DEFAULT_PARAMETERS['blanket_width'] + DEFAULT_PARAMETERS['blanket_vessel_thickness'])
+        major_radius = DEFAULT_PARAMETERS['major_radius']
+
+        assert np.isclose(mesh.r_grid[0], major_radius - outer_minor_radius)
+        assert np.isclose(mesh.r_grid[-1], major_radius + outer_minor_radius)
+        assert np.isclose(mesh.z_grid[-1], outer_minor_radius)
+        assert np.allclose(mesh.phi_grid, [0, np.radians(10)])
+        assert np.all(np.diff(mesh.r_grid) <= 5.0)
+        assert np.prod(mesh.dimension) < 100*10*100 / 4
+
+    def test_offset_elongated_tori(self):
+        """Ensure the mesh covers every torus when they sit on different major radii and are elongated"""
+        plasma = openmc.ZTorus(a=450, b=150, c=100)
+        vessel = openmc.ZTorus(a=465, b=200, c=130)
+        model = openmc.Model(geometry=openmc.Geometry([openmc.Cell(region=-plasma),
+                                                      openmc.Cell(region=+plasma & -vessel)]))
+
+        mesh = torus_section_mesh(model, radial_width=5.0, vertical_width=5.0, margin=10.0)
+
+        assert np.isclose(mesh.r_grid[0], 465 - 130 - 10)
+        assert np.isclose(mesh.r_grid[-1], 465 + 130 + 10)
+        assert np.isclose(mesh.z_grid[0], -210)
+        assert np.isclose(mesh.z_grid[-1], 210)
+
+class TestLayerPathLengths:
+
+    def test_midplane_and_axis(self):
+        """Ensure segments through the torus are split between the layers by their exact crossings"""
+        starts = np.array([[0, 0, 0], [0, 0, 0], [450, 0, -300]])
+        ends = np.array([[1000, 0, 0], [0, 0, 1000], [450, 0, 300]])
+
+        lengths = layer_path_lengths(starts, ends, major_radius=450, boundaries=[100, 200])
+
+        assert np.allclose(lengths, [[200, 200, 600],
+                                     [0, 0, 1000],
+                                     [200, 200, 200]])
+
+class TestTorusLayers:
+
+    def test_simple_toroidal_layers(self):
+        """Ensure the layers of the simple toroidal model are found with their minor radii"""
+        model = make_model({'section_angle': 10})
+        cells = {cell.name: cell for cell in model.geometry.get_all_cells().values()}
+
+        major_radius, layers = torus_layers(cells.values())
+
+        assert major_radius == DEFAULT_PARAMETERS['major_radius']
+        assert layers[cells['plasma_cell']] == (0.0, DEFAULT_PARAMETERS['plasma_minor_radius'])
+        assert layers[cells['blanket_vessel_cell']][1] - layers[cells['blanket_vessel_cell']][0] \
+               == pytest.approx(DEFAULT_PARAMETERS['blanket_vessel_thickness'])
+        assert layers[cells['bounding_sphere_cell']][1] == np.inf
+
+    def test_unsupported_tori(self):
+        """Ensure elliptical tori and tori on different major radii are refused rather than misread"""
+        inner = openmc.ZTorus(a=450, b=100, c=100)
+
+        elliptical = openmc.Cell(region=+inner & -openmc.ZTorus(a=450, b=160, c=120))
+        with pytest.raises(ValueError, match="elliptical"):
+            torus_layers([elliptical])
+
+        offset = openmc.Cell(region=+inner & -openmc.ZTorus(a=480, b=150, c=150))
+        with pytest.raises(ValueError, match="major radii"):
+            torus_layers([offset])
+
+class TestWriteDoseVtk:
+
+    def test_cylindrical_mesh(self, tmp_path):
+        """Ensure the VTK file has a vertex for every grid point and a value for every voxel"""
+        mesh = openmc.CylindricalMesh(r_grid=[100, 200, 300], phi_grid=[0, 0.1], z_grid=[-50, 0, 50, 100])
+        dose_rate = np.arange(2*1*3, dtype=float)
+        filename = tmp_path / "dose.vtk"
+
+        write_dose_vtk(dose_rate, mesh, filename)
+
+        with open(filename, 'rb') as f:
+            contents = f.read()
+        assert b"DIMENSIONS 3 2 4" in contents
+        assert b"POINTS 24 float" in contents
+        assert b"CELL_DATA 6" in contents
+        values = np.frombuffer(contents[-(6*4 + 1):-1], dtype='>f4')
+        assert np.allclose(values, dose_rate)
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from barc_blanket.tally_results import HEATING_LAYERS, read_layer_heating, read_tbr, read_first_cell_tbr
+
+class FakeTally:
+    """Just enough of an openmc.Tally for the readers"""
+
+    def __init__(self, name, mean, scores=None):
+        self.name = name
+        self.mean = np.asarray(mean, dtype=float)
+        self.scores = scores
+
+    def get_values(self, scores):
+        return self.mean[..., [self.scores.index(score) for score in scores]]
+
+def fake_statepoint(tallies):
+    return SimpleNamespace(tallies={i + 1: tally for i, tally in enumerate(tallies)})
+
+class TestTallyResults:
+
+    def test_layouts_agree(self):
+        """Ensure the heating of every layer and the TBR read the same from the separate and consolidated layouts"""
+        heating = np.arange(1.0, len(HEATING_LAYERS) + 1)
+        # Two breeding cells with two energy bins each
+        flux_tbr = np.array([[[10.0, 0.1]], [[20.0, 0.2]], [[30.0, 0.3]], [[40.0, 0.4]]])
+
+        separate = fake_statepoint([FakeTally("flux_blanket", flux_tbr[..., :1]),
+                                    FakeTally("TBR", [[[0.3]], [[0.7]]])]
+                                   + [FakeTally(f"neutron_heating_{layer}", [[[value]]])
+                                      for layer, value in zip(HEATING_LAYERS, heating)])
+        consolidated = fake_statepoint([FakeTally("flux_tbr_blanket", flux_tbr, scores=['flux', '(n,Xt)']),
+                                        FakeTally("neutron_heating", heating.reshape(-1, 1, 1))])
+
+        assert read_layer_heating(separate) == read_layer_heating(consolidated)
+        assert read_layer_heating(consolidated) == dict(zip(HEATING_LAYERS, heating))
+        assert read_tbr(separate) == pytest.approx(1.0)
+        assert read_tbr(consolidated) == pytest.approx(1.0)
+
+    def test_first_cell_tbr(self):
+        """Ensure the optimiser's metric is still the first bin of the TBR tally, under either tally name"""
+        for name in ["TBR", "tbr"]:
+            statepoint = fake_statepoint([FakeTally(name, [[[0.3]], [[0.7]]])])
+            assert read_first_cell_tbr(statepoint) == pytest.approx(0.3)
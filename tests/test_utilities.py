@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from barc_blanket.utilities import atomic_write, cache_directory, REPOSITORY_DIRECTORY
+
+class TestAtomicWrite:
+
+    def test_replaces_when_done(self, tmp_path):
+        """Ensure the file only changes once the block finishes, creating its directory, with no temporary file left"""
+        path = str(tmp_path / "cache" / "entry.txt")
+
+        with atomic_write(path) as temporary_path:
+            with open(temporary_path, 'w') as f:
+                f.write("new")
+            assert not os.path.exists(path)
+
+        with open(path) as f:
+            assert f.read() == "new"
+        assert os.listdir(tmp_path / "cache") == ["entry.txt"]
+
+    def test_keeps_original_on_error(self, tmp_path):
+        """Ensure a failed write leaves the existing file as it was and removes the temporary file"""
+        path = str(tmp_path / "entry.txt")
+        with open(path, 'w') as f:
+            f.write("old")
+
+        with pytest.raises(RuntimeError):
+            with atomic_write(path) as temporary_path:
+                with open(temporary_path, 'w') as f:
+                    f.write("partial")
+                raise RuntimeError("failed while writing")
+
+        with open(path) as f:
+            assert f.read() == "old"
+        assert os.listdir(tmp_path) == ["entry.txt"]
+
+class TestCacheDirectory:
+
+    def test_environment_overrides(self, tmp_path, monkeypatch):
+        """Ensure the environment variable is used when set, otherwise the name at the top of the repository"""
+        monkeypatch.delenv('BARC_TEST_CACHE', raising=False)
+        assert cache_directory('test_cache', 'BARC_TEST_CACHE') == os.path.join(REPOSITORY_DIRECTORY, 'test_cache')
+
+        monkeypatch.setenv('BARC_TEST_CACHE', str(tmp_path))
+        assert cache_directory('test_cache', 'BARC_TEST_CACHE') == str(tmp_path)
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import openmc
+import openmc.data
+import openmc.deplete
+from openmc.deplete.cram import CRAM48
+
+from barc_blanket.depletion_results import write_results, DepletionResultsView
+from barc_blanket.vessel_activation import extract_activities, _decay_matrix
+
+CO60_HALF_LIFE = 1.663e8
+
+def cobalt_chain():
+    """Chain where Co60 decays to stable Ni60 and also has a capture that decay must not pick up"""
+    cobalt = openmc.deplete.Nuclide('Co60')
+    cobalt.half_life = CO60_HALF_LIFE
+    cobalt.add_decay_mode('beta-', 'Ni60', 1.0)
+    cobalt.add_reaction('(n,gamma)', 'Ni60', 0.0, 1.0)
+
+    chain = openmc.deplete.Chain()
+    chain.add_nuclide(cobalt)
+    chain.add_nuclide(openmc.deplete.Nuclide('Ni60'))
+    return chain
+
+class TestDecayMatrix:
+
+    def test_decay_only(self):
+        """Ensure the matrix only has the decay constants, in the order of the given nuclides,
+        and nuclides missing from the chain neither decay nor are fed"""
+        decay_constant = np.log(2) / CO60_HALF_LIFE
+
+        matrix = _decay_matrix(cobalt_chain(), ['Ni60', 'H1', 'Co60'])
+
+        assert np.allclose(matrix.toarray(), [[0.0, 0.0, decay_constant],
+                                              [0.0, 0.0, 0.0],
+                                              [0.0, 0.0, -decay_constant]])
+
+    def test_cram_half_life(self):
+        """Ensure decaying for one half-life with CRAM48 halves Co60 and the rest becomes Ni60"""
+        matrix = _decay_matrix(cobalt_chain(), ['Co60', 'Ni60', 'H1'])
+
+        atoms = CRAM48(matrix, np.array([1e20, 0.0, 5e19]), CO60_HALF_LIFE)
+
+        assert atoms == pytest.approx([5e19, 5e19, 5e19], rel=1e-10)
+
+class TestExtractActivities:
+
+    def test_activity_per_volume(self, tmp_path, monkeypatch):
+        """Ensure the activity is λN/V in Bq/cm3 by default like Results.get_activity, and λN with units='Bq'"""
+        decay_constants = {'Co60': 4.17e-9, 'Fe56': 0.0}
+        monkeypatch.setattr(openmc.data, 'decay_constant', lambda nuclide: decay_constants[nuclide])
+
+        path = str(tmp_path / "depletion_results.h5")
+        atoms = np.array([[[0.0, 1e24]], [[2e18, 1e24]]])
+        times = np.array([0.0, 86400.0])
+        write_results(path, times, [7], [250.0], ['Co60', 'Fe56'], atoms)
+
+        vessel_material = openmc.Material(material_id=7)
+        model = SimpleNamespace(_cells_by_name={'blanket_vessel_cell': [SimpleNamespace(fill=vessel_material)]})
+        view = DepletionResultsView(path)
+
+        times_days, (times_seconds, activities) = extract_activities(model, view=view)
+
+        assert np.allclose(times_days, [0.0, 1.0])
+        assert np.allclose(times_seconds, times)
+        assert activities == pytest.approx([0.0, 4.17e-9 * 2e18 / 250.0])
+
+        _, (_, total_activities) = extract_activities(model, view=view, units='Bq')
+        assert total_activities == pytest.approx([0.0, 4.17e-9 * 2e18])
@@ -2,6 +2,7 @@ import openmc
 import pytest
 
 from barc_blanket.materials.waste_classification import check_class_c, sum_of_fractions, separate_nuclides, make_activity_volume_density
+from barc_blanket.materials.waste_classification import cached_sum_of_fractions, composition_fingerprint, clear_classification_cache, save_classification_cache, load_classification_cache
 
 class TestCheckClassC:
 
@@ -46,6 +47,46 @@ class TestSumOfFractions:
         # Ensure the sum of fractions is about 0.83, indicating it is class-B waste
         assert sum_of_fractions_result == pytest.approx(0.83, rel=0.01), f"Expected sum of fractions to be about 0.83 but got {sum_of_fractions_result:0.2f}"
 
+class TestCachedSumOfFractions:
+
+    def test_matches_uncached(self):
+        """Ensure the cached sum of fractions is the same as calculating it directly, on both a miss and a hit"""
+        clear_classification_cache()
+        material = make_activity_volume_density({'Sr90': 50, 'Cs137': 22})
+
+        expected_result, expected_fractions = sum_of_fractions(material, 2, 2)
+        miss_result, miss_fractions = cached_sum_of_fractions(material, 2, 2)
+        hit_result, hit_fractions = cached_sum_of_fractions(material, 2, 2)
+
+        assert miss_result == pytest.approx(expected_result), f"Expected {expected_result:0.2f} but got {miss_result:0.2f}"
+        assert hit_result == pytest.approx(expected_result), f"Expected {expected_result:0.2f} but got {hit_result:0.2f}"
+        assert hit_fractions == expected_fractions
+
+    def test_fingerprint_ignores_name_but_not_options(self):
+        """Two identical compositions share a fingerprint, but different tables or columns do not"""
+        material_a = make_activity_volume_density({'Sr90': 50})
+        material_a.name = 'a'
+        material_b = make_activity_volume_density({'Sr90': 50})
+        material_b.name = 'b'
+
+        assert composition_fingerprint(material_a, 2, 3) == composition_fingerprint(material_b, 2, 3)
+        assert composition_fingerprint(material_a, 2, 3) != composition_fingerprint(material_a, 2, 2)
+        assert composition_fingerprint(material_a, 1, None) != composition_fingerprint(material_a, 1, None, remove_C14=True)
+
+    def test_disk_round_trip(self, tmp_path):
+        """Ensure a saved cache can be loaded back and gives the same answer"""
+        clear_classification_cache()
+        material = make_activity_volume_density({'Sr90': 50, 'Cs137': 22})
+        expected_result, _ = cached_sum_of_fractions(material, 2, 1)
+
+        cache_file = str(tmp_path / "classification_cache.pkl")
+        save_classification_cache(cache_file)
+        clear_classification_cache()
+        load_classification_cache(cache_file)
+
+        loaded_result, _ = cached_sum_of_fractions(material, 2, 1)
+        assert loaded_result == pytest.approx(expected_result), f"Expected {expected_result:0.2f} but got {loaded_result:0.2f}"
+
 class TestSeparateNuclides:
 
     def test_simple_density_change(self):